@@ -0,0 +1,129 @@
+"""
+Responsive derivatives (WebP/AVIF at several widths) of landing page images.
+
+build_responsive_images writes them under RESPONSIVE_IMAGES_ROOT together with
+a manifest; the {% responsive_img %} tag reads the manifest to emit srcset markup.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from PIL import Image, ImageOps, features
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# Pillow encoder options per output format
+ENCODERS = {
+    'avif': {'quality': 55, 'speed': 6},
+    'webp': {'quality': 78, 'method': 6},
+}
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def available_formats():
+    # AVIF needs Pillow >= 11.3 (or pillow-avif-plugin); skip it when unsupported
+    return [fmt for fmt in settings.RESPONSIVE_IMAGE_FORMATS if features.check(fmt)]
+
+
+def manifest_path():
+    return Path(settings.RESPONSIVE_IMAGES_ROOT) / MANIFEST_NAME
+
+
+def read_manifest():
+    try:
+        with open(manifest_path()) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(manifest):
+    path = manifest_path()
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_sources():
+    # (static path, absolute path, widths) for every configured source image
+    for directory, widths in settings.RESPONSIVE_IMAGES.items():
+        root = finders.find(directory)
+        if not root:
+            continue
+        for name in sorted(os.listdir(root)):
+            if name.lower().endswith(SOURCE_EXTENSIONS):
+                yield f"{directory}/{name}", os.path.join(root, name), widths
+
+
+def build_derivatives(static_path, source, widths, formats, digest):
+    """
+    Encode ``source`` at each width (never upscaled) in each format. Filenames
+    carry the source digest, so a changed source never reuses a cached URL.
+    """
+    out_root = Path(settings.RESPONSIVE_IMAGES_ROOT)
+    stem = os.path.splitext(static_path)[0]
+    variants = []
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        targets = sorted({min(width, image.width) for width in widths})
+        for width in targets:
+            height = round(image.height * width / image.width)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                name = f"{stem}.{digest[:10]}.{width}w.{fmt}"
+                target = out_root / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                resized.save(target, format=fmt.upper(), **ENCODERS[fmt])
+                variants.append({
+                    'format': fmt,
+                    'width': width,
+                    'height': height,
+                    'path': f"{settings.RESPONSIVE_IMAGES_PREFIX}/{name}",
+                    'bytes': target.stat().st_size,
+                })
+    return variants
+
+
+def remove_variants(entry):
+    out_root = Path(settings.RESPONSIVE_IMAGES_ROOT)
+    for variant in entry.get('variants', []):
+        relative = variant['path'][len(settings.RESPONSIVE_IMAGES_PREFIX) + 1:]
+        try:
+            (out_root / relative).unlink()
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache(maxsize=4)
+def _load_manifest(mtime):
+    return read_manifest()
+
+
+def get_manifest():
+    # Re-read only when build_responsive_images has rewritten the file
+    try:
+        mtime = manifest_path().stat().st_mtime
+    except FileNotFoundError:
+        return {}
+    return _load_manifest(mtime)
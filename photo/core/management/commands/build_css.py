@@ -0,0 +1,35 @@
+import shlex
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# (config, output) per stylesheet; outputs land in STATICFILES_DIRS for collectstatic
+BUILDS = [
+    ('tailwind.config.js', 'static/css/landing.css'),
+    ('tailwind.critical.config.js', 'static/css/landing-critical.css'),
+]
+INPUT = 'assets/tailwind.css'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile the purged, minified Tailwind stylesheet for the Django templates and the "
+        "critical (hero) subset inlined by {% compiled_css %}. Run before collectstatic. "
+        "Needs the Tailwind v3 CLI (TAILWIND_COMMAND)."
+    )
+
+    def handle(self, *args, **options):
+        command = shlex.split(settings.TAILWIND_COMMAND)
+        for config, output in BUILDS:
+            args = command + ['-c', config, '-i', INPUT, '-o', output, '--minify']
+            try:
+                result = subprocess.run(args, cwd=settings.BASE_DIR, capture_output=True, text=True)
+            except FileNotFoundError:
+                raise CommandError(f"Tailwind CLI not found: {settings.TAILWIND_COMMAND!r} (set TAILWIND_COMMAND)")
+            if result.returncode != 0:
+                raise CommandError(f"{' '.join(args)} failed:\n{result.stderr}")
+            size = (settings.BASE_DIR / output).stat().st_size
+            self.stdout.write(f"{output}: {size / 1024:.1f} KiB")
+        self.stdout.write(self.style.SUCCESS("CSS built; run collectstatic to fingerprint it"))
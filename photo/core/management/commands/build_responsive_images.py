@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from core.images import (
+    available_formats, build_derivatives, file_digest, iter_sources, read_manifest,
+    remove_variants, write_manifest,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate WebP/AVIF derivatives of the images listed in RESPONSIVE_IMAGES at several "
+        "widths. Only sources whose content changed since the last run are re-encoded. "
+        "Run before collectstatic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild every source')
+
+    def handle(self, *args, **options):
+        formats = available_formats()
+        if not formats:
+            self.stderr.write("Pillow supports none of RESPONSIVE_IMAGE_FORMATS; nothing to do")
+            return
+
+        previous = read_manifest()
+        manifest = {}
+        built = skipped = 0
+        for static_path, source, widths in iter_sources():
+            digest = file_digest(source)
+            entry = previous.get(static_path)
+            if (
+                not options['force'] and entry
+                and entry['digest'] == digest
+                and entry['widths'] == list(widths)
+                and entry['formats'] == formats
+            ):
+                manifest[static_path] = entry
+                skipped += 1
+                continue
+
+            if entry:
+                remove_variants(entry)
+            variants = build_derivatives(static_path, source, widths, formats, digest)
+            manifest[static_path] = {
+                'digest': digest,
+                'widths': list(widths),
+                'formats': formats,
+                'variants': variants,
+            }
+            built += 1
+            self.stdout.write(f"{static_path}: {len(variants)} derivatives")
+
+        # Sources that were deleted or dropped from RESPONSIVE_IMAGES
+        for static_path in previous.keys() - manifest.keys():
+            remove_variants(previous[static_path])
+
+        write_manifest(manifest)
+        self.stdout.write(self.style.SUCCESS(
+            f"{built} rebuilt, {skipped} unchanged ({', '.join(formats)})"
+        ))
@@ -0,0 +1,147 @@
+"""
+In-process request metrics rendered in the Prometheus text format.
+
+Each web worker process keeps its own registry; scrape every worker (or run
+one metrics sidecar per process) to get the full picture.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request counters, set by RequestMetricsMiddleware
+current_request = ContextVar('current_request_metrics', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_seconds', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)  # (view, method, status) -> count
+        self.latency_buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.latency_sum = defaultdict(float)
+        self.latency_count = defaultdict(int)
+        self.counters = defaultdict(float)  # (metric, view) -> value
+        self.collectors = []
+
+    def observe_request(self, view, method, status, seconds, stats, response_bytes):
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            self.latency_buckets[view][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.latency_sum[view] += seconds
+            self.latency_count[view] += 1
+            self.counters[('db_queries_total', view)] += stats.queries
+            self.counters[('db_query_seconds_total', view)] += stats.query_seconds
+            self.counters[('cache_hits_total', view)] += stats.cache_hits
+            self.counters[('cache_misses_total', view)] += stats.cache_misses
+            if response_bytes is not None:
+                self.counters[('http_response_size_bytes_total', view)] += response_bytes
+
+    def register_collector(self, collector):
+        """
+        ``collector()`` returns an iterable of (name, type, help, value) tuples
+        and is called on every scrape. Used by other apps to export their gauges.
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP http_requests_total Requests by resolved view, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP http_request_duration_seconds Request latency by resolved view.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for view, buckets in sorted(self.latency_buckets.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {self.latency_count[view]}')
+                lines.append(f'http_request_duration_seconds_sum{{view="{view}"}} {self.latency_sum[view]}')
+                lines.append(f'http_request_duration_seconds_count{{view="{view}"}} {self.latency_count[view]}')
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE {name} counter')
+                for (metric, view), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{view="{view}"}} {value}')
+
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                # A broken collector (e.g. Redis down) must not break the whole scrape
+                continue
+            for name, kind, help_text, value in samples:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def record_query(seconds):
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+
+
+def record_cache(hits=0, misses=0):
+    stats = current_request.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+_MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    # Counts hits and misses of every cache read made while serving a request
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version=version)
+        if value is _MISSING:
+            record_cache(misses=1)
+            return default
+        record_cache(hits=1)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version=version)
+        record_cache(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    pass
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
@@ -0,0 +1,178 @@
+import mimetypes
+import os
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date
+
+from .metrics import RequestStats, current_request, record_query, registry
+
+
+def _timed_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_query(time.perf_counter() - started)
+
+
+def _install_query_timers():
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(_timed_query))
+    return stack
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, SQL query count/time, cache hits/misses and response size
+    per resolved view name (e.g. ``users:login``) into core.metrics.registry.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            with _install_query_timers():
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        # Connections are per thread: the wrappers go on the thread the async
+        # ORM runs this request's queries on
+        timers = await sync_to_async(_install_query_timers)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(timers.close)()
+            current_request.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, stats, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        registry.observe_request(view, request.method, response.status_code, elapsed, stats, size)
+
+
+class StaticAssetMiddleware:
+    """
+    Serves collected files from STATIC_ROOT, picking the ``.br``/``.gz``
+    sibling written by core.storage.CompressedManifestStaticFilesStorage when
+    the client accepts it. Hashed names (listed in the staticfiles manifest)
+    never change content, so they are cached as immutable for a year.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.root = os.path.realpath(settings.STATIC_ROOT)
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else f"/{settings.STATIC_URL}"
+        self._hashed_names = None
+
+    @property
+    def hashed_names(self):
+        # The manifest only changes with collectstatic, i.e. on deploy
+        if self._hashed_names is None:
+            self._hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        return self._hashed_names
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # serve() only stats and opens a file; FileResponse streams it asynchronously
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def resolve(self, name):
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def accepted_encodings(self, request):
+        accepted = set()
+        for part in request.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = part.partition(';')
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) == 0:
+                        continue  # explicitly refused
+                except ValueError:
+                    continue
+            accepted.add(coding.strip().lower())
+        return accepted
+
+    def serve(self, request, name):
+        path = self.resolve(name)
+        if path is None:
+            return None
+
+        served, encoding = path, None
+        accepted = self.accepted_encodings(request)
+        for coding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if coding in accepted and os.path.isfile(path + suffix):
+                served, encoding = path + suffix, coding
+                break
+
+        stat = os.stat(served)
+        etag = f'"{int(stat.st_mtime)}-{stat.st_size}-{encoding or "identity"}"'
+        if name in self.hashed_names:
+            cache_control = f"public, max-age={settings.STATIC_IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            cache_control = f"public, max-age={settings.STATIC_MAX_AGE}"
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            content_type, _ = mimetypes.guess_type(path)
+            response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+            response['Last-Modified'] = http_date(stat.st_mtime)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        response['Vary'] = 'Accept-Encoding'
+        return response
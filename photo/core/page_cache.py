@@ -0,0 +1,155 @@
+"""
+Whole-page cache for anonymous TemplateViews whose output only changes on deploy.
+
+Entries are keyed by a version made of DEPLOY_VERSION (or, when unset, the
+mtimes of the template and of those it extends or includes) and the
+staticfiles manifest hash, so a deploy or a template edit never serves stale
+HTML.
+"""
+import hashlib
+import logging
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.template.loader import get_template, select_template
+from django.template.loader_tags import ExtendsNode, IncludeNode
+from django.urls import resolve, reverse
+
+
+logger = logging.getLogger('core')
+
+
+def get_page_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+
+@lru_cache(maxsize=None)
+def template_paths(template_names):
+    """
+    Files a page is rendered from: the selected template plus every template
+    it extends or includes by a quoted name, recursively. Resolved once per
+    process; only the files' mtimes are checked per request. Templates chosen
+    by a variable at render time are not found, so pages using them need
+    DEPLOY_VERSION.
+    """
+    paths = []
+    pending = [select_template(list(template_names)).template]
+    while pending:
+        template = pending.pop()
+        if template.origin.name in paths:
+            continue
+        paths.append(template.origin.name)
+        for node in template.nodelist.get_nodes_by_type((ExtendsNode, IncludeNode)):
+            name = (node.parent_name if isinstance(node, ExtendsNode) else node.template).var
+            if isinstance(name, str):
+                pending.append(get_template(name).template)
+    return tuple(paths)
+
+
+def page_version(template_names):
+    if settings.DEPLOY_VERSION:
+        version = settings.DEPLOY_VERSION
+    else:
+        try:
+            mtimes = ':'.join(str(os.stat(path).st_mtime_ns) for path in template_paths(tuple(template_names)))
+            version = hashlib.sha256(mtimes.encode()).hexdigest()[:16]
+        except OSError:
+            version = 'unknown'
+    # {% static %} URLs change whenever collectstatic produces new hashes
+    manifest_hash = getattr(staticfiles_storage, 'manifest_hash', '')
+    return f"{version}:{manifest_hash}"
+
+
+def page_cache_key(path, template_names):
+    return f"page:{page_version(template_names)}:{path}"
+
+
+def page_etag(content):
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+class CachedPageMixin:
+    """
+    Serve a TemplateView from the page cache for anonymous GET/HEAD requests
+    without a query string. A matching If-None-Match is answered with 304
+    without rendering or even reading the cached body.
+    """
+    page_cache_timeout = None  # falls back to PAGE_CACHE_TIMEOUT
+
+    def cacheable(self, request):
+        return (
+            settings.PAGE_CACHE_ENABLED
+            and request.method in ('GET', 'HEAD')
+            and not request.GET
+            and not request.user.is_authenticated
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_page_cache()
+        key = page_cache_key(request.path, self.get_template_names())
+        etag = cache.get(f"{key}:etag")
+        if etag and etag_matches(request, etag):
+            return self.finalize(HttpResponseNotModified(), etag)
+
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return self.finalize(HttpResponse(content, content_type=content_type), etag or page_etag(content))
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        # Never cache errors or anything that sets cookies (CSRF, session)
+        if response.status_code != 200 or response.cookies:
+            return response
+
+        etag = page_etag(response.content)
+        timeout = self.page_cache_timeout if self.page_cache_timeout is not None else settings.PAGE_CACHE_TIMEOUT
+        cache.set_many({key: (response.content, response['Content-Type']), f"{key}:etag": etag}, timeout)
+        if etag_matches(request, etag):
+            return self.finalize(HttpResponseNotModified(), etag)
+        return self.finalize(response, etag)
+
+    def finalize(self, response, etag):
+        response['ETag'] = etag
+        # Browsers keep the page but revalidate every time; a 304 costs almost nothing
+        response['Cache-Control'] = 'public, no-cache'
+        return response
+
+
+def warm_page_cache():
+    """
+    Render every URL in PAGE_CACHE_WARM_URLS into the page cache. Returns the
+    paths warmed. Called on startup from photo.wsgi and photo.asgi: the
+    'pages' cache is per process, so only the worker itself can fill it.
+    """
+    warmed = []
+    for name in settings.PAGE_CACHE_WARM_URLS:
+        path = reverse(name)
+        request = HttpRequest()
+        request.method = 'GET'
+        request.path = request.path_info = path
+        request.META = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'}
+        request.user = AnonymousUser()
+        match = resolve(path)
+        try:
+            response = match.func(request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception(f"Page cache warm-up failed for {path}")
+            continue
+        if response.status_code == 200:
+            warmed.append(path)
+    return warmed
@@ -0,0 +1,68 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional; only .gz siblings are written without it
+    brotli = None
+
+
+# Formats worth compressing; images other than SVG are already compressed
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.xml', '.html', '.ico')
+
+# Keep a compressed sibling only if it saves at least this fraction
+MIN_SAVING = 0.05
+
+
+def compress_gzip(data):
+    # mtime=0 keeps the output byte-identical between collectstatic runs
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+ENCODINGS = [('br', '.br', compress_brotli if brotli else None), ('gzip', '.gz', compress_gzip)]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes ``.br``/``.gz`` siblings of
+    every compressible file, so core.middleware.StaticAssetMiddleware can
+    serve precompressed bytes without compressing per request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        # Both the original and the hashed name are served, so compress both
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.lower().endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                for compressed in self.compress(name):
+                    yield name, compressed, True
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        for _, suffix, encode in ENCODINGS:
+            if encode is None:
+                continue
+            compressed = encode(data)
+            target = path + suffix
+            if len(compressed) > len(data) * (1 - MIN_SAVING):
+                # Drop a sibling left over from an earlier, more compressible version
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            tmp = target + '.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(compressed)
+            os.replace(tmp, target)
+            yield name + suffix
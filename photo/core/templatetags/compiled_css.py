@@ -0,0 +1,59 @@
+from django import template
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+
+register = template.Library()
+
+# Used until `manage.py build_css` has produced the stylesheets
+TAILWIND_CDN = 'https://cdn.tailwindcss.com'
+
+
+# Stylesheets read so far. Misses are not kept, so files built after the
+# worker started are picked up without a restart.
+_static_files = {}
+
+
+def read_static(name):
+    # Source tree first (runserver), then the collected files; None if never built
+    if name not in _static_files:
+        content = load_static(name)
+        if content is None:
+            return None
+        _static_files[name] = content
+    return _static_files[name]
+
+
+def load_static(name):
+    path = finders.find(name)
+    if path:
+        with open(path, encoding='utf-8') as fh:
+            return fh.read()
+    if staticfiles_storage.exists(name):
+        with staticfiles_storage.open(name) as fh:
+            return fh.read().decode('utf-8')
+    return None
+
+
+@register.simple_tag
+def compiled_css(bundle):
+    """
+    Inline css/<bundle>-critical.css and load css/<bundle>.css without blocking
+    first paint. Both come from build_css; without them this falls back to the
+    Tailwind CDN runtime so an unbuilt checkout still renders.
+    """
+    critical = read_static(f'css/{bundle}-critical.css')
+    if critical is None or read_static(f'css/{bundle}.css') is None:
+        return format_html('<script src="{}"></script>', TAILWIND_CDN)
+
+    href = static(f'css/{bundle}.css')
+    return format_html(
+        '<style>{}</style>'
+        '<link rel="preload" href="{}" as="style">'
+        '<link rel="stylesheet" href="{}" media="print" onload="this.media=\'all\'">'
+        '<noscript><link rel="stylesheet" href="{}"></noscript>',
+        mark_safe(critical), href, href, href,
+    )
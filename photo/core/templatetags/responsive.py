@@ -0,0 +1,46 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from core.images import MIME_TYPES, get_manifest
+
+
+register = template.Library()
+
+
+def srcset(variants, fmt):
+    return ', '.join(
+        f"{static(variant['path'])} {variant['width']}w"
+        for variant in variants if variant['format'] == fmt
+    )
+
+
+@register.simple_tag
+def responsive_img(path, alt='', sizes='100vw', **attrs):
+    """
+    <picture> with AVIF/WebP srcsets from build_responsive_images and the
+    original as fallback. Without derivatives it renders a plain <img>.
+
+        {% responsive_img 'core/images/features/faculty.jpg' alt='Faculty' sizes='112px' class='...' %}
+    """
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    entry = get_manifest().get(path)
+
+    extra = format_html_join(' ', '{}="{}"', sorted(attrs.items()))
+    if not entry:
+        return format_html('<img src="{}" alt="{}" {}>', static(path), alt, extra)
+
+    # Intrinsic size from the source aspect ratio avoids layout shift
+    largest = max(entry['variants'], key=lambda v: v['width'])
+    img = format_html(
+        '<img src="{}" alt="{}" width="{}" height="{}" {}>',
+        static(path), alt, largest['width'], largest['height'], extra,
+    )
+
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[fmt], srcset(entry['variants'], fmt), sizes) for fmt in entry['formats']),
+    )
+    # display: contents keeps the <img> sizing against the parent, as before
+    return format_html('<picture class="contents">{}{}</picture>', sources, img)
@@ -1,3 +1,353 @@
-from django.test import TestCase
+import importlib.util
+import os
+import tempfile
+import threading
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection, router
+from django.http import HttpResponse, HttpResponseNotFound
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from photo.celery import reset_db_pinning
+from photo.db.pool import ConnectionPool, PoolTimeout
+from photo.db.routers import ReplicaPinningMiddleware, pin_to_primary, reset_pinning
+
+from .middleware import StaticAssetMiddleware
+from .page_cache import get_page_cache, page_version, template_paths
+from .templatetags.compiled_css import read_static
+
+
+# Run with: python manage.py test --settings=photo.settings_bench
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsViewTests(TestCase):
+    url = reverse('core:metrics')
+
+    def test_local_address_alone_is_refused(self):
+        # What every request looks like behind a local reverse proxy
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_matches_nothing(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_staff_user(self):
+        self.client.force_login(get_user_model().objects.create_superuser('ops@narayanagroup.com', 'Ops', 'x'))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class ReadStaticTests(TestCase):
+    def test_stylesheet_built_after_a_miss_is_found(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATICFILES_DIRS=[root]):
+            name = 'css/late-build.css'
+            self.assertIsNone(read_static(name))
+
+            os.makedirs(os.path.join(root, 'css'))
+            with open(os.path.join(root, name), 'w') as fh:
+                fh.write('body{}')
+            self.assertEqual(read_static(name), 'body{}')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def ping(self):
+        if not self.alive:
+            raise OSError('server has gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **options):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+
+        return ConnectionPool(connect, **{'size': 2, 'timeout': 0.05, **options})
+
+    def test_released_connection_is_reused(self):
+        pool = self.make_pool()
+        conn, fresh = pool.acquire()
+        self.assertTrue(fresh)
+        pool.release(conn)
+        self.assertEqual(pool.acquire(), (conn, False))
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual((pool.stats.in_use, pool.stats.idle, pool.stats.checkouts), (1, 0, 2))
+
+    def test_unusable_connection_is_closed(self):
+        pool = self.make_pool()
+        conn, _ = pool.acquire()
+        pool.release(conn, reusable=False)
+        self.assertTrue(conn.closed)
+        self.assertIsNot(pool.acquire()[0], conn)
+
+    def test_exhausted_pool_times_out(self):
+        pool = self.make_pool(size=1)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats.timeouts, 1)
+
+    def test_waiting_checkout_gets_the_released_connection(self):
+        pool = self.make_pool(size=1, timeout=5)
+        conn, _ = pool.acquire()
+        threading.Timer(0.05, pool.release, [conn]).start()
+        self.assertEqual(pool.acquire(), (conn, False))
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = ConnectionPool(mock.Mock(side_effect=OSError('refused')), size=1, timeout=0.05)
+        with self.assertRaises(OSError):
+            pool.acquire()
+        self.assertEqual(pool.stats.in_use, 0)
+
+    def test_dead_idle_connection_is_replaced(self):
+        pool = self.make_pool(ping_after=0)
+        conn, _ = pool.acquire()
+        pool.release(conn)
+        conn.alive = False
+        replacement, fresh = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(fresh)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats.ping_failures, 1)
+
+    def test_connection_past_max_lifetime_is_replaced(self):
+        pool = self.make_pool(max_lifetime=0)
+        conn, _ = pool.acquire()
+        pool.release(conn)
+        self.assertIsNot(pool.acquire()[0], conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats.ping_failures, 0)
+
+    def test_forked_process_starts_empty(self):
+        pool = self.make_pool()
+        held, _ = pool.acquire()
+        idle, _ = pool.acquire()
+        pool.release(idle)
+
+        with mock.patch('photo.db.pool.os.getpid', return_value=os.getpid() + 1):
+            conn, fresh = pool.acquire()
+            self.assertTrue(fresh)
+            self.assertIsNot(conn, idle)
+            # Sockets shared with the parent are dropped, never closed
+            pool.release(held)
+            self.assertFalse(idle.closed or held.closed)
+            self.assertEqual(pool.stats.idle, 0)
+
+
+@skipUnless(importlib.util.find_spec('MySQLdb'), 'needs mysqlclient')
+class PooledBackendTests(SimpleTestCase):
+    def test_pool_does_not_keep_the_first_wrapper(self):
+        from photo.db.backends.mysql.base import DatabaseWrapper
+        from photo.db.pool import _pools
+
+        settings_dict = {**connection.settings_dict, 'ENGINE': 'photo.db.backends.mysql', 'NAME': 'pooltest'}
+        self.addCleanup(_pools.pop, 'pool-test', None)
+        first = DatabaseWrapper(settings_dict, 'pool-test')
+        pool = first.pool
+        del first
+
+        with mock.patch('django.db.backends.mysql.base.Database.connect') as connect:
+            pool.acquire()
+        self.assertIsNone(getattr(pool.connect, '__self__', None))
+        self.assertEqual(connect.call_args.kwargs['database'], 'pooltest')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    # Queries that reach 'replica' fail the test; the routing itself is checked through the router
+
+    def setUp(self):
+        self.addCleanup(reset_pinning)
+        self.User = get_user_model()
+
+    def run_request(self, view, **cookies):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return ReplicaPinningMiddleware(view)(request)
+
+    def read_alias(self):
+        return router.db_for_read(self.User)
+
+    def test_read_after_a_write_in_the_same_request_goes_to_the_primary(self):
+        pin_to_primary()
+        user = self.User.objects.create_superuser('pin@narayanagroup.com', 'Pin', 'x')
+        reset_pinning()
+        seen = []
+
+        def view(request):
+            seen.append(self.read_alias())
+            self.User.objects.filter(pk=user.pk).update(is_active=True)
+            with CaptureQueriesContext(connection) as primary:
+                self.assertTrue(self.User.objects.filter(email='pin@narayanagroup.com').exists())
+            seen.append(len(primary))
+            return HttpResponse()
+
+        self.run_request(view)
+        self.assertEqual(seen, ['replica', 1])
+
+    def test_cookie_pins_the_next_request(self):
+        def write(request):
+            router.db_for_write(self.User)
+            return HttpResponse()
+
+        def read(request):
+            return HttpResponse(self.read_alias())
+
+        cookie = self.run_request(write).cookies[ReplicaPinningMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertEqual(self.run_request(read, db_primary_until=cookie.value).content, b'default')
+        self.assertEqual(self.run_request(read, db_primary_until='1').content, b'replica')
+        self.assertEqual(self.run_request(read, db_primary_until='garbage').content, b'replica')
+
+    def test_reads_leave_no_cookie(self):
+        response = self.run_request(lambda request: HttpResponse(self.read_alias()))
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+    def test_pinning_is_reset_between_requests(self):
+        def write(request):
+            router.db_for_write(self.User)
+            return HttpResponse()
+
+        self.run_request(write)
+        # Same thread and context, no cookie sent back
+        self.assertEqual(self.run_request(lambda request: HttpResponse(self.read_alias())).content, b'replica')
+
+    def test_pinning_is_reset_before_a_task(self):
+        task = mock.Mock()
+        task.request.is_eager = False
+        pin_to_primary()
+        reset_db_pinning(task=task)
+        self.assertEqual(self.read_alias(), 'replica')
+
+    def test_eager_task_keeps_the_callers_pinning(self):
+        task = mock.Mock()
+        task.request.is_eager = True
+        pin_to_primary()
+        reset_db_pinning(task=task)
+        self.assertEqual(self.read_alias(), 'default')
+
+
+class StaticAssetMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = os.path.join(tmp.name, 'static')
+        os.makedirs(os.path.join(root, 'css'))
+        for name, body in [('css/app.css', b'body{}'), ('css/app.css.br', b'br'), ('css/app.css.gz', b'gz'),
+                           ('css/app.0123abcd.css', b'body{}'), ('css/plain.css', b'p{}')]:
+            with open(os.path.join(root, name), 'wb') as fh:
+                fh.write(body)
+        with open(os.path.join(tmp.name, 'secret.txt'), 'w') as fh:
+            fh.write('secret')
+        os.symlink(os.path.join(tmp.name, 'secret.txt'), os.path.join(root, 'link.txt'))
+
+        overrides = override_settings(STATIC_ROOT=root, STATIC_URL='/static/', STATIC_MAX_AGE=300)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        storage = mock.patch('core.middleware.staticfiles_storage', hashed_files={'css/app.css': 'css/app.0123abcd.css'})
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.middleware = StaticAssetMiddleware(lambda request: HttpResponseNotFound())
+
+    def get(self, path, **headers):
+        return self.middleware(RequestFactory().get(path, headers=headers))
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_paths_outside_the_root_are_not_served(self):
+        for path in ('/static/../secret.txt', '/static/css/../../secret.txt', '/static/link.txt', '/static/css/'):
+            self.assertEqual(self.get(path).status_code, 404, path)
+
+    def test_brotli_then_gzip_when_accepted(self):
+        for accept, encoding, body in [('gzip, br', 'br', b'br'), ('gzip', 'gzip', b'gz'),
+                                       ('br;q=0, gzip;q=0.5', 'gzip', b'gz'), ('', None, b'body{}')]:
+            response = self.get('/static/css/app.css', accept_encoding=accept)
+            self.assertEqual(response.get('Content-Encoding'), encoding, accept)
+            self.assertEqual(self.body(response), body)
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_encodings_get_their_own_etag(self):
+        identity = self.get('/static/css/app.css')
+        brotli = self.get('/static/css/app.css', accept_encoding='br')
+        self.assertNotEqual(identity['ETag'], brotli['ETag'])
+
+        self.assertEqual(self.get('/static/css/app.css', if_none_match=identity['ETag']).status_code, 304)
+        not_modified = self.get('/static/css/app.css', accept_encoding='br', if_none_match=brotli['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Vary'], 'Accept-Encoding')
+        self.assertEqual(self.get('/static/css/app.css', accept_encoding='br', if_none_match=identity['ETag']).status_code, 200)
+
+    def test_only_hashed_names_are_immutable(self):
+        hashed = self.get('/static/css/app.0123abcd.css')
+        self.assertEqual(hashed['Cache-Control'], f"public, max-age={365 * 24 * 60 * 60}, immutable")
+        self.assertEqual(self.get('/static/css/plain.css')['Cache-Control'], 'public, max-age=300')
+
+
+@override_settings(PAGE_CACHE_ENABLED=True, DEPLOY_VERSION='')
+class PageCacheTests(TestCase):
+    url = reverse('core:landing')
+
+    def setUp(self):
+        get_page_cache().clear()
+        self.addCleanup(get_page_cache().clear)
+
+    def test_repeat_visit_is_answered_from_the_cache(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'public, no-cache')
+
+        with mock.patch('core.views.LandingView.get_context_data', side_effect=AssertionError('rendered')):
+            again = self.client.get(self.url)
+            self.assertEqual(again.content, first.content)
+            self.assertEqual(again['ETag'], first['ETag'])
+            self.assertEqual(self.client.get(self.url, headers={'If-None-Match': first['ETag']}).status_code, 304)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': '"stale"'}).status_code, 200)
+
+    def test_signed_in_users_and_query_strings_skip_the_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(f"{self.url}?ref=mail", headers={'If-None-Match': etag}).status_code, 200)
+
+        self.client.force_login(get_user_model().objects.create_superuser('ops@narayanagroup.com', 'Ops', 'x'))
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_editing_an_included_template_changes_the_version(self):
+        with tempfile.TemporaryDirectory() as root:
+            for name, body in [('page.html', '{% extends "base.html" %}'), ('base.html', '{% include "part.html" %}'),
+                               ('part.html', 'hello'), ('unused.html', '')]:
+                with open(os.path.join(root, name), 'w') as fh:
+                    fh.write(body)
+            templates = [{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'DIRS': [root]}]
+            with override_settings(TEMPLATES=templates):
+                template_paths.cache_clear()
+                self.addCleanup(template_paths.cache_clear)
+                self.assertEqual([os.path.basename(path) for path in template_paths(('page.html',))],
+                                 ['page.html', 'base.html', 'part.html'])
+
+                before = page_version(['page.html'])
+                os.utime(os.path.join(root, 'unused.html'), ns=(0, 10**18))
+                self.assertEqual(page_version(['page.html']), before)
+                os.utime(os.path.join(root, 'part.html'), ns=(0, 10**18))
+                self.assertNotEqual(page_version(['page.html']), before)
+
+    @override_settings(DEPLOY_VERSION='release-42')
+    def test_deploy_version_replaces_template_mtimes(self):
+        self.assertTrue(page_version(['landing.html']).startswith('release-42:'))
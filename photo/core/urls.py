@@ -1,10 +1,11 @@
 from django.urls import path
-from .views import LandingView, LoginView, SignupView
+from .views import LandingView, LoginView, SignupView, MetricsView
 
 app_name = "core"
 
 urlpatterns = [
     path('', LandingView.as_view(), name='landing'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     # path('signup/', SignupView.as_view(), name = 'signup'),
     # path('login/', LoginView.as_view(),name='login'),
 ]
\ No newline at end of file
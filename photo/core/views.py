@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views import View
+
+from .metrics import registry
+from .page_cache import CachedPageMixin
 
 # Create your views here.
 from django.views.generic import TemplateView
 
-class LandingView(TemplateView):
+class LandingView(CachedPageMixin, TemplateView):
     template_name = 'landing.html'
 
 
@@ -12,4 +18,18 @@ class LoginView(TemplateView):
     template_name = 'login.html'
 
 class SignupView(TemplateView):
-    template_name = 'signup.html'
\ No newline at end of file
+    template_name = 'signup.html'
+
+
+class MetricsView(View):
+    # Prometheus scrape endpoint for this worker process. Not gated on the client
+    # address: behind a local reverse proxy every request comes from 127.0.0.1.
+
+    def get(self, request):
+        if not (request.user.is_staff or self.has_scrape_token(request)):
+            return HttpResponseForbidden()
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def has_scrape_token(self, request):
+        scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and constant_time_compare(token, settings.METRICS_TOKEN)
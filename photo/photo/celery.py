@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_prerun, worker_process_init, worker_ready
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'photo.settings')
 
@@ -7,4 +8,36 @@ app = Celery('photo')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def size_db_pools(**kwargs):
+    # Connections inherited from the parent are dropped by the pool itself (pid check);
+    # here each child just gets a pool sized for one task at a time
+    from django.conf import settings
+    from photo.db.pool import all_pools
+
+    for database in settings.DATABASES.values():
+        if 'POOL' in database:
+            database['POOL']['size'] = settings.CELERY_DB_POOL_SIZE
+    for pool in all_pools().values():
+        pool.resize(settings.CELERY_DB_POOL_SIZE)
+
+
+@task_prerun.connect
+def reset_db_pinning(task=None, **kwargs):
+    # Reads go back to the replicas until this task writes. Eager tasks run
+    # inside the caller's request and must keep its pinning.
+    if task is not None and getattr(task.request, 'is_eager', False):
+        return
+    from photo.db.routers import reset_pinning
+    reset_pinning()
+
+
+@worker_ready.connect
+def flush_leftover_login_audit(**kwargs):
+    # Login bookkeeping left mid-flush by a worker that died is picked up by
+    # the next flush; run one now rather than wait for beat
+    from users.tasks import flush_login_audit
+    flush_login_audit.delay()
@@ -0,0 +1,72 @@
+"""
+MySQL backend that borrows connections from photo.db.pool instead of opening
+a new one per request. Configure with ENGINE 'photo.db.backends.mysql' and an
+optional POOL dict in the DATABASES entry (size, timeout, ping_after,
+max_lifetime); keep CONN_MAX_AGE at 0 so Django returns the connection to the
+pool at the end of every request and Celery task.
+"""
+from django.db.backends.mysql import base
+
+from core.metrics import registry
+from photo.db.pool import get_pool, pool_metrics
+
+
+POOL_DEFAULTS = {
+    'size': 10,
+    'timeout': 5.0,
+    'ping_after': 30.0,
+    'max_lifetime': 3600.0,
+}
+
+registry.register_collector(pool_metrics)
+
+
+def connect_function(alias, settings_dict):
+    """
+    () -> new raw connection for this DATABASES entry. The pool outlives the
+    DatabaseWrapper that created it (Django makes one per thread), so it gets
+    a plain, unpooled wrapper of its own rather than a method of that one.
+    """
+    plain = base.DatabaseWrapper(settings_dict, alias)
+
+    def connect():
+        return plain.get_new_connection(plain.get_connection_params())
+
+    return connect
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    _fresh_connection = True
+    _pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            options = {**POOL_DEFAULTS, **self.settings_dict.get('POOL', {})}
+            self._pool = get_pool(self.alias, lambda: connect_function(self.alias, self.settings_dict), **options)
+        return self._pool
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection, self._fresh_connection = self.pool.acquire()
+        except Exception as e:
+            # Surface pool exhaustion like any other failure to connect
+            raise base.Database.OperationalError(str(e)) from e
+        return connection
+
+    def init_connection_state(self):
+        # Session settings (sql_auto_is_null, isolation level) survive in the pool
+        if self._fresh_connection:
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        reusable = not self.errors_occurred
+        if reusable and (self.in_atomic_block or not self.get_autocommit()):
+            # Never hand out a connection with a transaction still open
+            try:
+                self.connection.rollback()
+            except base.Database.Error:
+                reusable = False
+        self.pool.release(self.connection, reusable=reusable)
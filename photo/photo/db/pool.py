@@ -0,0 +1,178 @@
+"""
+Per-process pool of raw DB-API connections, used by photo.db.backends.mysql.
+
+Django keeps one connection per thread and closes it at the end of every
+request (CONN_MAX_AGE = 0); with the pooled backend that close hands the
+connection back here instead, so the next request skips the TCP + auth
+handshake. Idle connections are pinged before reuse and recycled after
+``max_lifetime``.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolStats:
+    __slots__ = (
+        'checkouts', 'wait_seconds', 'timeouts', 'created', 'closed',
+        'ping_failures', 'in_use', 'idle',
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=10, timeout=5.0, ping_after=30.0, max_lifetime=3600.0):
+        self.connect = connect  # () -> new raw connection
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_lifetime = max_lifetime
+        self.stats = PoolStats()
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # After fork the inherited sockets belong to the parent: forget them, never close them
+        self._pid = os.getpid()
+        self._idle = deque()  # (conn, created_at, released_at), most recently used last
+        self._born = {}  # id(conn) -> created_at for connections checked out
+        self.stats.in_use = self.stats.idle = 0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def resize(self, size):
+        with self._cond:
+            self.size = size
+            self._cond.notify_all()
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            self._check_pid()
+            while True:
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    self.stats.idle -= 1
+                    break
+                if self.stats.in_use < self.size:
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise PoolTimeout(f"No database connection free within {self.timeout}s (pool size {self.size})")
+                self._cond.wait(remaining)
+            self.stats.in_use += 1
+
+        try:
+            now = time.monotonic()
+            if conn is not None and now - created_at > self.max_lifetime:
+                self._discard(conn)
+                conn = None
+            elif conn is not None and now - released_at > self.ping_after and not self._ping(conn):
+                self.stats.ping_failures += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn, created_at = self.connect(), now
+                self.stats.created += 1
+                fresh = True
+            else:
+                fresh = False
+        except BaseException:
+            with self._cond:
+                self.stats.in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._born[id(conn)] = created_at
+            self.stats.checkouts += 1
+            self.stats.wait_seconds += time.monotonic() - started
+        return conn, fresh
+
+    def release(self, conn, reusable=True):
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+                return  # inherited from the parent process; drop it
+            if id(conn) not in self._born:
+                # Checked out before a fork reset the pool: the parent's socket, drop it
+                return
+            created_at = self._born.pop(id(conn))
+            self.stats.in_use -= 1
+            if reusable and len(self._idle) < self.size:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self.stats.idle += 1
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def _ping(self, conn):
+        try:
+            conn.ping()
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, conn):
+        self.stats.closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self._cond:
+            self._check_pid()
+            idle, self._idle = list(self._idle), deque()
+            self.stats.idle = 0
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, make_connect, **options):
+    # make_connect() -> the pool's connect function; only called for a new pool
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(make_connect(), **options)
+        return pool
+
+
+def all_pools():
+    return dict(_pools)
+
+
+def pool_metrics():
+    # core.metrics collector: totals across every pooled alias in this process
+    totals = PoolStats()
+    for pool in all_pools().values():
+        for name in PoolStats.__slots__:
+            setattr(totals, name, getattr(totals, name) + getattr(pool.stats, name))
+    return [
+        ('db_pool_checkouts_total', 'counter', 'Connections handed out by the pool.', totals.checkouts),
+        ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for and opening pooled connections.', totals.wait_seconds),
+        ('db_pool_timeouts_total', 'counter', 'Checkouts that gave up because the pool was exhausted.', totals.timeouts),
+        ('db_pool_connections_created_total', 'counter', 'New database connections opened.', totals.created),
+        ('db_pool_connections_closed_total', 'counter', 'Database connections closed (expired, broken or surplus).', totals.closed),
+        ('db_pool_ping_failures_total', 'counter', 'Idle connections that failed the liveness check.', totals.ping_failures),
+        ('db_pool_in_use', 'gauge', 'Connections currently checked out.', totals.in_use),
+        ('db_pool_idle', 'gauge', 'Connections idle in the pool.', totals.idle),
+    ]
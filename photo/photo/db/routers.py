@@ -0,0 +1,103 @@
+"""
+Send reads to DATABASE_REPLICAS and writes to ``default``, with read-your-writes:
+once a request (or Celery task) has written, its later reads stay on the
+primary, and ReplicaPinningMiddleware keeps that client's next requests there
+for REPLICA_PIN_SECONDS so it never reads a replica that has not caught up.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+PRIMARY = 'default'
+
+# True while reads must go to the primary
+_pinned = ContextVar('db_pinned_to_primary', default=False)
+# Set by db_for_write so the middleware knows to pin the client
+_wrote = ContextVar('db_wrote', default=False)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+def reset_pinning():
+    # Start of a request or task: forget state left by the previous one on this thread
+    _pinned.set(False)
+    _wrote.set(False)
+
+
+def wrote_to_primary():
+    return _wrote.get()
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or not settings.DATABASE_REPLICAS:
+            return PRIMARY
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        # Also covers select_for_update() and get_or_create(), which read "for write"
+        _wrote.set(True)
+        _pinned.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == PRIMARY
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin a client's reads to the primary for REPLICA_PIN_SECONDS after any
+    request of theirs wrote to it, using a short-lived cookie.
+    """
+    cookie_name = 'db_primary_until'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        # sync_to_async copies context changes back, so writes made by the
+        # async ORM on its worker thread are seen here
+        self.process_request(request)
+        return self.process_response(request, await self.get_response(request))
+
+    def process_request(self, request):
+        reset_pinning()
+        try:
+            pinned_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            pin_to_primary()
+
+    def process_response(self, request, response):
+        if wrote_to_primary() and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                self.cookie_name,
+                str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
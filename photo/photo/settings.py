@@ -64,8 +64,11 @@ REST_FRAMEWORK = {
 
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'photo.db.routers.ReplicaPinningMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.StaticAssetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,16 +107,41 @@ DATABASES = {
     #     'NAME': BASE_DIR / 'db.sqlite3',
     # }
     'default':{
-        'ENGINE' : 'django.db.backends.mysql',
+        # django.db.backends.mysql plus a per-process connection pool (photo.db.pool)
+        'ENGINE' : 'photo.db.backends.mysql',
         'HOST' : config('DB_HOST'),
         'PORT' : config('DB_PORT'),
         'NAME' : config('DB_NAME'),
         'USER' : config('DB_USER'),
         'PASSWORD' : config('DB_PASSWORD'),
-
+        # Keep at 0: closing at the end of a request returns the connection to the pool
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            # Per process: at least the worker's thread count (gunicorn --threads)
+            'size': config('DB_POOL_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=5.0, cast=float),  # seconds to wait for a free connection
+            'ping_after': 30.0,  # idle seconds after which a connection is pinged before reuse
+            'max_lifetime': 3600.0,  # stay below MySQL's wait_timeout
+        },
     }
 }
 
+# Optional read replica (same credentials); see photo.db.routers
+if config('DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'POOL': dict(DATABASES['default']['POOL']),
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['photo.db.routers.PrimaryReplicaRouter']
+# Seconds a client's reads stay on the primary after it wrote (covers replica lag)
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
+# Prefork Celery children run one task at a time (see photo/celery.py)
+CELERY_DB_POOL_SIZE = config('CELERY_DB_POOL_SIZE', default=2, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,6 +161,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (users.hashing). PASSWORD_HASH_WORK_FACTOR is the PBKDF2
+# iteration count or scrypt N (0 = Django's default); pick it with
+# `manage.py calibrate_password_hasher`. Changing the hasher or work factor
+# rehashes each password on its owner's next successful login.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='users.hashing.TunablePBKDF2PasswordHasher')
+PASSWORD_HASH_WORK_FACTOR = config('PASSWORD_HASH_WORK_FACTOR', default=0, cast=int)
+PASSWORD_HASH_TARGET_MS = config('PASSWORD_HASH_TARGET_MS', default=250, cast=int)  # calibration target per hash
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [
+    hasher for hasher in (
+        'users.hashing.TunablePBKDF2PasswordHasher',
+        'users.hashing.TunableScryptPasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    ) if hasher != PASSWORD_HASHER
+]
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=2, cast=int)  # cores given to hashing
+PASSWORD_HASH_QUEUE = config('PASSWORD_HASH_QUEUE', default=64, cast=int)  # hashes allowed to wait before returning 503
+PASSWORD_HASH_TIMEOUT = 10  # seconds a sync view waits for its hash
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -161,7 +209,84 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+# For a local SMTP stand-in: EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend,
+# EMAIL_PORT=1025 and `manage.py run_smtp_sink`
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = 'no-reply@narayanagroup.com'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.metrics.InstrumentedRedisCache',  # RedisCache that counts hits/misses
+        'LOCATION': config('CACHE_URL', default='redis://localhost:6379/1'),
+    },
+    # Rendered pages (core.page_cache); per process, so a hit never leaves the worker
+    'pages': {
+        'BACKEND': 'core.metrics.InstrumentedLocMemCache',
+        'LOCATION': 'pages',
+    },
+}
+
+# Page cache for anonymous core TemplateViews (core.page_cache)
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60  # keys are versioned, so this only bounds memory
+PAGE_CACHE_WARM_URLS = ['core:landing']
+PAGE_CACHE_WARM_ON_STARTUP = config('PAGE_CACHE_WARM_ON_STARTUP', default=True, cast=bool)
+# Set per release (e.g. the git SHA); without it page cache keys follow template mtimes
+DEPLOY_VERSION = config('DEPLOY_VERSION', default='')
+
+# Bearer token Prometheus sends to scrape /metrics/ (staff users always can); unset, only staff can
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# JWTAuthCookie user lookups: in-process LRU in front of the shared cache
+USER_CACHE_TTL = 300  # seconds in the shared cache
+USER_CACHE_LOCAL_SIZE = 1024
+USER_CACHE_LOCAL_TTL = 1  # seconds; other processes see a deactivation or permission change within this
+TOKEN_CACHE_SIZE = 4096  # validated access tokens kept per process
+
+# Reverse proxies in front of the app (e.g. 1 behind nginx). X-Forwarded-For is only trusted
+# this many hops deep; with 0 the client IP is REMOTE_ADDR (users.signals.get_client_ip)
+TRUSTED_PROXY_COUNT = config('TRUSTED_PROXY_COUNT', default=0, cast=int)
+
+# Token-bucket limits for auth endpoints (users.throttling):
+# scope -> {'ip' | 'email': (burst capacity, seconds to refill an empty bucket)}
+RATE_LIMITS = {
+    'otp': {'ip': (20, 3600), 'email': (3, 600)},
+    'login': {'ip': (60, 300), 'email': (10, 300)},
+}
+
+# last_login / IP / device writes are buffered here and flushed by users.tasks.flush_login_audit
+LOGIN_AUDIT_BACKEND = 'users.login_audit.RedisLoginAuditBuffer'
+LOGIN_AUDIT_FLUSH_TIMEOUT = 300  # seconds; a flush that dies holds the flush lock at most this long
+
+# Seconds LoginView remembers that an email has no User or PendingUser
+AUTH_STATE_NEGATIVE_TTL = 30
+
+# OTP codes; Redis keeps them out of MySQL and expires them natively
+OTP_STORE_BACKEND = 'users.otp_store.RedisOTPStore'
+OTP_TTL = 300  # seconds
+
+# Outgoing mail is queued by the views. OutboxMailQueue writes it to the EmailOutbox table in
+# the request's transaction and `manage.py run_mail_dispatcher` processes send it (run as many
+# as throughput needs); RedisMailQueue is sent in batches by users.tasks.drain_mail_queue
+MAIL_QUEUE_BACKEND = config('MAIL_QUEUE_BACKEND', default='users.mail.OutboxMailQueue')
+MAIL_BATCH_SIZE = 100
+MAIL_BATCH_WINDOW = 1  # seconds; enqueues inside this window share one drain
+MAIL_MAX_RETRIES = 5
+MAIL_RETRY_BACKOFF = 5  # seconds, doubled on every retry
+MAIL_OUTBOX_LEASE = 300  # seconds a dispatcher (or drain, with RedisMailQueue) has to send a claimed batch before others may retake it
+MAIL_OUTBOX_POLL = 1  # seconds an idle dispatcher waits before looking again
+MAIL_OUTBOX_RETENTION = 7 * 24 * 60 * 60  # seconds sent and failed rows are kept
+
+# Bulk invitations (users.invitations): one SMTP session per chunk
+INVITE_RATE = config('INVITE_RATE', default=20, cast=float)  # messages per second across all workers
+INVITE_CHUNK_SIZE = 200
+INVITE_JOB_TTL = 7 * 24 * 60 * 60  # seconds progress is kept for resuming
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME' : timedelta(minutes=15),
@@ -170,15 +295,61 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION' : True,
     'USER_ID_FIELD' : 'email',
     'USER_ID_CLAIM': 'user_id',  # Optional: Customize the claim name in the token
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.TokenRefreshSerializer',
 }
 
+# Outstanding/blacklisted refresh token JTIs; Redis entries expire with the token
+TOKEN_REGISTRY_BACKEND = 'users.token_registry.RedisTokenRegistry'
+
 AUTH_USER_MODEL = 'users.User'
 
 CELERY_TIMEZONE = 'Asia/Kolkata'
 CELERY_ENABLE_UTC = False
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'  # same Redis for results
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL  # same Redis for results
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
+# Synced into django_celery_beat's tables by the DatabaseScheduler on startup
+CELERY_BEAT_SCHEDULE = {
+    'flush-login-audit': {
+        'task': 'users.tasks.flush_login_audit',
+        'schedule': 30.0,
+    },
+    'maintain-login-history-partitions': {
+        'task': 'users.tasks.maintain_login_history_partitions',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'cleanup-mail-outbox': {
+        'task': 'users.tasks.cleanup_mail_outbox',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'sweep-mail-queue': {
+        'task': 'users.tasks.sweep_mail_queue',
+        'schedule': 60.0,
+    },
+}
+
+# Cleanup tasks delete in primary-key ordered chunks (see users.cleanup)
+CLEANUP_BATCH_SIZE = 1000
+CLEANUP_BATCH_SLEEP = 0.05  # seconds between batches
+
+# Google Authenticator codes (users.totp): steps of clock drift accepted either side
+TOTP_VALID_WINDOW = 0
+
+# Google Authenticator QR images (users.qr)
+QR_RENDER_WORKERS = 2
+QR_RENDER_QUEUE = 8  # renders allowed to wait for a worker before returning 503
+QR_RENDER_TIMEOUT = 5  # seconds
+QR_CACHE_TTL = 600
+
+# Bulk account creation (users.provisioning)
+PROVISIONING_CHUNK_SIZE = 1000  # rows per bulk_create
+PROVISIONING_API_MAX_ROWS = 20000  # larger files go through `manage.py provision_users`
+
+# Login history (users.LoginEvent), kept in monthly partitions on MySQL
+LOGIN_HISTORY_RETENTION_MONTHS = 12
+LOGIN_HISTORY_PARTITIONS_AHEAD = 3
 
 
 LOGGING = {
@@ -202,6 +373,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'core': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -212,4 +388,31 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
-STATIC_ROOT = BASE_DIR / "staticfiles"  # for collectstatic in production
\ No newline at end of file
+STATIC_ROOT = BASE_DIR / "staticfiles"  # for collectstatic in production
+
+# collectstatic writes content-hashed copies plus .br/.gz siblings (core.storage);
+# core.middleware.StaticAssetMiddleware serves them from STATIC_ROOT
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # hashed names
+STATIC_MAX_AGE = 300  # unhashed names, e.g. files referenced from JS by their plain path
+
+# Tailwind v3 CLI used by `manage.py build_css` (e.g. "npx tailwindcss@3" or a standalone binary)
+TAILWIND_COMMAND = config('TAILWIND_COMMAND', default='npx tailwindcss@3')
+
+# WebP/AVIF derivatives built by `manage.py build_responsive_images` (see core.images).
+# Written inside STATICFILES_DIRS so collectstatic and runserver pick them up.
+RESPONSIVE_IMAGES_PREFIX = 'responsive'
+RESPONSIVE_IMAGES_ROOT = BASE_DIR / "static" / RESPONSIVE_IMAGES_PREFIX
+RESPONSIVE_IMAGE_FORMATS = ['avif', 'webp']
+# Source directory (static path) -> widths to generate
+RESPONSIVE_IMAGES = {
+    'core/images/carousel': (640, 1024, 1440, 1920),
+    'core/images/features': (128, 256, 512),  # shown at 112px (w-28)
+}
@@ -0,0 +1,61 @@
+# Settings for the offline benchmarks (manage.py bench_* --settings=photo.settings_bench):
+# SQLite, locmem cache/email and in-memory OTP, mail and token backends.
+import os
+import tempfile
+
+os.environ.setdefault('SECRET_KEY', 'bench-only-not-secret')
+os.environ.setdefault('DEBUG', 'False')
+for name in ('DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASSWORD'):
+    os.environ.setdefault(name, '')
+
+from .settings import *  # noqa: E402,F401,F403
+
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DB', os.path.join(tempfile.gettempdir(), 'photo_bench.sqlite3')),
+        'OPTIONS': {
+            'timeout': 30,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
+    },
+}
+# A second alias for the router tests; the benchmarks leave DATABASE_REPLICAS empty
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = []
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.metrics.InstrumentedLocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'core.metrics.InstrumentedLocMemCache',
+        'LOCATION': 'pages',
+    },
+}
+
+# No collectstatic before a benchmark run, so no manifest to resolve hashed names from
+STORAGES = {
+    **STORAGES,  # noqa: F405
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+CELERY_TASK_ALWAYS_EAGER = True
+
+MAIL_QUEUE_BACKEND = 'users.mail.InMemoryMailQueue'
+OTP_STORE_BACKEND = 'users.otp_store.InMemoryOTPStore'
+TOKEN_REGISTRY_BACKEND = 'users.token_registry.InMemoryTokenRegistry'
+LOGIN_AUDIT_BACKEND = 'users.login_audit.InMemoryLoginAuditBuffer'
+
+# Every benchmark client shares 127.0.0.1
+RATE_LIMITS = {
+    'otp': {'ip': (1_000_000, 1), 'email': (1_000, 1)},
+    'login': {'ip': (1_000_000, 1), 'email': (1_000, 1)},
+}
+
+LOGGING['loggers']['users']['level'] = 'WARNING'  # noqa: F405
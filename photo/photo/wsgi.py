@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'photo.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.PAGE_CACHE_WARM_ON_STARTUP:
+    # Each worker has its own page cache; fill it before the first visitor arrives
+    from core.page_cache import warm_page_cache  # noqa: E402
+    warm_page_cache()
@@ -0,0 +1,15 @@
+/** @type {import('tailwindcss').Config} */
+// Stylesheet for the Django-rendered pages; built by `python manage.py build_css`.
+// Every file that can contain class names must be listed, or its classes are purged.
+module.exports = {
+  content: [
+    "./templates/**/*.html",
+    "./static/js/**/*.js",
+    "./core/templatetags/**/*.py",
+    "./frontend/src/components/**/*.{js,jsx}",
+  ],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+}
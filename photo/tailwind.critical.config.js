@@ -0,0 +1,11 @@
+/** @type {import('tailwindcss').Config} */
+// Above-the-fold subset (header + carousel), inlined into <head> by {% compiled_css %}
+const base = require('./tailwind.config.js')
+
+module.exports = {
+  ...base,
+  content: [
+    "./templates/partials/landing_hero.html",
+    "./core/templatetags/**/*.py",
+  ],
+}
@@ -8,3 +8,9 @@ class UsersConfig(AppConfig):
     def ready(self):
         import users.signals
         import users.tasks
+
+        from core.metrics import registry
+        from users.hashing import hashing_metrics
+        from users.mail import mail_queue_metrics
+        registry.register_collector(mail_queue_metrics)
+        registry.register_collector(hashing_metrics)
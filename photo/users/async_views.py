@@ -0,0 +1,360 @@
+"""
+Native async versions of the account views, for ASGI deployments (photo.asgi).
+
+Same request and response contract as the DRF views in users.views, served
+under /account/async/. DRF has no async request handling, so these are plain
+Django async views: ORM calls use the async interface, password hashing runs
+on the users.hashing pool and mail is only pushed onto the outbound queue,
+so an in-flight request holds no thread while it waits.
+"""
+import json
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .auth_state import resolve_auth_state, forget_auth_state
+from .hashing import HashingBusy, ahash_password
+from .login_audit import record_login
+from .mail import send_otp_mail
+from .models import User, PendingUser
+from .otp_store import get_otp_store, OTP_VALID, OTP_EXPIRED
+from .throttling import OTPRequestThrottle, LoginThrottle
+from .tokens import RefreshToken
+from .totp import verify_totp, TOTP_VALID, TOTP_REPLAYED, TOTP_NOT_REGISTERED
+from .serializers import SignupSerializer, OTPVerifySerializer, SetPasswordSerializer, LoginSerializer, LoginOTPRequestSerializer, PasswordResetSerializer
+
+
+logger = logging.getLogger('users')
+
+
+def parse_body(request):
+    # JSON and form bodies, like DRF's default parsers
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return data
+    return request.POST.dict()
+
+
+def async_api_view(throttle_classes=(), get_throttles=None):
+    """
+    Wrap an async view taking (request) with the parts of APIView the account
+    views rely on: body parsing into ``request.data``, the token bucket
+    throttles and a 503 when the hashing pool is saturated.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @require_POST
+        @wraps(view)
+        async def wrapper(request):
+            try:
+                request.data = parse_body(request)
+            except ValueError as e:
+                return JsonResponse({"detail": f"JSON parse error - {e}"}, status=400)
+
+            throttles = get_throttles(request) if get_throttles else [cls() for cls in throttle_classes]
+            for throttle in throttles:
+                if not await sync_to_async(throttle.allow_request)(request, None):
+                    wait = throttle.wait()
+                    response = JsonResponse(
+                        {"detail": f"Request was throttled. Expected available in {int(wait or 1)} seconds."},
+                        status=429,
+                    )
+                    if wait is not None:
+                        response['Retry-After'] = str(int(wait) or 1)
+                    return response
+
+            try:
+                return await view(request)
+            except HashingBusy:
+                logger.warning(f"Password hashing pool saturated, rejecting {request.path}")
+                response = JsonResponse({"error": "Server busy, please retry."}, status=503)
+                response['Retry-After'] = '1'
+                return response
+        return wrapper
+    return decorator
+
+
+async def validate(serializer):
+    # Field validators may query the database
+    return await sync_to_async(serializer.is_valid)()
+
+
+async def token_response(user, message, status=200):
+    refresh = await sync_to_async(RefreshToken.for_user)(user)
+
+    # Set tokens as HttpOnly cookies
+    response = JsonResponse({"message": message}, status=status)
+    response.set_cookie(
+        key="access_token",
+        value=str(refresh.access_token),
+        httponly=True,
+        secure=False,  # Set to True only in production with HTTPS
+        samesite="Strict",
+    )
+    response.set_cookie(
+        key="refresh_token",
+        value=str(refresh),
+        httponly=True,
+        secure=False,
+        samesite="Strict",
+    )
+    return response
+
+
+@async_api_view(throttle_classes=[OTPRequestThrottle])
+async def signup(request):
+    serializer = SignupSerializer(data=request.data)
+    if not await validate(serializer):
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    name = serializer.validated_data['name']
+
+    await PendingUser.objects.aupdate_or_create(email=email, defaults={'name': name, 'otp_verified': False})
+    await sync_to_async(forget_auth_state)(email)
+
+    # Replaces any previous signup OTP for this email
+    otp_code = await sync_to_async(send_otp_mail)(
+        email, 'signup',
+        subject="Your OTP Code",
+        message="Your OTP code is {code}. It will expire in 5 minutes.",
+    )
+
+    logger.info(f"OTP sent to {email}: {otp_code}")
+    return JsonResponse({"message": "OTP sent to your email"})
+
+
+@async_api_view(throttle_classes=[LoginThrottle])
+async def otp_verify(request):
+    serializer = OTPVerifySerializer(data=request.data)
+    if not await validate(serializer):
+        logger.warning(f"OTP verification failed due to serializer errors: {serializer.errors}")
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    otp_code = serializer.validated_data['otp']
+
+    if await User.objects.filter(email=email).aexists():
+        return JsonResponse({"error": "User already registered. Please login."}, status=400)
+
+    if not await PendingUser.objects.filter(email=email).aexists():
+        logger.warning(f"OTP verification failed: email {email} is not registered")
+        return JsonResponse({"error": "Email is not registered or invalid email"}, status=400)
+
+    result = await sync_to_async(get_otp_store().verify)(email, otp_code, 'signup')
+
+    if result == OTP_EXPIRED:
+        # The store already dropped the OTP: cleanup PendingUser
+        await PendingUser.objects.filter(email=email).adelete()
+        logger.error(f"OTP expired for {email}, pending user deleted")
+        return JsonResponse({"error": "OTP expired. Please click Resend OTP."}, status=400)
+
+    if result != OTP_VALID:
+        logger.warning(f"Invalid OTP attempt for {email}")
+        return JsonResponse({"error": "Invalid OTP"}, status=400)
+
+    # One UPDATE instead of get() + save() in a transaction
+    if not await PendingUser.objects.filter(email=email).aupdate(otp_verified=True):
+        logger.warning(f"OTP verification failed: no pending user found for {email}")
+        return JsonResponse({"error": "No pending registration found. Please sign up."}, status=400)
+
+    logger.info(f"OTP verified for {email}")
+    return JsonResponse({"message": "OTP verified, please login and set your password"})
+
+
+@async_api_view()
+async def set_password(request):
+    serializer = SetPasswordSerializer(data=request.data)
+    if not await validate(serializer):
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+
+    if await User.objects.filter(email=email).aexists():
+        logger.warning(f"SetPassword attempt for existing user: {email}")
+        return JsonResponse({"error": "User already exists"}, status=400)
+
+    pending_user = await PendingUser.objects.filter(email=email).afirst()
+    if pending_user is None:
+        logger.warning(f"OTP verification failed: email {email} is not registered")
+        return JsonResponse({"error": "Email is not registered or invalid email"}, status=400)
+
+    if not pending_user.otp_verified:
+        logger.warning(f"SetPassword attempt failed: email not verified for {email}")
+        return JsonResponse({"error": "Email not verified. Please verify OTP first."}, status=400)
+
+    # Hash first so the transaction below does not hold a connection through it
+    encoded = await ahash_password(password)
+    user = await sync_to_async(create_user_from_pending)(pending_user, encoded)
+    logger.info(f"User created: {email}")
+
+    return await token_response(user, "User created successfully", status=201)
+
+
+def create_user_from_pending(pending_user, encoded_password):
+    with transaction.atomic():
+        user = User.objects.create_user(email=pending_user.email, name=pending_user.name)
+        # create_user() would hash on this thread; store the hash made on the pool instead
+        user.password = encoded_password
+        user.save(update_fields=['password'])
+
+        # Cleanup: delete pending user and all OTPs for this email
+        pending_user.delete()
+        get_otp_store().discard(pending_user.email)
+    return user
+
+
+async def login_success(request, user, message, method):
+    # Buffered; flushed to the User row by flush_login_audit
+    await sync_to_async(record_login)(request, user, method=method)
+    return await token_response(user, message)
+
+
+@async_api_view(throttle_classes=[LoginThrottle])
+async def login(request):
+    serializer = LoginSerializer(data=request.data)
+    if not await validate(serializer):
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    password = serializer.validated_data.get('password')
+    otp = serializer.validated_data.get('otp')
+    totp = serializer.validated_data.get('totp')
+
+    # One lookup (usually cached) shared by every branch below
+    state = await sync_to_async(resolve_auth_state)(email)
+    user = state.user
+    pending_user = state.pending_user
+
+    # Restrict login if user is not verified
+    if not state.user_exists:
+        if not pending_user:
+            return JsonResponse({"error": "User not found. Please sign up."}, status=404)
+        if not pending_user.otp_verified:
+            return JsonResponse({"error": "OTP not verified. Please sign up and complete verification process."}, status=400)
+
+    # Email only: status check
+    if not password and not otp and not totp:
+        if state.user_exists:
+            return JsonResponse({"action": "login_password_or_otp_or_google_authenticator"})
+        return JsonResponse({"action": "set_password and register Authenticator"})
+
+    if not state.user_exists:
+        return JsonResponse({"error": "User not found. Please sign up."}, status=404)
+
+    # Password login
+    if password:
+        # Checked against a fresh row, never the cached user (see LoginView)
+        user = await aauthenticate(request, email=email, password=password)
+        if user is None:
+            return JsonResponse({"error": "Incorrect password."}, status=400)
+        return await login_success(request, user, "Login successful", method='password')
+
+    # OTP login
+    if otp:
+        result = await sync_to_async(get_otp_store().verify)(email, otp, 'login')
+        if result == OTP_EXPIRED:
+            logger.error(f"Login OTP expired for {email}")
+            return JsonResponse({"error": "OTP expired. Please request a new OTP."}, status=400)
+        if result != OTP_VALID:
+            logger.warning(f"Invalid login OTP attempt for {email}")
+            return JsonResponse({"error": "Invalid OTP"}, status=400)
+        return await login_success(request, user, "Login successful via OTP", method='otp')
+
+    # Google Authenticator login
+    result = await sync_to_async(verify_totp)(email, totp)
+    if result == TOTP_NOT_REGISTERED:
+        return JsonResponse({"error": "Google Authenticator is not registered for this user"}, status=400)
+    if result == TOTP_REPLAYED:
+        logger.warning(f"Replayed Google Authenticator code for {email}")
+        return JsonResponse({"error": "This Google Authenticator code has already been used"}, status=400)
+    if result != TOTP_VALID:
+        return JsonResponse({"error": "Invalid Google Authenticator code"}, status=400)
+    return await login_success(request, user, "Login successful via Google Authenticator", method='totp')
+
+
+@async_api_view(throttle_classes=[OTPRequestThrottle])
+async def login_otp_request(request):
+    serializer = LoginOTPRequestSerializer(data=request.data)
+    if not await validate(serializer):
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    if not await User.objects.filter(email=email).aexists():
+        return JsonResponse({"error": "User not found. Please sign up."}, status=404)
+
+    # Replaces old login OTPs for this email
+    otp_code = await sync_to_async(send_otp_mail)(
+        email, 'login',
+        subject="Your Login OTP Code",
+        message="Your login OTP code is {code}. It will expire in 5 minutes.",
+    )
+
+    logger.info(f"Login OTP sent to {email}: {otp_code}")
+    return JsonResponse({"message": "Login OTP sent to your email"})
+
+
+def password_reset_throttles(request):
+    # Step 1 sends an OTP; steps 2 and 3 are guesses at one
+    if not request.data.get('otp') and not request.data.get('password'):
+        return [OTPRequestThrottle()]
+    return [LoginThrottle()]
+
+
+@async_api_view(get_throttles=password_reset_throttles)
+async def password_reset(request):
+    serializer = PasswordResetSerializer(data=request.data)
+    if not await validate(serializer):
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    otp = serializer.validated_data.get('otp')
+    password = serializer.validated_data.get('password')
+
+    if not otp and not password:
+        # Step 1: Send OTP
+        await sync_to_async(send_otp_mail)(
+            email, 'reset_password',
+            subject="Your Password Reset OTP",
+            message="Your password reset OTP is {code}. It expires in 5 minutes.",
+        )
+        return JsonResponse({"message": "Password reset OTP sent to your email"})
+
+    if otp and not password:
+        # Step 2: Verify OTP; left usable, since step 3 sends it again
+        result = await sync_to_async(get_otp_store().verify)(email, otp, 'reset_password', consume=False)
+        if result == OTP_EXPIRED:
+            return JsonResponse({"error": "OTP expired. Please request a new OTP."}, status=400)
+        if result != OTP_VALID:
+            return JsonResponse({"error": "Invalid OTP"}, status=400)
+        return JsonResponse({"message": "OTP verified. You can now reset your password."})
+
+    if otp and password:
+        # Step 3: Reset password
+        try:
+            user = await User.objects.aget(email=email)
+        except User.DoesNotExist:
+            return JsonResponse({"error": "User not found."}, status=404)
+
+        # Hash before using up the code, so a 503 from the hashing pool leaves it valid
+        encoded = await ahash_password(password)
+        result = await sync_to_async(get_otp_store().verify)(email, otp, 'reset_password')
+        if result == OTP_EXPIRED:
+            return JsonResponse({"error": "OTP expired. Please request a new OTP."}, status=400)
+        if result != OTP_VALID:
+            return JsonResponse({"error": "Invalid OTP"}, status=400)
+
+        user.password = encoded
+        await user.asave(update_fields=['password'])
+        return JsonResponse({"message": "Password reset successful."})
+
+    return JsonResponse({"error": "Invalid request."}, status=400)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from photo.db.routers import PRIMARY
+
+from .models import PendingUser
+from .user_cache import get_cached_user, missing_user_key, invalidate_user
+
+
+class AuthState:
+    # What LoginView needs to know about an email: the User, or else the PendingUser
+
+    def __init__(self, user=None, pending_user=None):
+        self.user = user
+        self.pending_user = pending_user
+
+    @property
+    def user_exists(self):
+        return self.user is not None
+
+
+def resolve_auth_state(email):
+    """
+    Look up the account for ``email`` with at most two queries: the user
+    (usually served by the user cache) and, only if there is no user, the
+    pending signup. Emails with neither are remembered for
+    AUTH_STATE_NEGATIVE_TTL seconds so repeated lookups cost nothing.
+    """
+    if cache.get(missing_user_key(email)):
+        return AuthState()
+
+    try:
+        return AuthState(user=get_cached_user(email))
+    except get_user_model().DoesNotExist:
+        pass
+
+    # From the primary: a miss is cached, and a lagging replica could still miss a new signup
+    pending_user = PendingUser.objects.using(PRIMARY).filter(email=email).first()
+    if pending_user is None:
+        cache.set(missing_user_key(email), True, settings.AUTH_STATE_NEGATIVE_TTL)
+    return AuthState(pending_user=pending_user)
+
+
+def forget_auth_state(email):
+    # Call after creating a PendingUser or User outside User.save
+    invalidate_user(email)
@@ -1,4 +1,12 @@
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .user_cache import get_cached_user, get_cached_token, remember_token
+
 
 class JWTAuthCookie(JWTAuthentication):
     def authenticate(self, request):
@@ -15,4 +23,30 @@ class JWTAuthCookie(JWTAuthentication):
             return self.get_user(validated_token), validated_token
         except Exception:
             # Instead of raising, just return None so AllowAny views work
-            return None
\ No newline at end of file
+            return None
+
+    def get_validated_token(self, raw_token):
+        # Signature checks are memoized until the token expires
+        key = raw_token.decode() if isinstance(raw_token, bytes) else raw_token
+        validated_token = get_cached_token(key)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            remember_token(key, validated_token)
+        return validated_token
+
+    def get_user(self, validated_token):
+        # Same checks as JWTAuthentication.get_user, but served from the user cache
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = get_cached_user(user_id)
+        except get_user_model().DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
@@ -0,0 +1,60 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger('users')
+
+
+def delete_in_batches(queryset, name, batch_size=None, sleep=None, before_delete=None):
+    """
+    Delete the rows of ``queryset`` in primary-key order, ``batch_size`` rows per
+    statement, sleeping between batches so foreground queries can take the locks.
+
+    Progress is checkpointed in the cache under ``name``; a run that is killed
+    resumes after the last deleted primary key. ``before_delete(pks)`` can
+    remove dependent rows first. Returns totals for logging / task results.
+    """
+    batch_size = batch_size or settings.CLEANUP_BATCH_SIZE
+    sleep = settings.CLEANUP_BATCH_SLEEP if sleep is None else sleep
+    checkpoint_key = f"cleanup:{name}:last_pk"
+
+    model = queryset.model
+    last_pk = cache.get(checkpoint_key)
+    stats = {'deleted': 0, 'batches': 0, 'seconds': 0.0, 'max_batch_seconds': 0.0}
+    if last_pk is not None:
+        logger.info(f"Cleanup {name}: resuming after pk {last_pk}")
+
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        pks = list(page.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+
+        started = time.monotonic()
+        if before_delete is not None:
+            before_delete(pks)
+        deleted, _ = model.objects.filter(pk__in=pks).delete()
+        elapsed = time.monotonic() - started
+
+        last_pk = pks[-1]
+        cache.set(checkpoint_key, last_pk, timeout=60 * 60 * 24)
+
+        stats['deleted'] += deleted
+        stats['batches'] += 1
+        stats['seconds'] += elapsed
+        stats['max_batch_seconds'] = max(stats['max_batch_seconds'], elapsed)
+        logger.info(f"Cleanup {name}: batch {stats['batches']} deleted {deleted} rows in {elapsed:.3f}s")
+
+        if len(pks) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    cache.delete(checkpoint_key)
+    logger.info(f"Cleanup {name}: {stats['deleted']} rows in {stats['batches']} batches, {stats['seconds']:.3f}s")
+    return stats
@@ -0,0 +1,235 @@
+"""
+Password hashing on a dedicated, bounded thread pool.
+
+PBKDF2 and scrypt hold a core for hundreds of milliseconds per call; run on
+request threads, a login storm starves every other endpoint. User.set_password
+and check_password (and with them create_user, ModelBackend and the admin)
+hand the work to PASSWORD_HASH_WORKERS threads instead. hashlib releases the
+GIL while it hashes, so the threads use real cores without a process pool's
+start-up and pickling cost. At most PASSWORD_HASH_QUEUE hashes wait for a
+worker; beyond that callers get HashingBusy (a 503) rather than piling up.
+
+The preferred hasher is PASSWORD_HASHER at PASSWORD_HASH_WORK_FACTOR (see
+``manage.py calibrate_password_hasher``). A password stored with any other
+hasher or parameters is rehashed on its owner's next successful login.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, ScryptPasswordHasher, make_password, verify_password
+from django.utils.crypto import get_random_string
+
+
+logger = logging.getLogger('users')
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class TunableHasherMixin:
+    def configured_work_factor(self, default):
+        # PASSWORD_HASH_WORK_FACTOR only applies to the preferred hasher
+        preferred = settings.PASSWORD_HASHERS[0] == f"{type(self).__module__}.{type(self).__name__}"
+        return (preferred and settings.PASSWORD_HASH_WORK_FACTOR) or default
+
+
+class TunablePBKDF2PasswordHasher(TunableHasherMixin, PBKDF2PasswordHasher):
+    # Same algorithm name as Django's hasher, so existing hashes verify as before
+    # and must_update() flags them once the iteration count differs
+    min_work_factor = 600_000  # OWASP floor for PBKDF2-HMAC-SHA256
+
+    @property
+    def iterations(self):
+        return self.configured_work_factor(PBKDF2PasswordHasher.iterations)
+
+    def get_work_factor(self):
+        return self.iterations
+
+    def encode_at(self, password, salt, work_factor):
+        return self.encode(password, salt, iterations=work_factor)
+
+    def scale_work_factor(self, work_factor, ratio):
+        # Run time is linear in the iteration count
+        return max(self.min_work_factor, int(round(work_factor * ratio, -4)))
+
+
+class TunableScryptPasswordHasher(TunableHasherMixin, ScryptPasswordHasher):
+    min_work_factor = 2 ** 14
+    # A cap, not an allocation: OpenSSL's 32 MiB default rejects N above 2**14
+    maxmem = 2 ** 30
+
+    @property
+    def work_factor(self):
+        return self.configured_work_factor(ScryptPasswordHasher.work_factor)
+
+    def get_work_factor(self):
+        return self.work_factor
+
+    def encode_at(self, password, salt, work_factor):
+        return self.encode(password, salt, n=work_factor)
+
+    def scale_work_factor(self, work_factor, ratio):
+        # N must be a power of two; run time and memory are linear in it
+        return max(self.min_work_factor, 2 ** round(math.log2(work_factor * ratio)))
+
+
+class HashStats:
+    __slots__ = ('hashes', 'queue_seconds', 'hash_seconds', 'rejected', 'timeouts', 'rehashed', 'queued', 'running')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class HashPool:
+    def __init__(self):
+        self.stats = HashStats()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _executor(self):
+        # Worker threads do not survive a fork: start a fresh pool in each process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    workers, queue = settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE
+                    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+                    # Hashes queued or running at once
+                    self._slots = threading.BoundedSemaphore(workers + queue)
+                    self.stats.queued = self.stats.running = 0
+                    self._pid = os.getpid()
+        return self._pool
+
+    def record(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    def submit(self, func, *args):
+        pool = self._executor()
+        if not self._slots.acquire(blocking=False):
+            self.record(rejected=1)
+            raise HashingBusy
+        enqueued = time.monotonic()
+        self.record(queued=1)
+
+        def run():
+            started = time.monotonic()
+            self.record(queued=-1, running=1, queue_seconds=started - enqueued)
+            try:
+                return func(*args)
+            finally:
+                self.record(running=-1, hashes=1, hash_seconds=time.monotonic() - started)
+
+        future = pool.submit(run)
+        # Also runs when a queued hash is cancelled after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, func, *args):
+        # Blocks the calling thread, but only PASSWORD_HASH_WORKERS cores ever hash
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout=settings.PASSWORD_HASH_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                self.record(queued=-1)
+            self.record(timeouts=1)
+            raise HashingBusy
+
+    async def arun(self, func, *args):
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+
+hash_pool = HashPool()
+
+
+def hash_password(raw_password):
+    return hash_pool.run(make_password, raw_password)
+
+
+async def ahash_password(raw_password):
+    return await hash_pool.arun(make_password, raw_password)
+
+
+def check_password(user, raw_password):
+    """
+    user.check_password() on the hashing pool. A correct password stored with
+    outdated parameters is rehashed with the preferred ones and saved.
+    """
+    is_correct, must_update = hash_pool.run(verify_password, raw_password, user.password)
+    if is_correct and must_update:
+        try:
+            user.password = hash_password(raw_password)
+        except HashingBusy:
+            return is_correct  # upgrade on a later login rather than fail this one
+        user.save(update_fields=['password'])
+        log_rehash(user)
+    return is_correct
+
+
+async def acheck_password(user, raw_password):
+    # Async check_password(); Django's own acheck_password hashes on the event loop
+    is_correct, must_update = await hash_pool.arun(verify_password, raw_password, user.password)
+    if is_correct and must_update:
+        try:
+            user.password = await ahash_password(raw_password)
+        except HashingBusy:
+            return is_correct
+        await user.asave(update_fields=['password'])
+        log_rehash(user)
+    return is_correct
+
+
+def log_rehash(user):
+    hash_pool.record(rehashed=1)
+    logger.info(f"Rehashed password for {user.pk} with {settings.PASSWORD_HASHER}")
+
+
+def time_hash(hasher, work_factor, samples=3):
+    # Best of ``samples``: the fastest run is the one least disturbed by other load
+    password, salt = get_random_string(16), hasher.salt()
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.encode_at(password, salt, work_factor)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def calibrate_work_factor(hasher, target_seconds, samples=3):
+    """
+    Find the work factor at which one hash takes about ``target_seconds`` on
+    this machine, never going below the hasher's min_work_factor. Returns
+    (work_factor, seconds per hash at that factor).
+    """
+    work_factor = hasher.get_work_factor()
+    for _ in range(3):
+        elapsed = time_hash(hasher, work_factor, samples)
+        scaled = hasher.scale_work_factor(work_factor, target_seconds / elapsed)
+        if scaled == work_factor:
+            return work_factor, elapsed
+        work_factor = scaled
+    return work_factor, time_hash(hasher, work_factor, samples)
+
+
+def hashing_metrics():
+    # core.metrics collector
+    stats = hash_pool.stats
+    return [
+        ('password_hashes_total', 'counter', 'Password hashes and verifications run on the hashing pool.', stats.hashes),
+        ('password_hash_queue_seconds_total', 'counter', 'Time hashes spent waiting for a hashing worker.', stats.queue_seconds),
+        ('password_hash_seconds_total', 'counter', 'Time spent hashing.', stats.hash_seconds),
+        ('password_hash_rejected_total', 'counter', 'Hashes refused because the queue was full.', stats.rejected),
+        ('password_hash_timeouts_total', 'counter', 'Hashes the caller gave up waiting for.', stats.timeouts),
+        ('password_rehashed_total', 'counter', 'Stored passwords upgraded to the preferred hasher on login.', stats.rehashed),
+        ('password_hash_queued', 'gauge', 'Hashes waiting for a worker.', stats.queued),
+        ('password_hash_running', 'gauge', 'Hashes running now.', stats.running),
+    ]
@@ -0,0 +1,193 @@
+"""
+Bulk invitation emails for provisioned cohorts.
+
+start_invitations() splits the recipients into chunks of INVITE_CHUNK_SIZE and
+schedules one users.tasks.send_invite_chunk per chunk. Every message first
+takes a token from one bucket in the shared cache, so all Celery workers
+together stay under INVITE_RATE messages per second however many chunks run
+at once (retries, or a backlog after the workers were down). Each chunk
+issues its OTPs with one bulk write (OTPStore.issue_many) just before sending,
+so codes do not expire while earlier chunks go out, renders the messages from
+emails/invite.txt and sends them over a single SMTP connection.
+
+Progress is kept in the cache per job and per chunk. The job id is derived
+from the recipients and OTP type, so starting the same job again skips the
+chunks (and, within a chunk, the recipients) that were already sent.
+"""
+import hashlib
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+
+from .mail import get_mail_queue
+from .otp_store import get_otp_store
+from .throttling import take_token
+
+
+logger = logging.getLogger('users')
+
+# Provisioned users already exist, so a signup OTP could never be verified
+INVITE_OTP_TYPES = ('reset_password', 'login')
+SUBJECTS = {
+    'reset_password': "Your account is ready",
+    'login': "Your account is ready: sign-in code",
+}
+# Failed recipients listed by invite_progress(); the rest are only counted
+MAX_REPORTED_FAILURES = 100
+# Token bucket (users.throttling) shared by every chunk of every job
+SEND_BUCKET_KEY = 'throttle:invites'
+# Held while a token is taken from it (see wait_for_send_slot)
+SEND_LOCK_KEY = 'throttle:invites:lock'
+# Messages between saves of a chunk's progress; a worker killed mid-chunk
+# re-sends at most this many when the task is redelivered
+CHECKPOINT_EVERY = 20
+
+
+def invite_job_id(emails, otp_type):
+    return hashlib.sha256('\n'.join([otp_type, *sorted(emails)]).encode()).hexdigest()[:16]
+
+
+def job_key(job_id):
+    return f"invites:{job_id}"
+
+
+def chunk_key(job_id, index):
+    return f"invites:{job_id}:chunk:{index}"
+
+
+def start_invitations(emails, otp_type='reset_password'):
+    """
+    Schedule invite emails to ``emails`` and return the job id. Chunks that
+    an earlier run of the same job finished are not scheduled again.
+    """
+    from .tasks import send_invite_chunk
+
+    if otp_type not in INVITE_OTP_TYPES:
+        raise ValueError(f"otp_type must be one of {', '.join(INVITE_OTP_TYPES)}")
+
+    # Sorted so every run of a job cuts the same chunks
+    emails = sorted({email.strip().lower() for email in emails if email.strip()})
+    job_id = invite_job_id(emails, otp_type)
+    size = settings.INVITE_CHUNK_SIZE
+    chunks = [emails[i:i + size] for i in range(0, len(emails), size)]
+    cache.add(
+        job_key(job_id),
+        {'otp_type': otp_type, 'total': len(emails), 'chunks': len(chunks), 'created_at': time.time()},
+        settings.INVITE_JOB_TTL,
+    )
+
+    records = cache.get_many([chunk_key(job_id, i) for i in range(len(chunks))])
+    pending = [i for i in range(len(chunks)) if not records.get(chunk_key(job_id, i), {}).get('done')]
+    # The shared bucket enforces INVITE_RATE; staggered starts just keep chunks
+    # from queueing on it all at once
+    spacing = size / settings.INVITE_RATE
+    for slot, index in enumerate(pending):
+        send_invite_chunk.apply_async((job_id, index, chunks[index], otp_type), countdown=slot * spacing)
+
+    logger.info(f"Invite job {job_id}: {len(emails)} recipients, {len(pending)} of {len(chunks)} chunks scheduled")
+    return job_id
+
+
+def render_invite(email, code, otp_type):
+    body = render_to_string('emails/invite.txt', {
+        'email': email,
+        'code': code,
+        'otp_type': otp_type,
+        'ttl_minutes': settings.OTP_TTL // 60,
+    })
+    return EmailMessage(subject=SUBJECTS[otp_type], body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=[email])
+
+
+def wait_for_send_slot():
+    # Capacity of one second's worth of messages, refilled at INVITE_RATE. Every
+    # worker sends flat out, so take_token runs under a lock (cache.add is
+    # atomic); unlocked, concurrent takes overwrite each other's and the rate
+    # is exceeded. The lock expires on its own if its holder dies.
+    capacity = max(settings.INVITE_RATE, 1)
+    while True:
+        if not cache.add(SEND_LOCK_KEY, 1, timeout=1):
+            time.sleep(0.001)
+            continue
+        try:
+            wait = take_token({SEND_BUCKET_KEY: (capacity, capacity / settings.INVITE_RATE)})
+        finally:
+            cache.delete(SEND_LOCK_KEY)
+        if wait is None:
+            return
+        time.sleep(wait)
+
+
+def send_chunk(job_id, index, emails, otp_type):
+    """
+    Send one chunk over one SMTP connection, paced by the shared bucket. Refused
+    recipients are recorded as failed; connection errors propagate so the
+    task can retry, and the retry skips recipients already sent. Progress is
+    saved every CHECKPOINT_EVERY messages, so a redelivery after the worker
+    was killed does not start the chunk over. Returns the chunk record.
+    """
+    key = chunk_key(job_id, index)
+    record = cache.get(key) or {'sent': [], 'failed': [], 'done': False}
+    if record['done']:
+        return record
+    handled = set(record['sent']) | set(record['failed'])
+    remaining = [email for email in emails if email not in handled]
+
+    codes = get_otp_store().issue_many(remaining, otp_type)
+    messages = [render_invite(email, code, otp_type) for email, code in codes.items()]
+
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    started = time.monotonic()
+    sent_before = len(record['sent'])
+    try:
+        for n, message in enumerate(messages):
+            wait_for_send_slot()
+            try:
+                connection.send_messages([message])
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                # This recipient only; anything else (e.g. a dropped session) ends the chunk for a retry
+                record['failed'].append(message.to[0])
+                logger.warning(f"Invite job {job_id}: sending to {message.to[0]} failed: {e}")
+            else:
+                record['sent'].append(message.to[0])
+            if (n + 1) % CHECKPOINT_EVERY == 0:
+                cache.set(key, record, settings.INVITE_JOB_TTL)
+        record['done'] = True
+    finally:
+        connection.close()
+        cache.set(key, record, settings.INVITE_JOB_TTL)
+        elapsed = time.monotonic() - started
+        get_mail_queue().record(
+            sent_total=len(record['sent']) - sent_before,
+            batches_total=1,
+            send_seconds_total=elapsed,
+        )
+        logger.info(f"Invite job {job_id} chunk {index}: {len(record['sent'])} sent, {len(record['failed'])} failed in {elapsed:.1f}s")
+    return record
+
+
+def invite_progress(job_id):
+    # None for an unknown (or expired) job
+    job = cache.get(job_key(job_id))
+    if job is None:
+        return None
+    records = cache.get_many([chunk_key(job_id, i) for i in range(job['chunks'])]).values()
+    failed = [email for record in records for email in record['failed']]
+    chunks_done = sum(1 for record in records if record['done'])
+    return {
+        'job': job_id,
+        'otp_type': job['otp_type'],
+        'total': job['total'],
+        'sent': sum(len(record['sent']) for record in records),
+        'failed': len(failed),
+        'failed_emails': failed[:MAX_REPORTED_FAILURES],
+        'chunks': job['chunks'],
+        'chunks_done': chunks_done,
+        'complete': chunks_done == job['chunks'],
+        'seconds': round(time.time() - job['created_at'], 1),
+    }
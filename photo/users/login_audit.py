@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from .signals import get_client_ip
+from .utils import load_backend, get_redis
+
+
+AUDIT_FIELDS = ('last_login', 'last_login_ip', 'last_login_device')
+
+
+class BaseLoginAuditBuffer:
+    """
+    Write-behind buffer for the login bookkeeping columns on User.
+    Later writes for the same user and field overwrite earlier ones, so a
+    drain only ever returns the latest state per user. Login history events
+    are appended alongside and never coalesced.
+    """
+
+    def record(self, email, event=None, **fields):
+        raise NotImplementedError
+
+    def draining(self):
+        """
+        Context manager yielding ({email: {field: value}}, [event, ...]). The
+        entries leave the buffer only when the block exits cleanly; if it
+        raises, the next drain yields them again (at-least-once).
+        """
+        raise NotImplementedError
+
+
+class RedisLoginAuditBuffer(BaseLoginAuditBuffer):
+    # One hash, field "<email>\x1f<column>", so HSET coalesces per user and column
+    key = 'login_audit:pending'
+    # Login history events, one JSON document per list entry
+    events_key = 'login_audit:events'
+    # Taken keys live here until their flush commits; one flush at a time
+    flushing_prefix = 'login_audit:flushing'
+    lock_key = 'login_audit:flush_lock'
+
+    def record(self, email, event=None, **fields):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(self.key, mapping={f"{email}\x1f{name}": json.dumps(value) for name, value in fields.items()})
+        if event is not None:
+            pipe.rpush(self.events_key, json.dumps(event))
+        pipe.execute()
+
+    def take(self, client, key, kind):
+        # Atomically move the key aside so new logins start a fresh one. The name
+        # sorts by time, so leftovers from failed flushes are replayed in order.
+        flushing = f"{self.flushing_prefix}:{kind}:{time.time_ns():020d}"
+        try:
+            client.rename(key, flushing)
+        except redis.ResponseError:
+            pass  # nothing buffered
+        # Keys left behind by flushes that failed (or by a worker that died) come first
+        return sorted(k.decode() for k in client.scan_iter(f"{self.flushing_prefix}:{kind}:*"))
+
+    @contextmanager
+    def draining(self):
+        client = get_redis()
+        lock = client.lock(self.lock_key, timeout=settings.LOGIN_AUDIT_FLUSH_TIMEOUT, blocking=False)
+        if not lock.acquire():
+            # Another flush is still running; it owns the keys being flushed
+            yield {}, []
+            return
+        try:
+            pending_keys = self.take(client, self.key, 'pending')
+            event_keys = self.take(client, self.events_key, 'events')
+
+            pipe = client.pipeline(transaction=False)
+            for flushing in pending_keys:
+                pipe.hgetall(flushing)
+            for flushing in event_keys:
+                pipe.lrange(flushing, 0, -1)
+            results = pipe.execute()
+
+            pending, events = {}, []
+            for raw in results[:len(pending_keys)]:
+                # Later hashes overwrite earlier ones, like HSET would have
+                for field, value in raw.items():
+                    email, name = field.decode().split('\x1f', 1)
+                    pending.setdefault(email, {})[name] = json.loads(value)
+            for raw in results[len(pending_keys):]:
+                events += [json.loads(value) for value in raw]
+
+            yield pending, events
+
+            if pending_keys or event_keys:
+                client.delete(*pending_keys, *event_keys)
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                pass  # expired while flushing; the next flush takes it
+
+
+class InMemoryLoginAuditBuffer(BaseLoginAuditBuffer):
+    # Process-local buffer for tests and benchmarks
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._events = []
+
+    def record(self, email, event=None, **fields):
+        with self._lock:
+            self._pending.setdefault(email, {}).update(fields)
+            if event is not None:
+                self._events.append(event)
+
+    @contextmanager
+    def draining(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, []
+        try:
+            yield pending, events
+        except BaseException:
+            # Put them back; anything recorded since is newer and wins
+            with self._lock:
+                for email, fields in pending.items():
+                    self._pending[email] = {**fields, **self._pending.get(email, {})}
+                self._events[:0] = events
+            raise
+
+
+def get_login_audit_buffer():
+    return load_backend(settings.LOGIN_AUDIT_BACKEND)
+
+
+def record_login(request, user, method='session'):
+    """
+    Buffer last_login, IP and device for ``user`` plus a LoginEvent for the
+    login history; users.tasks.flush_login_audit writes them in bulk.
+    """
+    now = timezone.now().isoformat()
+    ip = get_client_ip(request)
+    device = request.META.get('HTTP_USER_AGENT', '')[:255]
+    get_login_audit_buffer().record(
+        user.pk,
+        event={'user_email': user.pk, 'created_at': now, 'ip': ip, 'device': device, 'method': method},
+        last_login=now,
+        last_login_ip=ip,
+        last_login_device=device,
+    )
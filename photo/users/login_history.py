@@ -0,0 +1,158 @@
+import logging
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .cleanup import delete_in_batches
+from .models import LoginEvent
+from .signals import clean_ip
+
+
+logger = logging.getLogger('users')
+
+TABLE = LoginEvent._meta.db_table
+EVENT_FIELDS = ('user_email', 'created_at', 'ip', 'device', 'method')
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month_start):
+    # p202610 holds rows with created_at before 2026-11-01 (and after the previous partition)
+    return f"p{month_start:%Y%m}"
+
+
+def partition_clause(month_start):
+    upper = add_months(month_start, 1)
+    return f"PARTITION {partition_name(month_start)} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}'))"
+
+
+def is_partitioned():
+    return connection.vendor == 'mysql'
+
+
+def existing_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL",
+            [TABLE],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_future_partitions(months_ahead=None):
+    """
+    Split the catch-all pmax partition so every month up to ``months_ahead``
+    from now has its own partition. Returns the partitions added.
+    """
+    if not is_partitioned():
+        return []
+    months_ahead = settings.LOGIN_HISTORY_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+
+    existing = existing_partitions()
+    this_month = timezone.now().date().replace(day=1)
+    missing = [
+        month for month in (add_months(this_month, n) for n in range(months_ahead + 1))
+        if partition_name(month) not in existing
+    ]
+    if missing:
+        clauses = ', '.join(partition_clause(month) for month in missing)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {TABLE} REORGANIZE PARTITION pmax INTO "
+                f"({clauses}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            )
+        logger.info(f"Login history: added partitions {', '.join(partition_name(m) for m in missing)}")
+    return [partition_name(month) for month in missing]
+
+
+def drop_expired_partitions(retention_months=None):
+    """
+    Drop whole monthly partitions older than the retention window. On databases
+    without partitioning, fall back to chunked deletes.
+    """
+    retention_months = settings.LOGIN_HISTORY_RETENTION_MONTHS if retention_months is None else retention_months
+    cutoff = add_months(timezone.now().date().replace(day=1), -retention_months)
+
+    if not is_partitioned():
+        cutoff = timezone.make_aware(datetime.combine(cutoff, time.min))
+        delete_in_batches(LoginEvent.objects.filter(created_at__lt=cutoff), 'login_event')
+        return []
+
+    expired = sorted(
+        name for name in existing_partitions()
+        if name != 'pmax' and name < partition_name(cutoff)
+    )
+    if expired:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {TABLE} DROP PARTITION {', '.join(expired)}")
+        logger.info(f"Login history: dropped partitions {', '.join(expired)}")
+    return expired
+
+
+def recent_logins(email, limit=10, since=None):
+    """
+    Last ``limit`` logins for ``email``, newest first. Served by
+    loginevent_user_recent_idx; the created_at bound lets MySQL prune
+    partitions outside the retention window.
+    """
+    if since is None:
+        since = timezone.now() - timedelta(days=31 * settings.LOGIN_HISTORY_RETENTION_MONTHS)
+    return list(
+        LoginEvent.objects.filter(user_email=email, created_at__gte=since)
+        .order_by('-created_at')
+        .values('created_at', 'ip', 'device', 'method')[:limit]
+    )
+
+
+def clean_event(event):
+    """
+    The LoginEvent for one buffered event, or None (logged) when it cannot be
+    stored, so one malformed event does not fail the whole flush.
+    """
+    try:
+        values = {name: event.get(name) for name in EVENT_FIELDS}
+        if isinstance(values['created_at'], str):
+            values['created_at'] = datetime.fromisoformat(values['created_at'])
+        values['ip'] = clean_ip(values['ip']) if values['ip'] else None
+        values['device'] = str(values['device'] or '')[:255]
+        row = LoginEvent(**values)
+        row.full_clean()
+    except (AttributeError, TypeError, ValueError, ValidationError) as e:
+        logger.warning(f"Login history: dropping malformed event {event!r}: {e}")
+        return None
+    return row
+
+
+def ingest(events, batch_size=1000):
+    """
+    Store buffered events (dicts of LoginEvent field values) and return how
+    many were stored. If the batch insert still hits bad data, the rows are
+    inserted one at a time and only the offending ones are dropped; any other
+    database error propagates so the flush is retried.
+    """
+    rows = [row for row in map(clean_event, events) if row is not None]
+    try:
+        with transaction.atomic():
+            LoginEvent.objects.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+    except (DataError, IntegrityError):
+        logger.exception("Login history: batch insert failed, inserting row by row")
+
+    stored = 0
+    for row in rows:
+        row.pk = None
+        try:
+            with transaction.atomic():
+                row.save(force_insert=True)
+        except (DataError, IntegrityError) as e:
+            logger.warning(f"Login history: dropping event for {row.user_email}: {e}")
+            continue
+        stored += 1
+    return stored
@@ -0,0 +1,451 @@
+import json
+import smtplib
+import time
+import logging
+import threading
+import uuid
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+from redis import RedisError
+
+from .models import EmailOutbox
+from .otp_store import generate_otp_code, get_otp_store
+from .utils import load_backend, get_redis
+
+
+logger = logging.getLogger('users')
+
+
+def retry_delay(attempts):
+    # Seconds before a failed message is tried again
+    return min(settings.MAIL_RETRY_BACKOFF * 2 ** attempts, 300)
+
+
+class BaseMailQueue:
+    """
+    Storage for outgoing mail waiting to be delivered by the drain_mail_queue task.
+    Messages are plain dicts so they survive JSON round-trips.
+    """
+
+    def push(self, message):
+        # Also counts the message in the enqueued_total counter
+        raise NotImplementedError
+
+    def pop_batch(self, size):
+        raise NotImplementedError
+
+    def requeue(self, messages):
+        # Failed messages, to be handed out again after retry_delay(attempts)
+        raise NotImplementedError
+
+    def ack(self, messages):
+        # Messages sent (or dropped) by send_batch
+        pass
+
+    def depth(self):
+        raise NotImplementedError
+
+    def claim_drain(self, window):
+        # True when the caller should schedule a drain (coalesces bursts into one batch)
+        raise NotImplementedError
+
+    def release_drain(self):
+        raise NotImplementedError
+
+    def record(self, **counters):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class RedisMailQueue(BaseMailQueue):
+    """
+    Message bodies live in a hash keyed by message id; the queue, the retry
+    schedule and the batches being sent hold ids only. pop_batch moves ids
+    into a processing set with a MAIL_OUTBOX_LEASE deadline and ack() removes
+    them after the send, so a batch whose drain dies is handed out again once
+    the lease runs out instead of being lost.
+    """
+
+    queue_key = 'mail:ready'
+    processing_key = 'mail:processing'  # id -> lease deadline
+    delayed_key = 'mail:delayed'  # id -> time it may be retried
+    messages_key = 'mail:messages'
+    drain_key = 'mail:drain_scheduled'
+    stats_key = 'mail:stats'
+
+    # KEYS: queue, processing, delayed, messages; ARGV: now, size, lease deadline.
+    # Expired leases go back to the head of the queue, due retries to its tail.
+    claim_script = """
+    local expired = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1])
+    for i = #expired, 1, -1 do
+        redis.call('lpush', KEYS[1], expired[i])
+    end
+    redis.call('zremrangebyscore', KEYS[2], '-inf', ARGV[1])
+    local due = redis.call('zrangebyscore', KEYS[3], '-inf', ARGV[1])
+    for _, id in ipairs(due) do
+        redis.call('rpush', KEYS[1], id)
+    end
+    redis.call('zremrangebyscore', KEYS[3], '-inf', ARGV[1])
+    local batch = {}
+    for i = 1, tonumber(ARGV[2]) do
+        local id = redis.call('lpop', KEYS[1])
+        if not id then
+            break
+        end
+        redis.call('zadd', KEYS[2], ARGV[3], id)
+        batch[#batch + 1] = id
+    end
+    if #batch == 0 then
+        return {}
+    end
+    return redis.call('hmget', KEYS[4], unpack(batch))
+    """
+
+    def __init__(self):
+        self._claim = None
+
+    def push(self, message):
+        message = dict(message, id=uuid.uuid4().hex)
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.hset(self.messages_key, message['id'], json.dumps(message))
+        pipe.rpush(self.queue_key, message['id'])
+        pipe.hincrbyfloat(self.stats_key, 'enqueued_total', 1)
+        pipe.execute()
+
+    def pop_batch(self, size):
+        if self._claim is None:
+            self._claim = get_redis().register_script(self.claim_script)
+        now = time.time()
+        raw = self._claim(
+            keys=[self.queue_key, self.processing_key, self.delayed_key, self.messages_key],
+            args=[now, size, now + settings.MAIL_OUTBOX_LEASE],
+        )
+        return [json.loads(item) for item in raw if item]
+
+    def requeue(self, messages):
+        if not messages:
+            return
+        now = time.time()
+        pipe = get_redis().pipeline(transaction=True)
+        for item in messages:
+            pipe.hset(self.messages_key, item['id'], json.dumps(item))
+            pipe.zrem(self.processing_key, item['id'])
+            pipe.zadd(self.delayed_key, {item['id']: now + retry_delay(item['attempts'])})
+        pipe.execute()
+
+    def ack(self, messages):
+        if not messages:
+            return
+        ids = [item['id'] for item in messages]
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.zrem(self.processing_key, *ids)
+        pipe.hdel(self.messages_key, *ids)
+        pipe.execute()
+
+    def depth(self):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.llen(self.queue_key)
+        pipe.zcard(self.delayed_key)
+        pipe.zcard(self.processing_key)
+        return sum(pipe.execute())
+
+    def claim_drain(self, window):
+        return bool(get_redis().set(self.drain_key, 1, nx=True, ex=max(int(window), 1)))
+
+    def release_drain(self):
+        get_redis().delete(self.drain_key)
+
+    def record(self, **counters):
+        pipe = get_redis().pipeline(transaction=False)
+        for name, value in counters.items():
+            pipe.hincrbyfloat(self.stats_key, name, value)
+        pipe.execute()
+
+    def stats(self):
+        raw = get_redis().hgetall(self.stats_key)
+        return {key.decode(): float(value) for key, value in raw.items()}
+
+
+class InMemoryMailQueue(BaseMailQueue):
+    """
+    Process-local queue for tests and benchmarks. Only useful together with
+    CELERY_TASK_ALWAYS_EAGER, since a separate worker cannot see it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._delayed = []  # (time it may be retried, message)
+        self._stats = {}
+
+    def push(self, message):
+        with self._lock:
+            self._queue.append(message)
+            self._stats['enqueued_total'] = self._stats.get('enqueued_total', 0.0) + 1
+
+    def pop_batch(self, size):
+        now = time.monotonic()
+        with self._lock:
+            self._queue.extend(message for available_at, message in self._delayed if available_at <= now)
+            self._delayed = [(available_at, message) for available_at, message in self._delayed if available_at > now]
+            return [self._queue.popleft() for _ in range(min(size, len(self._queue)))]
+
+    def requeue(self, messages):
+        now = time.monotonic()
+        with self._lock:
+            self._delayed.extend((now + retry_delay(message['attempts']), message) for message in messages)
+
+    def depth(self):
+        return len(self._queue) + len(self._delayed)
+
+    def claim_drain(self, window):
+        return True
+
+    def release_drain(self):
+        pass
+
+    def record(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self._stats[name] = self._stats.get(name, 0.0) + value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class OutboxMailQueue(RedisMailQueue):
+    """
+    Messages are EmailOutbox rows, so enqueue_mail inside a transaction is
+    committed (or rolled back) with the rest of the request's writes. Nothing
+    is scheduled on enqueue: run_mail_dispatcher processes poll the table and
+    claim batches with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them
+    can run side by side without sending a message twice. A claim is a lease:
+    available_at moves MAIL_OUTBOX_LEASE seconds ahead, and rows of a
+    dispatcher that dies mid-batch become claimable again when it runs out.
+    Counters stay in Redis, shared by every dispatcher, but only on a best
+    effort basis so that sending mail depends on the database alone.
+    """
+
+    def push(self, message):
+        EmailOutbox.objects.create(
+            subject=message['subject'],
+            body=message['body'],
+            from_email=message['from_email'],
+            to=message['to'],
+        )
+
+    def pop_batch(self, size):
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                EmailOutbox.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', available_at__lte=now)
+                .order_by('available_at')[:size]
+            )
+            EmailOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+                available_at=now + timedelta(seconds=settings.MAIL_OUTBOX_LEASE)
+            )
+        return [
+            {
+                'id': row.pk,
+                'subject': row.subject,
+                'body': row.body,
+                'from_email': row.from_email,
+                'to': row.to,
+                'enqueued_at': row.created_at.timestamp(),
+                'attempts': row.attempts,
+            }
+            for row in rows
+        ]
+
+    def requeue(self, messages):
+        # Failures are rare, so one UPDATE per message is fine
+        now = timezone.now()
+        for item in messages:
+            EmailOutbox.objects.filter(pk=item['id']).update(
+                attempts=item['attempts'],
+                available_at=now + timedelta(seconds=retry_delay(item['attempts'])),
+                last_error=item.get('error', ''),
+            )
+
+    def ack(self, messages):
+        now = timezone.now()
+        sent = [item['id'] for item in messages if not item.get('dropped')]
+        dropped = [item for item in messages if item.get('dropped')]
+        if sent:
+            EmailOutbox.objects.filter(pk__in=sent).update(status='sent', sent_at=now)
+        for item in dropped:
+            EmailOutbox.objects.filter(pk=item['id']).update(
+                status='failed', attempts=item['attempts'], last_error=item.get('error', ''),
+            )
+
+    def depth(self):
+        return EmailOutbox.objects.filter(status='pending').count()
+
+    def record(self, **counters):
+        try:
+            super().record(**counters)
+        except RedisError as e:
+            logger.warning(f"Mail counters not recorded: {e}")
+
+    def stats(self):
+        try:
+            stats = super().stats()
+        except RedisError as e:
+            logger.warning(f"Mail counters unavailable: {e}")
+            stats = {}
+        # Counted from the table rather than with a Redis call per enqueue: the
+        # rows still there plus those cleanup_mail_outbox has deleted
+        stats['enqueued_total'] = stats.get('outbox_deleted_total', 0.0) + EmailOutbox.objects.count()
+        return stats
+
+    def claim_drain(self, window):
+        # Dispatchers poll the table; there is no drain task to schedule
+        return False
+
+    def release_drain(self):
+        pass
+
+
+def get_mail_queue():
+    return load_backend(settings.MAIL_QUEUE_BACKEND)
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Queue an email for the background dispatcher and return immediately.
+    Takes the same arguments as django.core.mail.send_mail.
+    """
+    from .tasks import drain_mail_queue
+
+    queue = get_mail_queue()
+    queue.push({
+        'subject': subject,
+        'body': message,
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+        'to': list(recipient_list),
+        'enqueued_at': time.time(),
+        'attempts': 0,
+    })
+
+    # Only the first enqueue in a batch window schedules a drain
+    if queue.claim_drain(settings.MAIL_BATCH_WINDOW):
+        drain_mail_queue.apply_async(countdown=settings.MAIL_BATCH_WINDOW)
+
+
+def send_otp_mail(email, otp_type, subject, message):
+    """
+    Issue an OTP and queue its email so that the code never exists without
+    its message. With DatabaseOTPStore both rows are written in one
+    transaction; other stores only get the code once the queued message has
+    committed. ``message`` is formatted with ``code``. Returns the code.
+    """
+    store = get_otp_store()
+    with transaction.atomic():
+        if store.transactional:
+            code = store.issue(email, otp_type)
+        else:
+            code = generate_otp_code()
+            transaction.on_commit(lambda: store.issue(email, otp_type, code=code))
+        enqueue_mail(subject, message.format(code=code), [email])
+    return code
+
+
+def is_connection_error(e):
+    # The session is gone (as opposed to one message being refused); nothing
+    # more can be sent over this connection
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code == 421  # service closing the transmission channel
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+def send_batch(connection, batch):
+    """
+    Send a batch over an already open connection.
+    Returns the messages that failed and should be retried later; the rest
+    (sent, or dropped after MAIL_MAX_RETRIES) are passed to the queue's ack().
+    A connection-level error ends the batch: the messages after it were never
+    tried, so they are returned too, without an attempt counted against them.
+    """
+    queue = get_mail_queue()
+    failed = []
+    untried = []
+    done = []
+    sent = 0
+    queue_seconds = 0.0
+    started = time.monotonic()
+
+    for n, item in enumerate(batch):
+        email = EmailMessage(
+            subject=item['subject'],
+            body=item['body'],
+            from_email=item['from_email'],
+            to=item['to'],
+            connection=connection,
+        )
+        try:
+            email.send()
+        except Exception as e:
+            item['attempts'] += 1
+            item['error'] = str(e)
+            if item['attempts'] < settings.MAIL_MAX_RETRIES:
+                failed.append(item)
+            else:
+                logger.error(f"Giving up on email to {item['to']} after {item['attempts']} attempts: {e}")
+                item['dropped'] = True
+                done.append(item)
+                queue.record(dropped_total=1)
+            if is_connection_error(e):
+                untried = batch[n + 1:]
+                logger.warning(f"Mail connection lost, {len(untried)} messages left untried: {e}")
+                queue.record(connection_errors_total=1)
+                break
+            continue
+        done.append(item)
+        sent += 1
+        queue_seconds += time.time() - item['enqueued_at']
+
+    elapsed = time.monotonic() - started
+    queue.ack(done)
+    queue.record(
+        sent_total=sent,
+        failed_total=len(failed),
+        batches_total=1,
+        send_seconds_total=elapsed,
+        queue_seconds_total=queue_seconds,
+    )
+    logger.info(f"Mail batch: {sent} sent, {len(failed) + len(untried)} to retry in {elapsed:.3f}s")
+    return failed + untried
+
+
+def mail_queue_metrics():
+    # Collector for core.metrics.registry
+    stats = mail_queue_stats()
+    yield 'mail_queue_depth', 'gauge', 'Messages waiting to be sent.', stats['depth']
+    yield 'mail_sent_total', 'counter', 'Messages delivered.', stats.get('sent_total', 0.0)
+    yield 'mail_failed_total', 'counter', 'Send attempts that failed and were retried.', stats.get('failed_total', 0.0)
+    yield 'mail_dropped_total', 'counter', 'Messages dropped after MAIL_MAX_RETRIES.', stats.get('dropped_total', 0.0)
+    yield 'mail_send_seconds_total', 'counter', 'Time spent talking to the SMTP server.', stats.get('send_seconds_total', 0.0)
+    yield 'mail_queue_seconds_total', 'counter', 'Enqueue-to-delivery time of sent messages.', stats.get('queue_seconds_total', 0.0)
+
+
+def mail_queue_stats():
+    queue = get_mail_queue()
+    stats = queue.stats()
+    sent = stats.get('sent_total', 0.0)
+    batches = stats.get('batches_total', 0.0)
+    stats['depth'] = queue.depth()
+    stats['avg_send_seconds'] = stats.get('send_seconds_total', 0.0) / sent if sent else 0.0
+    stats['avg_queue_seconds'] = stats.get('queue_seconds_total', 0.0) / sent if sent else 0.0
+    stats['avg_batch_size'] = sent / batches if batches else 0.0
+    return stats
@@ -0,0 +1,160 @@
+import json
+import re
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.urls import reverse
+
+
+PASSWORD = 'Bench-Passw0rd!'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the /account/ API through signup -> otp-verify -> set-password -> login -> "
+        "token refresh -> logout with concurrent in-process clients and report throughput, "
+        "latency percentiles and DB queries per request. "
+        "Run with --settings=photo.settings_bench (SQLite, locmem cache and email)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of account flows to run')
+        parser.add_argument('--concurrency', type=int, default=4, help='Flows running in parallel')
+        parser.add_argument('--refreshes', type=int, default=1, help='Token refreshes per flow')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+        parser.add_argument('--allow-errors', action='store_true', help='Do not fail when a request errors')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_account_flow creates accounts; run it with --settings=photo.settings_bench")
+
+        setup_test_environment()
+        call_command('migrate', verbosity=0)
+
+        self.run_id = uuid.uuid4().hex[:8]
+        self.samples = defaultdict(list)  # step -> [(ms, queries, status)]
+        self.lock = threading.Lock()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            futures = [pool.submit(self.run_flow, n, options['refreshes']) for n in range(options['users'])]
+            failures = [f.exception() for f in futures if f.exception()]
+        wall = time.perf_counter() - started
+
+        report = self.build_report(wall, options, failures)
+        self.print_report(report, failures)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+        if (report['errors'] or failures) and not options['allow_errors']:
+            raise CommandError(f"{report['errors']} requests failed, {len(failures)} of {options['users']} flows did not finish")
+
+    def request(self, client, step, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            try:
+                response = client.post(url, data, content_type='application/json')
+            except Exception:
+                # e.g. "database is locked": an error with no status
+                with self.lock:
+                    self.samples[step].append(((time.perf_counter() - started) * 1000, len(queries), None))
+                raise
+            elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.samples[step].append((elapsed, len(queries), response.status_code))
+        if response.status_code >= 400:
+            raise RuntimeError(f"{step} returned {response.status_code}: {response.content[:200]!r}")
+        return response
+
+    def read_otp(self, email):
+        for message in reversed(mail.outbox):
+            if email in message.to:
+                return re.search(r'\b(\d{6})\b', message.body).group(1)
+        raise RuntimeError(f"No OTP email for {email}")
+
+    def run_flow(self, n, refreshes):
+        client = Client()
+        email = f'bench{n}-{self.run_id}@narayanagroup.com'
+        try:
+            self.request(client, 'signup', reverse('users:signup'), {'name': f'Bench {n}', 'email': email})
+            self.request(client, 'otp-verify', reverse('users:otp-verify'), {'email': email, 'otp': self.read_otp(email)})
+            self.request(client, 'set-password', reverse('users:set-password'), {'email': email, 'password': PASSWORD})
+            self.request(client, 'login-status', reverse('users:login'), {'email': email})
+            self.request(client, 'login', reverse('users:login'), {'email': email, 'password': PASSWORD})
+
+            refresh = client.cookies['refresh_token'].value
+            for _ in range(refreshes):
+                response = self.request(client, 'token-refresh', reverse('users:token_refresh'), {'refresh': refresh})
+                refresh = response.json().get('refresh', refresh)
+
+            self.request(client, 'logout', reverse('users:logout'), {})
+        finally:
+            connection.close()
+
+    def build_report(self, wall, options, failures):
+        steps = {}
+        total = errors = 0
+        for step, samples in self.samples.items():
+            latencies = [ms for ms, _, _ in samples]
+            queries = [q for _, q, _ in samples]
+            step_errors = sum(1 for _, _, code in samples if code is None or code >= 400)
+            total += len(samples)
+            errors += step_errors
+            steps[step] = {
+                'requests': len(samples),
+                'errors': step_errors,
+                'p50_ms': round(statistics.median(latencies), 2),
+                'p90_ms': round(percentile(latencies, 90), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'max_ms': round(max(latencies), 2),
+                'queries_per_request': round(statistics.mean(queries), 2),
+            }
+        return {
+            'users': options['users'],
+            'concurrency': options['concurrency'],
+            'wall_seconds': round(wall, 3),
+            'requests': total,
+            'errors': errors,
+            'requests_per_second': round(total / wall, 2) if wall else 0.0,
+            'completed_flows': options['users'] - len(failures),
+            'failed_flows': len(failures),
+            'flows_per_second': round((options['users'] - len(failures)) / wall, 2) if wall else 0.0,
+            'steps': steps,
+        }
+
+    def print_report(self, report, failures):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['users']} flows, concurrency {report['concurrency']}, {report['wall_seconds']}s"
+        ))
+        self.stdout.write(
+            f"{'step':<15}{'reqs':>7}{'err':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'queries':>9}"
+        )
+        for step, row in report['steps'].items():
+            self.stdout.write(
+                f"{step:<15}{row['requests']:>7}{row['errors']:>6}{row['p50_ms']:>10}{row['p90_ms']:>10}"
+                f"{row['p99_ms']:>10}{row['max_ms']:>10}{row['queries_per_request']:>9}"
+            )
+        self.stdout.write(
+            f"Total {report['requests']} requests, {report['errors']} errors, "
+            f"{report['completed_flows']}/{report['users']} flows completed, "
+            f"{report['requests_per_second']} req/s, {report['flows_per_second']} flows/s"
+        )
+        for failure in failures[:5]:
+            self.stderr.write(str(failure))
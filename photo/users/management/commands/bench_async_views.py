@@ -0,0 +1,187 @@
+import asyncio
+import json
+import re
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from .bench_account_flow import PASSWORD, percentile
+
+
+NEW_PASSWORD = 'Bench-Passw0rd!2'
+
+# (step, url name without the async- prefix, payload builder)
+FLOW = [
+    ('signup', 'signup', lambda email, otp: {'name': 'Bench', 'email': email}),
+    ('otp-verify', 'otp-verify', lambda email, otp: {'email': email, 'otp': otp}),
+    ('set-password', 'set-password', lambda email, otp: {'email': email, 'password': PASSWORD}),
+    ('login', 'login', lambda email, otp: {'email': email, 'password': PASSWORD}),
+    ('login-otp-request', 'login-otp-request', lambda email, otp: {'email': email}),
+    ('login-otp', 'login', lambda email, otp: {'email': email, 'otp': otp}),
+    ('reset-request', 'password-reset', lambda email, otp: {'email': email}),
+    ('reset-verify', 'password-reset', lambda email, otp: {'email': email, 'otp': otp}),
+    ('reset', 'password-reset', lambda email, otp: {'email': email, 'otp': otp, 'password': NEW_PASSWORD}),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the signup -> otp-verify -> set-password -> login -> login OTP -> password reset flow "
+        "against the sync DRF views (threads + Client) and the async views (one event loop + "
+        "AsyncClient) and compare throughput and latency per step. "
+        "Run with --settings=photo.settings_bench (SQLite, locmem cache and email)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Number of account flows per mode')
+        parser.add_argument('--concurrency', type=int, default=16, help='Flows in flight at once')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_async_views creates accounts; run it with --settings=photo.settings_bench")
+
+        setup_test_environment()
+        call_command('migrate', verbosity=0)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+
+        modes = ['sync', 'async'] if options['mode'] == 'both' else [options['mode']]
+        report = {'users': options['users'], 'concurrency': options['concurrency'], 'modes': {}}
+        for mode in modes:
+            self.samples = defaultdict(list)  # step -> [(ms, status)]
+            started = time.perf_counter()
+            if mode == 'sync':
+                failures = self.run_sync(options['users'], options['concurrency'])
+            else:
+                failures = asyncio.run(self.run_async(options['users'], options['concurrency']))
+            wall = time.perf_counter() - started
+            report['modes'][mode] = self.build_report(wall, options['users'], failures)
+            for failure in failures[:5]:
+                self.stderr.write(f"{mode}: {failure}")
+
+        self.print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+        completed = {mode: result['completed_flows'] for mode, result in report['modes'].items()}
+        if len(set(completed.values())) > 1:
+            raise CommandError(
+                f"The modes did different amounts of work ({', '.join(f'{m}: {n} flows' for m, n in completed.items())}); "
+                f"the comparison is not meaningful"
+            )
+
+    def url(self, mode, name):
+        return reverse(f'users:{name}' if mode == 'sync' else f'users:async-{name}')
+
+    def read_otp(self, email):
+        for message in reversed(mail.outbox):
+            if email in message.to:
+                return re.search(r'\b(\d{6})\b', message.body).group(1)
+        return None
+
+    def record(self, step, elapsed, response):
+        # A request that raised (e.g. "database is locked") is recorded with no status
+        status = response.status_code if response is not None else None
+        with self.lock:
+            self.samples[step].append((elapsed, status))
+        if status is not None and status >= 400:
+            raise RuntimeError(f"{step} returned {response.status_code}: {response.content[:200]!r}")
+
+    def run_sync(self, users, concurrency):
+        def flow(n):
+            client = Client()
+            email = f'sync{n}-{self.run_id}@narayanagroup.com'
+            try:
+                for step, name, payload in FLOW:
+                    started = time.perf_counter()
+                    try:
+                        response = client.post(self.url('sync', name), payload(email, self.read_otp(email)), content_type='application/json')
+                    except Exception:
+                        self.record(step, (time.perf_counter() - started) * 1000, None)
+                        raise
+                    self.record(step, (time.perf_counter() - started) * 1000, response)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(flow, n) for n in range(users)]
+            return [f.exception() for f in futures if f.exception()]
+
+    async def run_async(self, users, concurrency):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def flow(n):
+            client = AsyncClient()
+            email = f'async{n}-{self.run_id}@narayanagroup.com'
+            async with slots:
+                for step, name, payload in FLOW:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(self.url('async', name), payload(email, self.read_otp(email)), content_type='application/json')
+                    except Exception:
+                        self.record(step, (time.perf_counter() - started) * 1000, None)
+                        raise
+                    self.record(step, (time.perf_counter() - started) * 1000, response)
+
+        results = await asyncio.gather(*(flow(n) for n in range(users)), return_exceptions=True)
+        return [r for r in results if isinstance(r, Exception)]
+
+    def build_report(self, wall, users, failures):
+        steps = {}
+        total = errors = 0
+        for step, samples in self.samples.items():
+            latencies = [ms for ms, _ in samples]
+            step_errors = sum(1 for _, code in samples if code is None or code >= 400)
+            total += len(samples)
+            errors += step_errors
+            steps[step] = {
+                'requests': len(samples),
+                'errors': step_errors,
+                'p50_ms': round(statistics.median(latencies), 2),
+                'p90_ms': round(percentile(latencies, 90), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+            }
+        return {
+            'wall_seconds': round(wall, 3),
+            'requests': total,
+            'errors': errors,
+            'completed_flows': users - len(failures),
+            'failed_flows': len(failures),
+            'requests_per_second': round(total / wall, 2) if wall else 0.0,
+            'flows_per_second': round((users - len(failures)) / wall, 2) if wall else 0.0,
+            'steps': steps,
+        }
+
+    def print_report(self, report):
+        modes = report['modes']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['users']} flows per mode, concurrency {report['concurrency']}"
+        ))
+        header = f"{'step':<19}" + ''.join(f"{f'{mode} p50':>12}{f'{mode} p99':>12}" for mode in modes)
+        self.stdout.write(header)
+        for step, _, _ in FLOW:
+            row = f"{step:<19}"
+            for mode in modes:
+                stats = modes[mode]['steps'].get(step)
+                row += f"{stats['p50_ms']:>12}{stats['p99_ms']:>12}" if stats else f"{'-':>12}{'-':>12}"
+            self.stdout.write(row)
+        for mode, result in modes.items():
+            self.stdout.write(
+                f"{mode}: {result['requests']} requests, {result['errors']} errors, "
+                f"{result['completed_flows']}/{report['users']} flows completed in {result['wall_seconds']}s, "
+                f"{result['requests_per_second']} req/s, {result['flows_per_second']} flows/s"
+            )
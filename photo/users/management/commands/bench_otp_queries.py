@@ -0,0 +1,158 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from users.models import OTP, PendingUser
+
+
+BENCH_DOMAIN = 'bench.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed OTP/PendingUser rows and report latency and EXPLAIN plans for the hot "
+        "OTP lookups and cleanup range queries, with and without the composite indexes. "
+        "The baseline run drops the real indexes, so it only runs against the bench SQLite "
+        "database (--settings=photo.settings_bench) or a MySQL database named with --confirm-database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--otps', type=int, default=1_000_000, help='OTP rows to seed')
+        parser.add_argument('--pending', type=int, default=200_000, help='PendingUser rows to seed')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=50, help='Runs per query')
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse rows from a previous --keep run')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+        parser.add_argument('--no-baseline', action='store_true', help='Do not drop indexes for the "before" run')
+        parser.add_argument('--confirm-database', metavar='NAME',
+                            help='Allow a non-SQLite database; must repeat its NAME. Never point this at production')
+
+    def handle(self, *args, **options):
+        name = connection.settings_dict['NAME']
+        if connection.vendor != 'sqlite' and options['confirm_database'] != name:
+            raise CommandError(
+                f"bench_otp_queries seeds rows and drops the OTP/PendingUser indexes of '{name}' "
+                f"({connection.vendor}); run it with --settings=photo.settings_bench, or pass "
+                f"--confirm-database {name} for a dedicated benchmark database"
+            )
+        self.stdout.write(self.style.WARNING(f"Benchmarking against database '{name}' ({connection.vendor})"))
+
+        if not options['skip_seed']:
+            self.seed(options['otps'], options['pending'], options['batch_size'])
+
+        emails = list(
+            OTP.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').values_list('email', 'code', 'otp_type')[:options['repeat']]
+        )
+        if not emails:
+            self.stderr.write("No seeded rows found; run without --skip-seed first.")
+            return
+
+        indexes = [(OTP, index) for index in OTP._meta.indexes] + [(PendingUser, index) for index in PendingUser._meta.indexes]
+
+        removed = []
+        try:
+            if not options['no_baseline']:
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.remove_index(model, index)
+                        removed.append((model, index))
+                self.run_queries('Before (no composite indexes)', emails)
+                self.restore_indexes(removed)
+            self.run_queries('After (with composite indexes)', emails)
+        finally:
+            # Also on errors and Ctrl-C: the indexes must never stay dropped
+            self.restore_indexes(removed)
+            if not options['keep']:
+                self.cleanup(options['batch_size'])
+
+    def restore_indexes(self, removed):
+        with connection.schema_editor() as editor:
+            while removed:
+                model, index = removed[-1]
+                editor.add_index(model, index)
+                removed.pop()
+
+    def seed(self, otp_count, pending_count, batch_size):
+        now = timezone.now()
+        types = [choice for choice, _ in OTP.OTP_TYPE_CHOICES]
+        started = time.perf_counter()
+
+        for offset in range(0, otp_count, batch_size):
+            rows = [
+                OTP(
+                    email=f'user{i}@{BENCH_DOMAIN}',
+                    code=f"{random.randint(100000, 999999)}",
+                    otp_type=random.choice(types),
+                    is_used=random.random() < 0.3,
+                )
+                for i in range(offset, min(offset + batch_size, otp_count))
+            ]
+            OTP.objects.bulk_create(rows, batch_size=batch_size)
+        # auto_now_add ignores explicit values, so spread created_at over two days afterwards
+        OTP.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').update(created_at=now - timedelta(days=2))
+        OTP.objects.filter(email__endswith=f'@{BENCH_DOMAIN}', is_used=False).update(created_at=now - timedelta(minutes=1))
+
+        for offset in range(0, pending_count, batch_size):
+            rows = [
+                PendingUser(email=f'pending{i}@{BENCH_DOMAIN}', name=f'Pending {i}', otp_verified=random.random() < 0.5)
+                for i in range(offset, min(offset + batch_size, pending_count))
+            ]
+            PendingUser.objects.bulk_create(rows, batch_size=batch_size)
+        PendingUser.objects.filter(email__endswith=f'@{BENCH_DOMAIN}', otp_verified=False).update(created_at=now - timedelta(hours=2))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Seeded {otp_count} OTP and {pending_count} PendingUser rows in {elapsed:.1f}s")
+
+    def run_queries(self, title, samples):
+        now = timezone.now()
+        otp_expiry_time = now - timedelta(minutes=5)
+        pending_user_expiry_time = now - timedelta(hours=1)
+
+        queries = {
+            'otp lookup (latest)': lambda email, code, otp_type: OTP.objects.filter(
+                email=email, code=code, is_used=False, otp_type=otp_type
+            ).order_by('-created_at')[:1],
+            'otp delete by email/type': lambda email, code, otp_type: OTP.objects.filter(email=email, otp_type=otp_type),
+            'expired otp range': lambda *sample: OTP.objects.filter(created_at__lt=otp_expiry_time),
+            'stale pending user range': lambda *sample: PendingUser.objects.filter(
+                otp_verified=False, created_at__lt=pending_user_expiry_time
+            ),
+        }
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{title}"))
+        for name, build in queries.items():
+            timings = []
+            for sample in samples:
+                queryset = build(*sample)
+                started = time.perf_counter()
+                # Range queries are only counted so the benchmark never deletes real rows
+                if 'range' in name:
+                    queryset.count()
+                else:
+                    list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+                if 'range' in name and len(timings) >= 5:
+                    break
+
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"  {name:<28} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms   runs {len(timings)}"
+            )
+            plan = build(*samples[0]).explain()
+            for line in plan.splitlines():
+                self.stdout.write(f"      {line}")
+
+    def cleanup(self, batch_size):
+        for model in (OTP, PendingUser):
+            while True:
+                ids = list(model.objects.filter(email__endswith=f'@{BENCH_DOMAIN}').values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                model.objects.filter(pk__in=ids).delete()
+        self.stdout.write("Removed seeded rows")
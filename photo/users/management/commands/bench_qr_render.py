@@ -0,0 +1,81 @@
+import base64
+import gzip
+import json
+import statistics
+import time
+import uuid
+
+import pyotp
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from users.qr import get_qr, qr_cache_key, render_png, render_svg
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def render_png_base64(data):
+    # What GoogleAuthenticatorRegisterView used to embed in its JSON response
+    return f"data:image/png;base64,{base64.b64encode(render_png(data)).decode()}".encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Google Authenticator QR render paths: inline base64 PNG (old), raw PNG, "
+        "compact SVG, and a cached hit through users.qr.get_qr. Reports latency and payload size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Renders per path')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        # A fresh secret per iteration so nothing is served from a cache by accident
+        uris = [
+            pyotp.TOTP(pyotp.random_base32()).provisioning_uri(name=f'bench{n}@narayanagroup.com', issuer_name="N_IIT_RAW")
+            for n in range(iterations)
+        ]
+
+        cached_uri = f'otpauth://totp/N_IIT_RAW:bench-{uuid.uuid4().hex[:8]}?secret={pyotp.random_base32()}'
+        paths = {
+            'png-base64': render_png_base64,
+            'png': render_png,
+            'svg': render_svg,
+            'svg-pool': lambda data: get_qr(data, 'svg'),
+            'svg-cached': lambda data: get_qr(cached_uri, 'svg'),
+        }
+
+        report = {}
+        for name, render in paths.items():
+            latencies = []
+            payload = b''
+            for uri in uris:
+                started = time.perf_counter()
+                payload = render(uri)
+                latencies.append((time.perf_counter() - started) * 1000)
+            report[name] = {
+                'p50_ms': round(statistics.median(latencies), 3),
+                'p90_ms': round(percentile(latencies, 90), 3),
+                'max_ms': round(max(latencies), 3),
+                'bytes': len(payload),
+                'gzip_bytes': len(gzip.compress(payload)),
+            }
+
+        for uri in uris:
+            cache.delete(qr_cache_key(uri, 'svg'))
+        cache.delete(qr_cache_key(cached_uri, 'svg'))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{iterations} renders per path"))
+        self.stdout.write(f"{'path':<12}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}{'bytes':>9}{'gzip':>8}")
+        for name, row in report.items():
+            self.stdout.write(
+                f"{name:<12}{row['p50_ms']:>10}{row['p90_ms']:>10}{row['max_ms']:>10}{row['bytes']:>9}{row['gzip_bytes']:>8}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(report, fh, indent=2)
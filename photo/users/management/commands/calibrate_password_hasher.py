@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from users.hashing import calibrate_work_factor
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the password hasher on this machine and print the PASSWORD_HASH_WORK_FACTOR "
+        "that makes one hash take about PASSWORD_HASH_TARGET_MS. Run it on the production "
+        "hardware; existing passwords are rehashed at the new factor on their next login."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=int, default=settings.PASSWORD_HASH_TARGET_MS)
+        parser.add_argument('--hasher', help='Dotted path of a tunable hasher (default: PASSWORD_HASHER)')
+        parser.add_argument('--samples', type=int, default=3, help='Timed hashes per measurement')
+
+    def handle(self, *args, **options):
+        hasher = import_string(options['hasher'])() if options['hasher'] else get_hasher()
+        if not hasattr(hasher, 'scale_work_factor'):
+            raise CommandError(f"{type(hasher).__name__} has no tunable work factor; use one from users.hashing")
+
+        target = options['target_ms'] / 1000
+        current = hasher.get_work_factor()
+        work_factor, seconds = calibrate_work_factor(hasher, target, options['samples'])
+
+        self.stdout.write(f"{hasher.algorithm}: work factor {current} now, {work_factor} for ~{options['target_ms']} ms")
+        self.stdout.write(f"Measured {seconds * 1000:.0f} ms per hash at {work_factor}")
+        if work_factor == hasher.min_work_factor and seconds > target:
+            self.stderr.write(self.style.WARNING(
+                f"Target not reachable above the minimum work factor ({hasher.min_work_factor}); "
+                f"add hashing workers instead of lowering it"
+            ))
+        workers = settings.PASSWORD_HASH_WORKERS
+        self.stdout.write(f"With PASSWORD_HASH_WORKERS={workers}: about {workers / seconds:.1f} logins/s per process")
+        self.stdout.write(self.style.SUCCESS(f"PASSWORD_HASH_WORK_FACTOR={work_factor}"))
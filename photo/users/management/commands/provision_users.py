@@ -0,0 +1,60 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.provisioning import FORMATS, detect_format, provision_users, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Create accounts in bulk from a CSV (email,name[,password] header) or JSONL file, "
+        "validating and deduplicating rows and writing them with one bulk_create per chunk. "
+        "Rows without a password get an unusable one; --invite emails them a code to set it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, or - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension (CSV unless .jsonl)')
+        parser.add_argument('--invite', action='store_true', help='Email an invite code to accounts created without a password')
+        parser.add_argument('--chunk-size', type=int, help='Rows per bulk_create (default PROVISIONING_CHUNK_SIZE)')
+        parser.add_argument('--hash-workers', type=int, help='Threads hashing initial passwords (default: CPU count)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without writing anything')
+        parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        try:
+            fh = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with fh:
+            report = provision_users(
+                read_rows(fh, fmt),
+                invite=options['invite'],
+                chunk_size=options['chunk_size'],
+                hash_workers=options['hash_workers'],
+                dry_run=options['dry_run'],
+                progress=self.print_progress,
+            )
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['email'] or '-'}: {error['error']}")
+        if report['invalid'] > len(report['errors']):
+            self.stderr.write(f"... and {report['invalid'] - len(report['errors'])} more invalid rows")
+
+        verb = 'would be created' if report['dry_run'] else 'created'
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['rows']} rows: {report['created']} {verb}, {report['existing']} already existed, "
+            f"{report['duplicates']} duplicates, {report['invalid']} invalid, {report['invited']} to invite "
+            f"in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+        ))
+        if report['invite_job']:
+            self.stdout.write(f"Invites scheduled as job {report['invite_job']}; follow it with send_invites --status")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as out:
+                json.dump(report, out, indent=2)
+
+    def print_progress(self, report):
+        self.stdout.write(f"  {report['rows']} rows read, {report['created']} created, {report['rows_per_second']} rows/s")
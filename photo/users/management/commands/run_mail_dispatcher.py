@@ -0,0 +1,91 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from users.mail import OutboxMailQueue, get_mail_queue, send_batch
+
+
+logger = logging.getLogger('users')
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the mail in the EmailOutbox table (MAIL_QUEUE_BACKEND=users.mail.OutboxMailQueue). "
+        "Each dispatcher claims its own batches with SELECT ... SKIP LOCKED, so throughput "
+        "grows with the number running. Stops after the current batch on SIGTERM or Ctrl-C."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.MAIL_BATCH_SIZE)
+        parser.add_argument('--poll', type=float, default=settings.MAIL_OUTBOX_POLL,
+                            help='Seconds to wait when there is nothing to send')
+        parser.add_argument('--once', action='store_true', help='Exit when nothing is left to send')
+
+    def handle(self, *args, **options):
+        queue = get_mail_queue()
+        if not isinstance(queue, OutboxMailQueue):
+            raise CommandError(
+                f"MAIL_QUEUE_BACKEND is {settings.MAIL_QUEUE_BACKEND}; the dispatcher only sends "
+                f"from users.mail.OutboxMailQueue (other queues are drained by users.tasks.drain_mail_queue)"
+            )
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        connection = None
+        processed = 0
+        failures = 0  # consecutive connection failures, for the backoff
+        started = time.monotonic()
+        self.stdout.write(f"Mail dispatcher started (batches of {options['batch_size']})")
+        while not self.stopping:
+            # A long-running process has to expire its DB connections itself
+            close_old_connections()
+            batch = queue.pop_batch(options['batch_size'])
+            if not batch:
+                # Close the SMTP session while idle rather than let the server time it out
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+                continue
+
+            if connection is None:
+                connection = get_connection(fail_silently=False)
+                try:
+                    connection.open()
+                except Exception as e:
+                    # Release the claim now rather than when the lease runs out
+                    queue.requeue(batch)
+                    connection = None
+                    failures += 1
+                    queue.record(connection_errors_total=1)
+                    logger.warning(f"Mail dispatcher: cannot connect to the mail server: {e}")
+                    if options['once']:
+                        raise CommandError(f"Cannot connect to the mail server: {e}")
+                    time.sleep(min(settings.MAIL_RETRY_BACKOFF * 2 ** failures, 300))
+                    continue
+                failures = 0
+
+            failed = send_batch(connection, batch)
+            queue.requeue(failed)
+            processed += len(batch) - len(failed)
+            if failed:
+                # The session may be broken; start the next batch on a fresh one
+                connection.close()
+                connection = None
+
+        if connection is not None:
+            connection.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Mail dispatcher stopped: {processed} messages processed in {elapsed:.1f}s")
+
+    def stop(self, signum, frame):
+        self.stopping = True
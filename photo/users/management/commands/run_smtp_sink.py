@@ -0,0 +1,94 @@
+import socketserver
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    # Just enough SMTP for Django's smtp.EmailBackend; messages are counted, not kept
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 smtp-sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.wfile.write(b"250-smtp-sink\r\n250 8BITMIME\r\n")
+            elif command.startswith(('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP')):
+                if command.startswith('RCPT') and self.server.refuse and self.server.refuse in command.lower():
+                    self.reply("550 mailbox unavailable")
+                    continue
+                self.reply("250 OK")
+            elif command == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                self.server.count()
+                self.reply("250 OK queued")
+            elif command == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay=0.0, refuse=None):
+        super().__init__(address, SinkHandler)
+        self.delay = delay
+        self.refuse = refuse
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.messages += 1
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local SMTP stand-in that accepts and counts messages, for testing mail throughput "
+        "(e.g. send_invites) without a real server. Point Django at it with "
+        "EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend EMAIL_PORT=1025."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds to stall after each message, to mimic a slow server')
+        parser.add_argument('--refuse', help='Refuse recipients whose address contains this text')
+
+    def handle(self, *args, **options):
+        server = SinkServer((options['host'], options['port']), delay=options['delay'], refuse=options['refuse'])
+        self.stdout.write(f"SMTP sink on {options['host']}:{options['port']} (Ctrl-C to stop)")
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        last = 0
+        try:
+            while True:
+                time.sleep(5)
+                if server.messages != last:
+                    self.stdout.write(f"{server.messages} messages over {server.connections} connections")
+                    last = server.messages
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            self.stdout.write(f"{server.messages} messages over {server.connections} connections")
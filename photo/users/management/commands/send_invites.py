@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.invitations import INVITE_OTP_TYPES, invite_progress, start_invitations
+from users.models import User
+from users.provisioning import FORMATS, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Email invite codes to existing accounts listed in a CSV (email column) or JSONL file, "
+        "in chunks sent over one SMTP session each at INVITE_RATE messages per second. "
+        "Running it again with the same file resumes the job; --status JOB prints its progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='CSV or JSONL file of recipients')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--type', dest='otp_type', choices=INVITE_OTP_TYPES, default='reset_password',
+                            help='reset_password: set a password; login: sign in with the code')
+        parser.add_argument('--status', metavar='JOB', help='Print the progress of a job and exit')
+        parser.add_argument('--wait', action='store_true', help='Poll until the job has finished')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            job_id = options['status']
+        elif options['path']:
+            job_id = self.start(options)
+        else:
+            raise CommandError("Give a recipients file or --status JOB")
+
+        progress = self.print_progress(job_id)
+        while options['wait'] and not progress['complete']:
+            time.sleep(5)
+            progress = self.print_progress(job_id)
+
+    def start(self, options):
+        fmt = options['format'] or detect_format(options['path'])
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as fh:
+                emails = {
+                    str(row.get('email') or '').strip().lower()
+                    for _, row in read_rows(fh, fmt)
+                    if isinstance(row, dict)
+                }
+        except OSError as e:
+            raise CommandError(str(e))
+        emails.discard('')
+
+        # Only accounts that can use the code; checked in slices to keep IN lists short
+        listed = sorted(emails)
+        active = set()
+        for i in range(0, len(listed), 1000):
+            active.update(User.objects.filter(email__in=listed[i:i + 1000], is_active=True).values_list('email', flat=True))
+        if len(active) < len(emails):
+            self.stderr.write(f"Skipping {len(emails) - len(active)} addresses without an active account")
+
+        job_id = start_invitations(active, options['otp_type'])
+        self.stdout.write(f"Job {job_id}: {len(active)} recipients")
+        return job_id
+
+    def print_progress(self, job_id):
+        progress = invite_progress(job_id)
+        if progress is None:
+            raise CommandError(f"No invite job {job_id} (unknown or expired)")
+        rate = progress['sent'] / progress['seconds'] if progress['seconds'] else 0.0
+        line = (
+            f"Job {job_id}: {progress['sent']}/{progress['total']} sent, {progress['failed']} failed, "
+            f"{progress['chunks_done']}/{progress['chunks']} chunks, {rate:.1f} msg/s"
+        )
+        self.stdout.write(self.style.SUCCESS(line) if progress['complete'] else line)
+        for email in progress['failed_emails'] if progress['complete'] else []:
+            self.stderr.write(f"failed: {email}")
+        return progress
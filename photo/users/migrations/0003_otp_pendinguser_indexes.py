@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_google_authenticator_enabled_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['email', 'otp_type', 'code', 'is_used', 'created_at'], name='otp_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['created_at'], name='otp_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendinguser',
+            index=models.Index(fields=['otp_verified', 'created_at'], name='pendinguser_stale_idx'),
+        ),
+    ]
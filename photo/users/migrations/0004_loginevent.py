@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 09:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_otp_pendinguser_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_email', models.EmailField(max_length=254)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('device', models.CharField(blank=True, default='', max_length=255)),
+                ('method', models.CharField(choices=[('password', 'Password'), ('otp', 'OTP'), ('totp', 'Google Authenticator'), ('session', 'Session')], default='password', max_length=10)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_email', '-created_at'], name='loginevent_user_recent_idx')],
+            },
+        ),
+    ]
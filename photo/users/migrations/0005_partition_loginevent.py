@@ -0,0 +1,46 @@
+from datetime import date, datetime, timezone
+
+from django.db import migrations
+
+
+def month_after(day, months=1):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_login_events(apps, schema_editor):
+    # MySQL only: RANGE partitions per month on created_at. The partition key must be
+    # part of every unique key, so the primary key becomes (id, created_at).
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    # created_at is stored in UTC, so the bounds are UTC dates too
+    this_month = datetime.now(timezone.utc).date().replace(day=1)
+    partitions = []
+    for n in range(4):
+        start = month_after(this_month, n)
+        upper = month_after(start)
+        partitions.append(f"PARTITION p{start:%Y%m} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}'))")
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    schema_editor.execute("ALTER TABLE users_loginevent DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)")
+    schema_editor.execute(
+        "ALTER TABLE users_loginevent PARTITION BY RANGE (TO_DAYS(created_at)) (" + ", ".join(partitions) + ")"
+    )
+
+
+def unpartition_login_events(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute("ALTER TABLE users_loginevent REMOVE PARTITIONING")
+    schema_editor.execute("ALTER TABLE users_loginevent DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_loginevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_login_events, unpartition_login_events),
+    ]
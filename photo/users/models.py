@@ -4,6 +4,11 @@ from django.utils import timezone
 
 from datetime import timedelta
 
+from photo.db.routers import PRIMARY
+
+from . import hashing
+from .user_cache import invalidate_user, invalidate_users
+
 class OTP(models.Model):
     OTP_TYPE_CHOICES = [
         ('signup', 'Signup'),
@@ -17,6 +22,14 @@ class OTP(models.Model):
     is_used = models.BooleanField(default=False)
     otp_type = models.CharField(max_length=15, choices=OTP_TYPE_CHOICES, default='signup')
 
+    class Meta:
+        indexes = [
+            # filter(email=, otp_type=, code=, is_used=).latest('created_at')
+            models.Index(fields=['email', 'otp_type', 'code', 'is_used', 'created_at'], name='otp_lookup_idx'),
+            # created_at__lt range deletes in the cleanup task
+            models.Index(fields=['created_at'], name='otp_created_at_idx'),
+        ]
+
     def is_expired(self):
         return timezone.now() > self.created_at + timedelta(minutes=5)
 
@@ -30,11 +43,88 @@ class PendingUser(models.Model):
     otp_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # filter(otp_verified=False, created_at__lt=) in the cleanup task
+            models.Index(fields=['otp_verified', 'created_at'], name='pendinguser_stale_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
 
-class UserManager(BaseUserManager):
+class LoginEvent(models.Model):
+    # Append-only login history. On MySQL the table is RANGE-partitioned by month on
+    # created_at (see migration 0005 and users.login_history), so there is no FK to
+    # User (partitioned tables cannot have one) and old months are dropped whole.
+    METHOD_CHOICES = [
+        ('password', 'Password'),
+        ('otp', 'OTP'),
+        ('totp', 'Google Authenticator'),
+        ('session', 'Session'),
+    ]
+
+    user_email = models.EmailField()
+    created_at = models.DateTimeField(default=timezone.now)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    device = models.CharField(max_length=255, blank=True, default='')
+    method = models.CharField(max_length=10, choices=METHOD_CHOICES, default='password')
+
+    class Meta:
+        indexes = [
+            # "last N logins for user"
+            models.Index(fields=['user_email', '-created_at'], name='loginevent_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_email} @ {self.created_at} ({self.method})"
+
+
+class EmailOutbox(models.Model):
+    # Outgoing mail for users.mail.OutboxMailQueue. Rows are inserted in the
+    # request's transaction and claimed by run_mail_dispatcher processes, which
+    # push available_at forward as a lease while they send.
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # filter(status='pending', available_at__lte=).order_by('available_at') when claiming
+            models.Index(fields=['status', 'available_at'], name='outbox_claim_idx'),
+            # filter(status__in=, created_at__lt=) in the cleanup task
+            models.Index(fields=['status', 'created_at'], name='outbox_cleanup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{', '.join(self.to)}: {self.subject} ({self.status})"
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # No post_save for QuerySet.update() (nor aupdate() and bulk_update(), which
+        # call it), so drop the cached copies of the rows it changes here. Read the
+        # pks from the primary: a replica may not have the newest rows yet
+        pks = list(self.using(self._db or PRIMARY).values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        invalidate_users(pks)
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def create(self, *args, **kwargs):
         raise NotImplementedError("Use create_user() instead of create() to create a user.")
     
@@ -75,8 +165,9 @@ class UserManager(BaseUserManager):
         return self.create_user(email, name, password, **extra_fields)
     
     def get_by_natural_key(self, email):
-        # Retrieve the user by their email (natural key)
-        return self.get(email=email)
+        # Retrieve the user by their email (natural key). authenticate() checks the
+        # password on this row, so read the primary: a replica may still have the old hash
+        return self.db_manager(PRIMARY).get(email=email)
 
 class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(unique=True, primary_key=True)  # Set email as primary key
@@ -103,6 +194,17 @@ class User(AbstractBaseUser, PermissionsMixin):
     def create(self, *args, **kwargs):
         raise NotImplementedError("Use create_user() or save() instead of create() to create a user.")
 
+    # Hash on the bounded users.hashing pool instead of the request thread
+    def set_password(self, raw_password):
+        self.password = hashing.hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        return hashing.check_password(self, raw_password)
+
+    async def acheck_password(self, raw_password):
+        return await hashing.acheck_password(self, raw_password)
+
     def save(self, *args, **kwargs):
         # Check if this is a new user (i.e., the user does not already exist in the database)
         if not self.pk:  # `pk` is None for new objects
@@ -128,4 +230,7 @@ class User(AbstractBaseUser, PermissionsMixin):
                 self.set_password(self.password)
 
         # Call the original save method
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+        # Drop any cached copy used by JWTAuthCookie
+        invalidate_user(self.pk)
\ No newline at end of file
@@ -0,0 +1,204 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import OTP
+from .utils import load_backend, get_redis
+
+
+# Results of OTPStore.verify()
+OTP_VALID = 'valid'
+OTP_INVALID = 'invalid'
+OTP_EXPIRED = 'expired'
+
+OTP_TYPES = [choice for choice, _ in OTP.OTP_TYPE_CHOICES]
+
+
+def generate_otp_code():
+    return f"{random.randint(100000, 999999)}"
+
+
+class BaseOTPStore:
+    """
+    Issues and checks one-time codes. Issuing a code replaces any earlier code
+    of the same type for that email, and a code can only be verified once.
+    """
+
+    # True when issue() writes through the default database connection, so it
+    # commits or rolls back with the caller's transaction
+    transactional = False
+
+    def issue(self, email, otp_type='signup', code=None):
+        # Returns the code; ``code`` issues one generated earlier
+        raise NotImplementedError
+
+    def issue_many(self, emails, otp_type='signup'):
+        # {email: code}; backends override this with one bulk write
+        return {email: self.issue(email, otp_type) for email in emails}
+
+    def verify(self, email, code, otp_type='signup', consume=True):
+        # consume=False checks the code and leaves it usable, for a step that
+        # only validates it before a later step uses it
+        raise NotImplementedError
+
+    def discard(self, email, otp_type=None):
+        # Drop outstanding codes for this email (all types when otp_type is None)
+        raise NotImplementedError
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    # Keeps codes in the OTP table; expired rows are removed by the cleanup task
+    transactional = True
+
+    def issue(self, email, otp_type='signup', code=None):
+        code = code or generate_otp_code()
+        with transaction.atomic():
+            OTP.objects.filter(email=email, otp_type=otp_type).delete()
+            OTP.objects.create(email=email, code=code, otp_type=otp_type)
+        return code
+
+    def issue_many(self, emails, otp_type='signup'):
+        codes = {email: generate_otp_code() for email in emails}
+        with transaction.atomic():
+            OTP.objects.filter(email__in=list(codes), otp_type=otp_type).delete()
+            OTP.objects.bulk_create([OTP(email=email, code=code, otp_type=otp_type) for email, code in codes.items()])
+        return codes
+
+    def verify(self, email, code, otp_type='signup', consume=True):
+        try:
+            otp_obj = OTP.objects.filter(email=email, code=code, is_used=False, otp_type=otp_type).latest('created_at')
+        except OTP.DoesNotExist:
+            return OTP_INVALID
+
+        if otp_obj.is_expired():
+            otp_obj.delete()
+            return OTP_EXPIRED
+        if not consume:
+            return OTP_VALID
+
+        # Conditional update so two concurrent requests cannot both use the code
+        if not OTP.objects.filter(pk=otp_obj.pk, is_used=False).update(is_used=True):
+            return OTP_INVALID
+        return OTP_VALID
+
+    def discard(self, email, otp_type=None):
+        otps = OTP.objects.filter(email=email)
+        if otp_type:
+            otps = otps.filter(otp_type=otp_type)
+        otps.delete()
+
+
+class RedisOTPStore(BaseOTPStore):
+    # Codes live under otp:<type>:<email> and expire natively after OTP_TTL seconds.
+    # A copy under otp-issued:<type>:<email> outlives the code by another OTP_TTL,
+    # so a correct code entered late is reported as expired rather than wrong.
+
+    # Compare-and-delete in one step so a code can only be used once; ARGV[2]
+    # is '0' to only compare. 1: valid, 2: expired, 0: invalid
+    consume_script = """
+    local current = redis.call('get', KEYS[1])
+    if current == ARGV[1] then
+        if ARGV[2] == '1' then
+            redis.call('del', KEYS[1], KEYS[2])
+        end
+        return 1
+    end
+    if not current and redis.call('get', KEYS[2]) == ARGV[1] then
+        redis.call('del', KEYS[2])
+        return 2
+    end
+    return 0
+    """
+
+    def __init__(self):
+        self._consume = None
+
+    def key(self, email, otp_type):
+        return f"otp:{otp_type}:{email.lower()}"
+
+    def issued_key(self, email, otp_type):
+        return f"otp-issued:{otp_type}:{email.lower()}"
+
+    def store(self, pipe, email, otp_type, code):
+        pipe.set(self.key(email, otp_type), code, ex=settings.OTP_TTL)
+        pipe.set(self.issued_key(email, otp_type), code, ex=settings.OTP_TTL * 2)
+
+    def issue(self, email, otp_type='signup', code=None):
+        code = code or generate_otp_code()
+        pipe = get_redis().pipeline()
+        self.store(pipe, email, otp_type, code)
+        pipe.execute()
+        return code
+
+    def issue_many(self, emails, otp_type='signup'):
+        codes = {email: generate_otp_code() for email in emails}
+        pipe = get_redis().pipeline(transaction=False)
+        for email, code in codes.items():
+            self.store(pipe, email, otp_type, code)
+        pipe.execute()
+        return codes
+
+    def verify(self, email, code, otp_type='signup', consume=True):
+        if self._consume is None:
+            self._consume = get_redis().register_script(self.consume_script)
+        result = self._consume(
+            keys=[self.key(email, otp_type), self.issued_key(email, otp_type)],
+            args=[code, '1' if consume else '0'],
+        )
+        if result == 1:
+            return OTP_VALID
+        if result == 2:
+            return OTP_EXPIRED
+        return OTP_INVALID
+
+    def discard(self, email, otp_type=None):
+        types = [otp_type] if otp_type else OTP_TYPES
+        get_redis().delete(*[key for t in types for key in (self.key(email, t), self.issued_key(email, t))])
+
+
+class InMemoryOTPStore(BaseOTPStore):
+    # Process-local store for tests and benchmarks
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}
+
+    def issue(self, email, otp_type='signup', code=None):
+        code = code or generate_otp_code()
+        with self._lock:
+            self._codes[(otp_type, email.lower())] = (code, time.monotonic() + settings.OTP_TTL)
+        return code
+
+    def issue_many(self, emails, otp_type='signup'):
+        codes = {email: generate_otp_code() for email in emails}
+        expires = time.monotonic() + settings.OTP_TTL
+        with self._lock:
+            for email, code in codes.items():
+                self._codes[(otp_type, email.lower())] = (code, expires)
+        return codes
+
+    def verify(self, email, code, otp_type='signup', consume=True):
+        key = (otp_type, email.lower())
+        with self._lock:
+            stored = self._codes.get(key)
+            if stored is None or stored[0] != code:
+                return OTP_INVALID
+            expired = time.monotonic() > stored[1]
+            if consume or expired:
+                del self._codes[key]
+        if expired:
+            return OTP_EXPIRED
+        return OTP_VALID
+
+    def discard(self, email, otp_type=None):
+        types = [otp_type] if otp_type else OTP_TYPES
+        with self._lock:
+            for t in types:
+                self._codes.pop((t, email.lower()), None)
+
+
+def get_otp_store():
+    return load_backend(settings.OTP_STORE_BACKEND)
@@ -0,0 +1,190 @@
+"""
+Bulk account creation for onboarding whole cohorts: ``manage.py provision_users``
+and the admin-only ``/account/admin/provision/`` endpoint.
+
+Rows are validated and deduplicated, then written with one bulk_create per
+chunk, skipping User.save's per-row PendingUser lookup and password hash.
+Accounts get an unusable password and, optionally, an invite OTP for the
+password-reset flow, sent in bulk by users.invitations. Initial passwords (command only) are hashed in parallel
+on a local thread pool; hashlib releases the GIL, so every core is used.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import timezone
+
+from .invitations import start_invitations
+from .models import User, PendingUser
+from .user_cache import invalidate_users
+
+
+logger = logging.getLogger('users')
+
+EMAIL_DOMAIN = '@narayanagroup.com'
+FORMATS = ('csv', 'jsonl')
+# Per-row errors kept in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+
+
+def read_rows(lines, fmt):
+    """
+    Yield (line number, row) from an iterable of text lines. CSV needs an
+    ``email,name[,password]`` header; JSONL has one object per line. A JSONL
+    line that does not parse yields ``None`` so it is reported, not fatal.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {key.strip().lower(): value for key, value in row.items() if key}
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def clean_row(row, allow_passwords=True):
+    # Returns (email, name, password or None); raises ValidationError
+    if not isinstance(row, dict):
+        raise ValidationError("Not a valid JSON object")
+    for field in ('email', 'name', 'password'):
+        # JSONL values can be numbers, lists or objects; none of them is a valid field here
+        if row.get(field) is not None and not isinstance(row.get(field), str):
+            raise ValidationError(f"{field.capitalize()} must be a string")
+    email = (row.get('email') or '').strip().lower()
+    validate_email(email)
+    if not email.endswith(EMAIL_DOMAIN):
+        raise ValidationError(f"Email must be {EMAIL_DOMAIN} domain")
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise ValidationError("Name is required")
+    if len(name) > User._meta.get_field('name').max_length:
+        raise ValidationError("Name is too long")
+    password = row.get('password') or None
+    if password is not None and not allow_passwords:
+        raise ValidationError("Initial passwords are not accepted here; send invites instead")
+    return email, name, password
+
+
+class Provisioner:
+    def __init__(self, invite=False, allow_passwords=True, chunk_size=None, hash_workers=None, dry_run=False, progress=None):
+        self.invite = invite
+        self.allow_passwords = allow_passwords
+        self.chunk_size = chunk_size or settings.PROVISIONING_CHUNK_SIZE
+        self.hash_workers = hash_workers or os.cpu_count() or 1
+        self.dry_run = dry_run
+        self.progress = progress  # called with the report after every chunk
+        self.report = {
+            'rows': 0, 'created': 0, 'existing': 0, 'duplicates': 0, 'invalid': 0, 'invited': 0,
+            'errors': [], 'seconds': 0.0, 'rows_per_second': 0.0, 'dry_run': dry_run, 'invite_job': None,
+        }
+        self.invitees = []
+
+    def run(self, rows):
+        """
+        Provision ``rows`` of (line number, row) and return the report. With
+        dry_run the rows are validated and checked against existing users
+        only; 'created' then counts the accounts that would be created.
+        """
+        started = time.monotonic()
+        seen = set()
+        chunk = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix='provision-hash') as hasher:
+                for line, row in rows:
+                    self.report['rows'] += 1
+                    try:
+                        email, name, password = clean_row(row, self.allow_passwords)
+                    except ValidationError as e:
+                        self.reject(line, row, ' '.join(e.messages))
+                        continue
+                    if email in seen:
+                        self.report['duplicates'] += 1
+                        continue
+                    seen.add(email)
+                    chunk.append((email, name, password))
+                    if len(chunk) >= self.chunk_size:
+                        self.flush(chunk, hasher, started)
+                        chunk = []
+                if chunk:
+                    self.flush(chunk, hasher, started)
+        finally:
+            # Also when the run fails part way: a re-run counts the accounts already
+            # created as existing, so this is their only chance of an invite. One job
+            # for the whole run keeps it under INVITE_RATE and resumable by send_invites.
+            if self.invitees:
+                self.report['invite_job'] = start_invitations(self.invitees)
+                self.report['invited'] = len(self.invitees)
+        self.update_rate(started)
+        logger.info(
+            f"Provisioning: {self.report['created']} created, {self.report['existing']} existing, "
+            f"{self.report['duplicates']} duplicates, {self.report['invalid']} invalid in "
+            f"{self.report['seconds']:.1f}s ({self.report['rows_per_second']:.0f} rows/s)"
+        )
+        return self.report
+
+    def reject(self, line, row, message):
+        self.report['invalid'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            email = row.get('email') if isinstance(row, dict) else None
+            self.report['errors'].append({'line': line, 'email': email, 'error': message})
+
+    def existing_emails(self, emails):
+        return set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+
+    def flush(self, chunk, hasher, started):
+        existing = self.existing_emails([email for email, _, _ in chunk])
+        chunk = [row for row in chunk if row[0] not in existing]
+        created = {email for email, _, _ in chunk}
+
+        if chunk and not self.dry_run:
+            hashes = iter(hasher.map(make_password, [password for _, _, password in chunk if password]))
+            # Rows are told apart from ones a concurrent signup inserted by this exact timestamp
+            joined = timezone.now()
+            users = [
+                # make_password(None) is an unusable password and costs no hashing
+                User(email=email, name=name, password=next(hashes) if password else make_password(None), date_joined=joined)
+                for email, name, password in chunk
+            ]
+            emails = [user.email for user in users]
+            with transaction.atomic():
+                # A concurrent signup for the same email wins; its row is skipped here
+                User.objects.bulk_create(users, ignore_conflicts=True)
+                created = set(User.objects.filter(email__in=emails, date_joined=joined).values_list('email', flat=True))
+                PendingUser.objects.filter(email__in=created).delete()
+            # bulk_create skips User.save, which normally drops cached "no such user" lookups
+            invalidate_users(emails)
+
+            if self.invite:
+                self.invitees += [email for email, _, password in chunk if not password and email in created]
+
+        self.report['existing'] += len(existing) + len(chunk) - len(created)
+        self.report['created'] += len(created)
+        self.update_rate(started)
+        if self.progress:
+            self.progress(self.report)
+
+    def update_rate(self, started):
+        self.report['seconds'] = round(time.monotonic() - started, 3)
+        self.report['rows_per_second'] = round(self.report['rows'] / self.report['seconds'], 1) if self.report['seconds'] else 0.0
+
+
+def provision_users(rows, **options):
+    return Provisioner(**options).run(rows)
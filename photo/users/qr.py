@@ -0,0 +1,102 @@
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import qrcode
+from django.conf import settings
+from django.core.cache import cache
+
+
+QR_FORMATS = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+# Rendering is CPU bound; a small pool keeps a burst of registrations from
+# tying up every request thread
+_pool = ThreadPoolExecutor(max_workers=settings.QR_RENDER_WORKERS, thread_name_prefix='qr-render')
+# Renders queued or running at once; beyond this callers get QRBusy instead of waiting
+_slots = threading.BoundedSemaphore(settings.QR_RENDER_WORKERS + settings.QR_RENDER_QUEUE)
+
+
+class QRBusy(Exception):
+    pass
+
+
+def qr_matrix(data):
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def render_svg(data):
+    # One <path> of horizontal runs in module units; far smaller than qrcode's SVG factories
+    matrix = qr_matrix(data)
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+def render_png(data):
+    buffer = io.BytesIO()
+    qrcode.make(data).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'svg': render_svg,
+    'png': render_png,
+}
+
+
+def qr_digest(data):
+    # The provisioning URI embeds the secret, so a new secret means a new digest
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def qr_cache_key(data, fmt):
+    return f"qr:{fmt}:{qr_digest(data)}"
+
+
+def render_qr(data, fmt):
+    """
+    Render ``data`` as a QR code in ``fmt`` on the worker pool. Raises QRBusy
+    if the pool is saturated or the render does not finish in time.
+    """
+    if not _slots.acquire(blocking=False):
+        raise QRBusy
+    try:
+        future = _pool.submit(RENDERERS[fmt], data)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=settings.QR_RENDER_TIMEOUT)
+    except TimeoutError:
+        raise QRBusy
+
+
+def get_qr(data, fmt):
+    # Rendered images are cached by URI digest until the cache entry expires
+    key = qr_cache_key(data, fmt)
+    image = cache.get(key)
+    if image is None:
+        image = render_qr(data, fmt)
+        cache.set(key, image, settings.QR_CACHE_TTL)
+    return image
@@ -1,7 +1,7 @@
 from rest_framework import serializers
-from .models import User, OTP
-from django.core.validators import validate_email
-from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer, TokenRefreshSerializer as BaseTokenRefreshSerializer
+from .models import User, PendingUser
+from .tokens import RefreshToken
 
 class SignupSerializer(serializers.Serializer):
     name = serializers.CharField()
@@ -14,7 +14,7 @@ class SignupSerializer(serializers.Serializer):
         # Check if user already exists
         if User.objects.filter(email=value).exists():
             raise serializers.ValidationError("User with this email already exists, Please login.")
-        if OTP.objects.filter(email=value, is_used=1):
+        if PendingUser.objects.filter(email=value, otp_verified=True).exists():
             raise serializers.ValidationError("User already initiated singup process and their email is verified, Try log in.")
         return value
 
@@ -40,13 +40,7 @@ class LoginSerializer(serializers.Serializer):
     totp = serializers.CharField(required=False, write_only=True, max_length=6, allow_blank=True)
 
     def validate_email(self, value):
-        # 1. Check valid email format (redundant, but explicit)
-        try:
-            validate_email(value)
-        except DjangoValidationError:
-            raise serializers.ValidationError("Enter a valid email address.")
-
-        # 2. Check domain
+        # Format is already checked by EmailField; only the domain is left
         if not value.lower().endswith('@narayanagroup.com'):
             raise serializers.ValidationError("Email must be of @narayanagroup.com domain")
         return value
@@ -110,4 +104,13 @@ class GoogleAuthenticatorRegisterSerializer(serializers.Serializer):
         # Check if the user exists
         if not User.objects.filter(email=value).exists():
             raise serializers.ValidationError("User not found")
-        return value
\ No newline at end of file
+        return value
+
+
+# Token endpoints use the registry-backed RefreshToken (see SIMPLE_JWT in settings)
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    token_class = RefreshToken
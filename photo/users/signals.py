@@ -1,28 +1,49 @@
+import ipaddress
+
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
 from django.db.models.signals import post_delete
 from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
 from django.conf import settings
 
+from .token_registry import get_token_registry
+from .user_cache import invalidate_user
+
+
+
+def clean_ip(value):
+    # The address in canonical form, or None if it is not one that fits
+    # GenericIPAddressField (max_length 39)
+    try:
+        ip = str(ipaddress.ip_address(str(value).strip()))
+    except ValueError:
+        return None
+    return ip if len(ip) <= 39 else None
 
 
 def get_client_ip(request):
+    """
+    The client's address, for throttling and the login audit. Clients can send
+    any X-Forwarded-For they like, so it is only read behind TRUSTED_PROXY_COUNT
+    proxies, and then only the entry the outermost of them appended. Otherwise,
+    or if that entry is not an IP address, the peer address is used.
+    """
+    proxies = settings.TRUSTED_PROXY_COUNT
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0].strip()
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    if proxies and x_forwarded_for:
+        addresses = x_forwarded_for.split(',')
+        ip = clean_ip(addresses[-min(proxies, len(addresses))])
+        if ip:
+            return ip
+    return clean_ip(request.META.get('REMOTE_ADDR'))
 
 
 
 @receiver(user_logged_in)
 def update_login_info(sender, request, user, **kwargs):
-    ip = get_client_ip(request)
-    device = request.META.get('HTTP_USER_AGENT', '')
-    user.last_login_ip = ip
-    user.last_login_device = device
-    user.save(update_fields=['last_login_ip', 'last_login_device'])
+    # Buffered instead of saved here; see users.login_audit
+    from .login_audit import record_login
+    record_login(request, user)
 
 
 
@@ -31,7 +52,9 @@ def delete_user_tokens(sender, instance, **kwargs):
     """
     Deletes all tokens associated with a user when the user is deleted.
     """
+    invalidate_user(instance.pk)
     try:
+        get_token_registry().revoke_user(instance.pk)
         OutstandingToken.objects.filter(user=instance).delete()
         # print(f"Deleted all tokens for user: {instance.email}")
     except Exception as e:
@@ -1,8 +1,18 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
 from django.utils import timezone
 
-from .models import OTP, PendingUser
+from .cleanup import delete_in_batches
+from .invitations import send_chunk
+from .login_audit import get_login_audit_buffer, AUDIT_FIELDS
+from .login_history import ensure_future_partitions, drop_expired_partitions, ingest
+from .mail import OutboxMailQueue, get_mail_queue, retry_delay, send_batch
+from .models import OTP, EmailOutbox, PendingUser, User
+from .signals import clean_ip
+from .user_cache import invalidate_user
 
 from celery import shared_task
 
@@ -16,20 +26,136 @@ def cleanup_expired_otps_and_pending_users():
     pending_user_expiry_time = now - timedelta(hours=1)
 
     # Delete expired OTPs
-    OTP.objects.filter(created_at__lt=otp_expiry_time).delete()
+    otps = delete_in_batches(OTP.objects.filter(created_at__lt=otp_expiry_time), 'otp')
 
     # Delete stale PendingUsers who haven't verified OTP within 1 hour
-    PendingUser.objects.filter(otp_verified=False, created_at__lt=pending_user_expiry_time).delete()
+    pending_users = delete_in_batches(
+        PendingUser.objects.filter(otp_verified=False, created_at__lt=pending_user_expiry_time), 'pending_user'
+    )
+    return {'otp': otps, 'pending_user': pending_users}
 
 
 
+@shared_task
+def cleanup_mail_outbox():
+    # Pending rows are left alone however old; they are still to be sent
+    cutoff = timezone.now() - timedelta(seconds=settings.MAIL_OUTBOX_RETENTION)
+    stats = delete_in_batches(
+        EmailOutbox.objects.filter(status__in=['sent', 'failed'], created_at__lt=cutoff), 'email_outbox'
+    )
+    if stats['deleted']:
+        # Still part of OutboxMailQueue's enqueued_total
+        get_mail_queue().record(outbox_deleted_total=stats['deleted'])
+    return stats
+
+
 @shared_task
 def cleanup_expired_blacklist_tokens():
+    # Only has work to do with DatabaseTokenRegistry (or rows left from before the
+    # Redis registry); Redis expires registry entries on its own
     now = timezone.now()
-    # Delete blacklisted tokens whose outstanding token has expired
-    expired_tokens = OutstandingToken.objects.filter(expires_at__lt=now)
-    BlacklistedToken.objects.filter(token__in=expired_tokens).delete()
-    expired_tokens.delete()
+    # Delete expired outstanding tokens, and their blacklist entries first, by explicit id lists
+    # rather than a token__in=<subquery> delete
+    return delete_in_batches(
+        OutstandingToken.objects.filter(expires_at__lt=now),
+        'outstanding_token',
+        before_delete=lambda pks: BlacklistedToken.objects.filter(token_id__in=pks).delete(),
+    )
+
+
+@shared_task
+def flush_login_audit():
+    # The buffer only lets go of the entries once both writes have committed;
+    # if either fails they are flushed again next time
+    with get_login_audit_buffer().draining() as (pending, events):
+        # bulk_update writes the same columns for every object, so group users by
+        # which columns they have buffered values for
+        groups = {}
+        for email, fields in pending.items():
+            values = dict(fields)
+            if 'last_login' in values:
+                values['last_login'] = datetime.fromisoformat(values['last_login'])
+            if 'last_login_ip' in values:
+                # Entries buffered before IPs were validated must not fail the batch
+                values['last_login_ip'] = clean_ip(values['last_login_ip'])
+            columns = tuple(name for name in AUDIT_FIELDS if name in values)
+            groups.setdefault(columns, []).append(User(email=email, **{name: values[name] for name in columns}))
+
+        with transaction.atomic():
+            for columns, users in groups.items():
+                User.objects.bulk_update(users, columns, batch_size=500)
+            ingest(events)
+
+    for email in pending:
+        invalidate_user(email)
+    return len(pending)
+
+
+@shared_task
+def maintain_login_history_partitions():
+    added = ensure_future_partitions()
+    dropped = drop_expired_partitions()
+    return {'added': added, 'dropped': dropped}
+
+
+@shared_task(bind=True, max_retries=None)
+def drain_mail_queue(self):
+    queue = get_mail_queue()
+
+    # One SMTP connection for every batch in this run
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        queue.record(connection_errors_total=1)
+        raise self.retry(exc=e, countdown=min(settings.MAIL_RETRY_BACKOFF * 2 ** self.request.retries, 300))
+
+    # Let new enqueues schedule another drain while this one runs
+    queue.release_drain()
+
+    retry = []
+    try:
+        while True:
+            batch = queue.pop_batch(settings.MAIL_BATCH_SIZE)
+            if not batch:
+                break
+            failed = send_batch(connection, batch)
+            retry.extend(failed)
+            if failed:
+                # The session may be broken; go on over a fresh one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    queue.record(connection_errors_total=1)
+                    break
+    finally:
+        connection.close()
+
+    if retry:
+        queue.requeue(retry)
+        queue.record(retried_total=len(retry))
+        # By then every one of them is due again
+        attempts = max(item['attempts'] for item in retry)
+        drain_mail_queue.apply_async(countdown=retry_delay(attempts))
+
+
+@shared_task
+def sweep_mail_queue():
+    # Beat: a drain for RedisMailQueue batches whose drain died and retries
+    # nobody is waiting on; the outbox is polled by its dispatchers instead
+    queue = get_mail_queue()
+    if not isinstance(queue, OutboxMailQueue) and queue.depth():
+        drain_mail_queue.delay()
+
+
+@shared_task(bind=True, max_retries=settings.MAIL_MAX_RETRIES, acks_late=True)
+def send_invite_chunk(self, job_id, index, emails, otp_type):
+    # One chunk of a users.invitations job; retried when the SMTP server is unreachable
+    try:
+        send_chunk(job_id, index, emails, otp_type)
+    except OSError as e:  # smtplib.SMTPException is an OSError too
+        raise self.retry(exc=e, countdown=min(settings.MAIL_RETRY_BACKOFF * 2 ** self.request.retries, 300))
 
 
 
@@ -1,3 +1,887 @@
-from django.test import TestCase
+import re
+import smtplib
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pyotp
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.core import mail
+from django.db import DatabaseError, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from .auth_state import resolve_auth_state
+from .cleanup import delete_in_batches
+from .hashing import HashingBusy, HashPool, check_password
+from .invitations import CHECKPOINT_EVERY, chunk_key, send_chunk
+from .login_audit import get_login_audit_buffer, record_login
+from .login_history import ingest
+from .mail import enqueue_mail, get_mail_queue, send_batch, send_otp_mail, InMemoryMailQueue, OutboxMailQueue, RedisMailQueue
+from .models import EmailOutbox, LoginEvent, OTP, PendingUser, User
+from .otp_store import (
+    get_otp_store, DatabaseOTPStore, InMemoryOTPStore, RedisOTPStore, OTP_EXPIRED, OTP_INVALID, OTP_VALID,
+)
+from .provisioning import Provisioner, provision_users
+from .qr import render_qr
+from .signals import get_client_ip
+from .tasks import cleanup_mail_outbox, flush_login_audit
+from .token_registry import get_token_registry, DatabaseTokenRegistry, InMemoryTokenRegistry, RedisTokenRegistry
+from .totp import rotate_secret, verify_totp, TOTP_VALID, TOTP_REPLAYED
+from .utils import get_redis
+from .user_cache import get_cached_user, user_cache_key, missing_user_key
+
+
+# Run with: python manage.py test --settings=photo.settings_bench
+
+
+# Real hashers cost hundreds of milliseconds per call
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def make_user(email, password=None, **fields):
+    # Same path as a real signup: a verified PendingUser, then create_user
+    PendingUser.objects.create(email=email, name='Test User', otp_verified=True)
+    return User.objects.create_user(email, 'Test User', password, **fields)
+
+
+class CacheResetMixin:
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+@override_settings(TOTP_VALID_WINDOW=1)  # no failures when a step boundary falls mid-test
+class TOTPReplayTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('alice@narayanagroup.com')
+        self.secret = rotate_secret(self.user.email)
+
+    def test_code_is_accepted_once(self):
+        code = pyotp.TOTP(self.secret).now()
+        self.assertEqual(verify_totp(self.user.email, code), TOTP_VALID)
+        self.assertEqual(verify_totp(self.user.email, code), TOTP_REPLAYED)
+
+    def test_code_cannot_be_replayed_with_different_case(self):
+        code = pyotp.TOTP(self.secret).now()
+        self.assertEqual(verify_totp('alice@narayanagroup.com', code), TOTP_VALID)
+        self.assertEqual(verify_totp('Alice@NarayanaGroup.com', code), TOTP_REPLAYED)
+        self.assertEqual(verify_totp('ALICE@NARAYANAGROUP.COM', code), TOTP_REPLAYED)
+
+    def test_verify_view_rejects_replay_with_different_case(self):
+        code = pyotp.TOTP(self.secret).now()
+        url = reverse('users:google_auth_verify')
+        first = self.client.post(url, {'email': 'alice@narayanagroup.com', 'otp': code})
+        self.assertEqual(first.status_code, 200)
+        replay = self.client.post(url, {'email': 'Alice@narayanagroup.com', 'otp': code})
+        self.assertEqual(replay.status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class GoogleAuthQRTests(CacheResetMixin, TestCase):
+    url = reverse('users:google_auth_qr')
+
+    def setUp(self):
+        super().setUp()
+        make_user('gabe@narayanagroup.com', 'Correct-Horse-1')
+        self.client.post(reverse('users:login'), {'email': 'gabe@narayanagroup.com', 'password': 'Correct-Horse-1'})
+        self.renders = []
+
+        def render(data):
+            self.renders.append(data)
+            return b'<svg/>'
+
+        patcher = mock.patch.dict('users.qr.RENDERERS', {'svg': render})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def register(self):
+        response = self.client.post(reverse('users:google_auth_register'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['qr_code_url']
+
+    def test_image_is_cached_until_the_secret_changes(self):
+        first_url = self.register()
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'image/svg+xml')
+        self.assertTrue(first['Cache-Control'].startswith('private'))
+        self.assertEqual(self.client.get(self.url).content, b'<svg/>')
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': first['ETag']}).status_code, 304)
+
+        self.assertNotEqual(self.register(), first_url)
+        second = self.client.get(self.url)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(len(self.renders), 2)
+        self.assertNotEqual(self.renders[0], self.renders[1])
+
+    def test_saturated_pool_answers_503(self):
+        self.register()
+        started, release = threading.Event(), threading.Event()
+
+        def slow(data):
+            started.set()
+            release.wait(5)
+            return b'<svg/>'
+
+        # One slot: a render already running leaves no room to queue
+        with mock.patch('users.qr._slots', threading.BoundedSemaphore(1)), \
+                mock.patch.dict('users.qr.RENDERERS', {'svg': slow}):
+            worker = threading.Thread(target=render_qr, args=('otpauth://totp/other', 'svg'))
+            worker.start()
+            started.wait(5)
+            response = self.client.get(self.url)
+            release.set()
+            worker.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class UserCacheTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('dan@narayanagroup.com', 'OldPass123!')
+
+    def test_secrets_stay_out_of_the_cache(self):
+        User.objects.filter(pk=self.user.pk).update(google_authenticator_secret=pyotp.random_base32())
+        user = get_cached_user(self.user.email)
+        cached = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', cached)
+        self.assertNotIn('google_authenticator_secret', cached)
+        self.assertTrue(cached['is_active'])
+
+        # Deferred on the instance, and read from the database on access
+        self.assertEqual(user.get_deferred_fields(), {'password', 'google_authenticator_secret'})
+        self.assertTrue(user.password.startswith('md5$'))
+
+    def test_queryset_updates_invalidate(self):
+        get_cached_user(self.user.email)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertFalse(get_cached_user(self.user.email).is_active)
+
+        async_to_sync(User.objects.filter(pk=self.user.pk).aupdate)(is_active=True)
+        self.assertTrue(get_cached_user(self.user.email).is_active)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class PasswordLoginTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('bob@narayanagroup.com', 'OldPass123!')
+
+    def login(self, email, password):
+        return self.client.post(reverse('users:login'), {'email': email, 'password': password})
+
+    def test_old_password_rejected_while_cached_user_is_stale(self):
+        # Cache the user, then change the hash the way another process would
+        # (no invalidation reaches this process's LRU)
+        resolve_auth_state(self.user.email)
+        QuerySet.update(User.objects.filter(pk=self.user.pk), password=make_password('NewPass123!'))
+
+        self.assertEqual(self.login(self.user.email, 'OldPass123!').status_code, 400)
+        self.assertEqual(self.login(self.user.email, 'NewPass123!').status_code, 200)
+
+    def test_failed_login_sends_user_login_failed(self):
+        received = []
+        def receiver(sender, credentials, **kwargs):
+            received.append(credentials)
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+
+        self.assertEqual(self.login(self.user.email, 'wrong').status_code, 400)
+        self.assertEqual(len(received), 1)
+
+    def test_mixed_case_lookups_share_one_cache_entry(self):
+        get_cached_user('Bob@NarayanaGroup.com')
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+        self.user.set_password('NewPass123!')
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key('Bob@NarayanaGroup.com')))
+
+    def test_negative_lookup_is_forgotten_for_every_case(self):
+        email = 'carol@narayanagroup.com'
+        resolve_auth_state('Carol@narayanagroup.com')
+        self.assertTrue(cache.get(missing_user_key(email)))
+
+        make_user(email)
+        self.assertTrue(resolve_auth_state('Carol@narayanagroup.com').user_exists)
+
+
+class LoginAuditFlushTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('dave@narayanagroup.com')
+        self.factory = RequestFactory()
+        with get_login_audit_buffer().draining():
+            pass  # start from an empty buffer
+
+    def test_forwarded_for_that_is_not_an_ip_falls_back_to_remote_addr(self):
+        request = self.factory.post('/', HTTP_X_FORWARDED_FOR='x' * 100, REMOTE_ADDR='10.0.0.7')
+        self.assertEqual(get_client_ip(request), '10.0.0.7')
+
+    def test_failed_flush_keeps_buffered_logins(self):
+        request = self.factory.post('/', REMOTE_ADDR='10.0.0.8')
+        record_login(request, self.user, method='password')
+
+        with mock.patch('users.tasks.ingest', side_effect=DatabaseError('boom')):
+            with self.assertRaises(DatabaseError):
+                flush_login_audit()
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login_ip)
+
+        self.assertEqual(flush_login_audit(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_login_ip, '10.0.0.8')
+        self.assertEqual(LoginEvent.objects.filter(user_email=self.user.pk).count(), 1)
+
+    def test_invalid_buffered_ip_does_not_poison_the_batch(self):
+        get_login_audit_buffer().record(self.user.pk, last_login_ip='not-an-ip')
+        self.assertEqual(flush_login_audit(), 1)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login_ip)
+
+
+class LoginHistoryIngestTests(TestCase):
+    def event(self, **overrides):
+        return {
+            'user_email': 'erin@narayanagroup.com', 'created_at': timezone.now().isoformat(),
+            'ip': '10.0.0.9', 'device': 'test', 'method': 'password', **overrides,
+        }
+
+    def test_malformed_events_are_dropped_not_fatal(self):
+        events = [
+            self.event(),
+            self.event(method='carrier-pigeon'),
+            self.event(created_at='yesterday'),
+            self.event(ip='x' * 60),  # stored without the address
+            'not an event',
+        ]
+        self.assertEqual(ingest(events), 2)
+        self.assertEqual(LoginEvent.objects.count(), 2)
+        self.assertEqual(LoginEvent.objects.filter(ip__isnull=True).count(), 1)
+
+
+@override_settings(RATE_LIMITS={'login': {'ip': (3, 3600), 'email': (100, 3600)}})
+class LoginThrottleTests(CacheResetMixin, TestCase):
+    def post(self, url_name, **extra):
+        return self.client.post(reverse(url_name), {'email': 'frank@narayanagroup.com', 'otp': '000000'}, **extra)
+
+    def test_authenticator_verify_is_throttled(self):
+        statuses = [self.post('users:google_auth_verify').status_code for _ in range(4)]
+        self.assertNotEqual(statuses[2], 429)
+        self.assertEqual(statuses[3], 429)
+
+    def test_otp_verify_is_throttled(self):
+        statuses = [self.post('users:otp-verify').status_code for _ in range(4)]
+        self.assertEqual(statuses[3], 429)
+
+    def test_spoofed_forwarded_for_does_not_get_a_fresh_bucket(self):
+        statuses = [
+            self.post('users:google_auth_verify', HTTP_X_FORWARDED_FOR=f'203.0.113.{n}').status_code
+            for n in range(4)
+        ]
+        self.assertEqual(statuses[3], 429)
+
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_trusted_proxy_entry_is_used(self):
+        request = RequestFactory().post('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 198.51.100.7', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(get_client_ip(request), '198.51.100.7')
+
+
+@override_settings(MAIL_QUEUE_BACKEND='users.mail.OutboxMailQueue', MAIL_MAX_RETRIES=2, MAIL_RETRY_BACKOFF=5)
+class OutboxTests(CacheResetMixin, TestCase):
+    email = 'grace@narayanagroup.com'
+
+    def test_code_is_issued_with_its_message(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            code = send_otp_mail(self.email, 'login', "Subject", "Your code is {code}")
+        self.assertEqual(EmailOutbox.objects.get().body, f"Your code is {code}")
+        self.assertEqual(get_otp_store().verify(self.email, code, 'login'), OTP_VALID)
+
+    def test_rolled_back_request_leaves_neither_code_nor_message(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                code = send_otp_mail(self.email, 'login', "Subject", "Your code is {code}")
+                raise RuntimeError
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(get_otp_store().verify(self.email, code, 'login'), OTP_INVALID)
+
+    def test_claimed_batch_is_leased_until_acked(self):
+        queue = get_mail_queue()
+        enqueue_mail("Subject", "Body", [self.email])
+        batch = queue.pop_batch(10)
+        self.assertEqual([item['to'] for item in batch], [[self.email]])
+        self.assertEqual(queue.pop_batch(10), [])  # another dispatcher sees nothing
+
+        self.assertEqual(send_batch(mail.get_connection(), batch), [])
+        row = EmailOutbox.objects.get()
+        self.assertEqual(row.status, 'sent')
+        self.assertIsNotNone(row.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_sends_back_off_then_give_up(self):
+        queue = get_mail_queue()
+        enqueue_mail("Subject", "Body", [self.email])
+        connection = mock.Mock()
+        connection.send_messages.side_effect = smtplib.SMTPServerDisconnected('gone')
+
+        queue.requeue(send_batch(connection, queue.pop_batch(10)))
+        row = EmailOutbox.objects.get()
+        self.assertEqual((row.status, row.attempts), ('pending', 1))
+        self.assertIn('gone', row.last_error)
+        self.assertGreater(row.available_at, timezone.now())
+        self.assertEqual(queue.pop_batch(10), [])  # backing off
+
+        EmailOutbox.objects.update(available_at=timezone.now())
+        self.assertEqual(send_batch(connection, queue.pop_batch(10)), [])
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('failed', 2))
+
+    def test_enqueue_makes_no_redis_call(self):
+        queue = get_mail_queue()
+        before = queue.stats()['enqueued_total']
+        with mock.patch('users.mail.get_redis', side_effect=AssertionError('Redis used on enqueue')):
+            enqueue_mail("Subject", "Body", [self.email])
+            enqueue_mail("Subject", "Body", [self.email])
+        self.assertEqual(queue.stats()['enqueued_total'], before + 2)
+        # Still counted once cleanup has removed the rows
+        EmailOutbox.objects.update(status='sent', created_at=timezone.now() - timedelta(days=365))
+        with mock.patch.object(OutboxMailQueue, 'record') as record:
+            cleanup_mail_outbox()
+        self.assertFalse(EmailOutbox.objects.exists())
+        record.assert_called_once_with(outbox_deleted_total=2)
+        with mock.patch.object(RedisMailQueue, 'stats', return_value={'outbox_deleted_total': 2.0}):
+            self.assertEqual(queue.stats()['enqueued_total'], before + 2)
+
+
+class BatchedCleanupTests(CacheResetMixin, TestCase):
+    def make_rows(self, *otp_types, **fields):
+        return [
+            OTP.objects.create(email='old@narayanagroup.com', code='123456', otp_type=otp_type, **fields).pk
+            for otp_type in otp_types
+        ]
+
+    def test_rows_are_deleted_in_pages_and_others_kept(self):
+        self.make_rows(*['signup'] * 7)
+        kept = self.make_rows('login')
+        stats = delete_in_batches(OTP.objects.filter(otp_type='signup'), 'test', batch_size=3, sleep=0)
+
+        self.assertEqual((stats['deleted'], stats['batches']), (7, 3))
+        self.assertEqual(list(OTP.objects.values_list('pk', flat=True)), kept)
+        self.assertIsNone(cache.get('cleanup:test:last_pk'))
+
+    def test_killed_run_resumes_after_the_checkpoint(self):
+        pks = self.make_rows(*['signup'] * 6)
+        batches = []
+
+        def die_on_second_batch(batch):
+            batches.append(batch)
+            if len(batches) == 2:
+                raise RuntimeError('worker killed')
+
+        queryset = OTP.objects.filter(otp_type='signup')
+        with self.assertRaises(RuntimeError):
+            delete_in_batches(queryset, 'test', batch_size=2, sleep=0, before_delete=die_on_second_batch)
+        self.assertEqual(cache.get('cleanup:test:last_pk'), pks[1])
+
+        # Below the checkpoint, so the resumed run does not scan for it again
+        early = self.make_rows('signup', pk=pks[0])[0]
+        stats = delete_in_batches(queryset, 'test', batch_size=2, sleep=0)
+        self.assertEqual(stats['deleted'], 4)
+        self.assertEqual(list(OTP.objects.values_list('pk', flat=True)), [early])
+
+        # The finished run dropped its checkpoint; the next one starts from the beginning
+        self.assertEqual(delete_in_batches(queryset, 'test', batch_size=2, sleep=0)['deleted'], 1)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ProvisioningTests(CacheResetMixin, TestCase):
+    def rows(self, *rows):
+        return list(enumerate(rows, 1))
+
+    def test_creates_accounts_and_reports_them(self):
+        report = provision_users(self.rows(
+            {'email': 'Heidi@narayanagroup.com', 'name': 'Heidi', 'password': 'Initial123!'},
+            {'email': 'ivan@narayanagroup.com', 'name': 'Ivan'},
+            {'email': 'ivan@narayanagroup.com', 'name': 'Ivan again'},
+        ))
+        self.assertEqual((report['created'], report['duplicates'], report['invalid']), (2, 1, 0))
+        self.assertTrue(User.objects.get(pk='heidi@narayanagroup.com').check_password('Initial123!'))
+        self.assertFalse(User.objects.get(pk='ivan@narayanagroup.com').has_usable_password())
+
+    def test_values_that_are_not_strings_are_invalid_rows(self):
+        report = provision_users(self.rows(
+            {'email': 'judy@narayanagroup.com', 'name': 'Judy', 'password': 123},
+            {'email': 'ken@narayanagroup.com', 'name': ['Ken']},
+            {'email': ['leo@narayanagroup.com'], 'name': 'Leo'},
+            {'email': 'mia@narayanagroup.com', 'name': 'Mia'},
+        ))
+        self.assertEqual((report['created'], report['invalid']), (1, 3))
+        self.assertEqual(list(User.objects.values_list('email', flat=True)), ['mia@narayanagroup.com'])
+
+    def test_rows_lost_to_a_concurrent_signup_are_not_counted_or_invited(self):
+        make_user('nina@narayanagroup.com')
+        # As if the signup committed between the existence check and the insert
+        with mock.patch.object(Provisioner, 'existing_emails', return_value=set()), \
+                mock.patch('users.provisioning.start_invitations', return_value='job') as start:
+            report = Provisioner(invite=True).run(self.rows(
+                {'email': 'nina@narayanagroup.com', 'name': 'Nina'},
+                {'email': 'omar@narayanagroup.com', 'name': 'Omar'},
+            ))
+        self.assertEqual((report['created'], report['existing'], report['invited']), (1, 1, 1))
+        start.assert_called_once_with(['omar@narayanagroup.com'])
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS, OTP_STORE_BACKEND='users.otp_store.DatabaseOTPStore')
+    def test_provisioned_account_is_claimed_only_with_the_mailed_code(self):
+        provision_users(self.rows({'email': 'pia@narayanagroup.com', 'name': 'Pia'}))
+        url = reverse('users:password-reset')
+        self.client.post(url, {'email': 'pia@narayanagroup.com'})
+        code = read_otp('pia@narayanagroup.com')
+        wrong = '111111' if code != '111111' else '222222'
+
+        response = self.client.post(url, {'email': 'pia@narayanagroup.com', 'otp': wrong, 'password': 'Claimed-Pass-1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.get(pk='pia@narayanagroup.com').has_usable_password())
+
+        response = self.client.post(url, {'email': 'pia@narayanagroup.com', 'otp': code, 'password': 'Claimed-Pass-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(pk='pia@narayanagroup.com').check_password('Claimed-Pass-1'))
+
+
+@override_settings(INVITE_RATE=1_000_000)
+class InvitationTests(CacheResetMixin, TestCase):
+    def test_chunk_progress_is_saved_while_sending(self):
+        emails = [f'user{n}@narayanagroup.com' for n in range(CHECKPOINT_EVERY * 2 + 5)]
+        saved = []
+
+        def send_messages(messages):
+            # What a redelivered task would find if the worker died right now
+            saved.append(len((cache.get(chunk_key('job', 0)) or {'sent': []})['sent']))
+            return 1
+
+        connection = mock.Mock()
+        connection.send_messages.side_effect = send_messages
+        with mock.patch('users.invitations.get_connection', return_value=connection):
+            record = send_chunk('job', 0, emails, 'reset_password')
+
+        self.assertTrue(record['done'])
+        self.assertEqual(saved[CHECKPOINT_EVERY], CHECKPOINT_EVERY)
+        self.assertEqual(saved[-1], CHECKPOINT_EVERY * 2)
+
+    @override_settings(INVITE_RATE=50)
+    def test_chunks_running_at_once_share_the_rate(self):
+        # Two workers, 70 messages: the 50-token burst, then 20 more at 50/s
+        chunks = [[f'user{c}-{n}@narayanagroup.com' for n in range(35)] for c in range(2)]
+        started = time.monotonic()
+        with mock.patch('users.invitations.get_connection', return_value=mock.Mock()):
+            workers = [threading.Thread(target=send_chunk, args=('job', c, chunks[c], 'login')) for c in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+    def test_redelivered_chunk_skips_recipients_already_sent(self):
+        emails = [f'user{n}@narayanagroup.com' for n in range(5)]
+        cache.set(chunk_key('job', 0), {'sent': emails[:3], 'failed': [], 'done': False})
+        with mock.patch('users.invitations.get_connection', return_value=mail.get_connection()):
+            send_chunk('job', 0, emails, 'login')
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), emails[3:])
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+    def test_failed_provisioning_run_still_invites_created_accounts(self):
+        def rows():
+            yield 1, {'email': 'pat@narayanagroup.com', 'name': 'Pat'}
+            raise OSError('input went away')
+
+        with mock.patch('users.provisioning.start_invitations', return_value='job') as start:
+            with self.assertRaises(OSError):
+                Provisioner(invite=True, chunk_size=1).run(rows())
+        start.assert_called_once_with(['pat@narayanagroup.com'])
+
+
+def redis_available():
+    try:
+        return get_redis().ping()
+    except RedisError:
+        return False
+
+
+class OTPStoreContract:
+    # Behaviour every OTP_STORE_BACKEND must share; subclasses provide the store
+    # and a way to let a code's lifetime run out
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def expire(self, email, otp_type):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.email = 'otp-store@narayanagroup.com'
+        self.addCleanup(self.store.discard, self.email)
+
+    def test_code_is_valid_once(self):
+        code = self.store.issue(self.email)
+        self.assertEqual(self.store.verify(self.email, code), OTP_VALID)
+        self.assertEqual(self.store.verify(self.email, code), OTP_INVALID)
+
+    def test_wrong_code_and_type_are_invalid(self):
+        code = self.store.issue(self.email)
+        wrong = '000000' if code != '000000' else '111111'
+        self.assertEqual(self.store.verify(self.email, wrong), OTP_INVALID)
+        self.assertEqual(self.store.verify(self.email, code, 'login'), OTP_INVALID)
+        self.assertEqual(self.store.verify(self.email, code), OTP_VALID)
+
+    def test_check_without_consuming(self):
+        code = self.store.issue(self.email, 'reset_password')
+        self.assertEqual(self.store.verify(self.email, code, 'reset_password', consume=False), OTP_VALID)
+        self.assertEqual(self.store.verify(self.email, code, 'reset_password'), OTP_VALID)
+        self.assertEqual(self.store.verify(self.email, code, 'reset_password', consume=False), OTP_INVALID)
+
+    def test_reissue_replaces_earlier_code(self):
+        first = self.store.issue(self.email, code='123456')
+        second = self.store.issue(self.email, code='654321')
+        self.assertEqual(self.store.verify(self.email, first), OTP_INVALID)
+        self.assertEqual(self.store.verify(self.email, second), OTP_VALID)
+
+    def test_expired_code_is_reported_as_expired(self):
+        code = self.store.issue(self.email, 'login')
+        self.expire(self.email, 'login')
+        self.assertEqual(self.store.verify(self.email, code, 'login'), OTP_EXPIRED)
+        self.assertEqual(self.store.verify(self.email, code, 'login'), OTP_INVALID)
+
+    def test_discard_drops_all_types(self):
+        signup = self.store.issue(self.email)
+        login = self.store.issue(self.email, 'login')
+        self.store.discard(self.email)
+        self.assertEqual(self.store.verify(self.email, signup), OTP_INVALID)
+        self.assertEqual(self.store.verify(self.email, login, 'login'), OTP_INVALID)
+
+    def test_issue_many(self):
+        emails = [self.email, 'otp-store-2@narayanagroup.com']
+        self.addCleanup(self.store.discard, emails[1])
+        codes = self.store.issue_many(emails, 'reset_password')
+        for email in emails:
+            self.assertEqual(self.store.verify(email, codes[email], 'reset_password'), OTP_VALID)
+
+
+class DatabaseOTPStoreTests(OTPStoreContract, TestCase):
+    def make_store(self):
+        return DatabaseOTPStore()
+
+    def expire(self, email, otp_type):
+        OTP.objects.filter(email=email, otp_type=otp_type).update(created_at=timezone.now() - timedelta(hours=1))
+
+
+class InMemoryOTPStoreTests(OTPStoreContract, TestCase):
+    def make_store(self):
+        return InMemoryOTPStore()
+
+    def expire(self, email, otp_type):
+        code, _ = self.store._codes[(otp_type, email)]
+        self.store._codes[(otp_type, email)] = (code, time.monotonic() - 1)
+
+
+@skipUnless(redis_available(), 'needs a Redis server at REDIS_URL')
+class RedisOTPStoreTests(OTPStoreContract, TestCase):
+    def make_store(self):
+        return RedisOTPStore()
+
+    def expire(self, email, otp_type):
+        # What Redis does once OTP_TTL has passed
+        get_redis().delete(self.store.key(email, otp_type))
+
+
+@override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1, PASSWORD_HASH_TIMEOUT=0.2)
+class HashPoolTests(TestCase):
+    def setUp(self):
+        self.pool = HashPool()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self):
+        self.release.wait(5)
+        return 'done'
+
+    def test_full_queue_is_rejected(self):
+        running = self.pool.submit(self.block)
+        queued = self.pool.submit(self.block)
+        with self.assertRaises(HashingBusy):
+            self.pool.submit(self.block)
+        self.assertEqual(self.pool.stats.rejected, 1)
+
+        self.release.set()
+        self.assertEqual(running.result(5), 'done')
+        self.assertEqual(queued.result(5), 'done')
+        # The slots are given back, so the pool accepts work again
+        self.assertEqual(self.pool.run(lambda: 'again'), 'again')
+
+    def test_queued_hash_times_out_and_frees_its_slot(self):
+        running = self.pool.submit(self.block)
+        with self.assertRaises(HashingBusy):
+            self.pool.run(self.block)
+        self.assertEqual(self.pool.stats.timeouts, 1)
+        self.assertEqual(self.pool.stats.queued, 0)
+
+        self.release.set()
+        running.result(5)
+        self.assertEqual(self.pool.run(lambda: 'again'), 'again')
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS + ['django.contrib.auth.hashers.ScryptPasswordHasher'], PASSWORD_HASH_TIMEOUT=10)
+    def test_outdated_hash_is_upgraded_on_login(self):
+        user = make_user('rehash@narayanagroup.com')
+        user.password = make_password('Correct-Horse-1', hasher='scrypt')
+        user.save(update_fields=['password'])
+
+        self.assertTrue(check_password(user, 'Correct-Horse-1'))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('md5$'))
+        self.assertFalse(check_password(user, 'wrong'))
+
+
+class MailQueueContract:
+    # Claim, ack and retry behaviour shared by the Celery-drained queues
+
+    def make_queue(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.queue = self.make_queue()
+
+    def push(self, n):
+        for i in range(n):
+            self.queue.push({'subject': f'm{i}', 'body': '', 'from_email': 'a@b.c', 'to': ['x@y.z'], 'enqueued_at': 0, 'attempts': 0})
+
+    def test_batches_come_out_in_order(self):
+        self.push(3)
+        self.assertEqual([m['subject'] for m in self.queue.pop_batch(2)], ['m0', 'm1'])
+        self.assertEqual([m['subject'] for m in self.queue.pop_batch(2)], ['m2'])
+        self.assertEqual(self.queue.pop_batch(2), [])
+
+    @override_settings(MAIL_RETRY_BACKOFF=60)
+    def test_failed_message_waits_for_its_backoff(self):
+        self.push(1)
+        batch = self.queue.pop_batch(1)
+        batch[0]['attempts'] = 1
+        self.queue.requeue(batch)
+        self.assertEqual(self.queue.pop_batch(1), [])
+        self.assertEqual(self.queue.depth(), 1)
+
+    @override_settings(MAIL_RETRY_BACKOFF=0)
+    def test_failed_message_is_retried_once_due(self):
+        self.push(1)
+        batch = self.queue.pop_batch(1)
+        batch[0]['attempts'] = 1
+        self.queue.requeue(batch)
+        retried = self.queue.pop_batch(1)
+        self.assertEqual([m['attempts'] for m in retried], [1])
+        self.queue.ack(retried)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_pushes_are_counted(self):
+        self.push(2)
+        self.assertEqual(self.queue.stats()['enqueued_total'], 2)
+
+
+class InMemoryMailQueueTests(MailQueueContract, TestCase):
+    def make_queue(self):
+        return InMemoryMailQueue()
+
+
+@skipUnless(redis_available(), 'needs a Redis server at REDIS_URL')
+class RedisMailQueueTests(MailQueueContract, TestCase):
+    def make_queue(self):
+        queue = RedisMailQueue()
+        keys = [queue.queue_key, queue.processing_key, queue.delayed_key, queue.messages_key]
+        get_redis().delete(*keys)
+        self.addCleanup(get_redis().delete, *keys)
+        return queue
+
+    def test_unacked_batch_is_handed_out_again_after_its_lease(self):
+        self.push(1)
+        with override_settings(MAIL_OUTBOX_LEASE=0):
+            batch = self.queue.pop_batch(1)  # the drain dies before ack()
+        self.assertEqual(self.queue.pop_batch(1), batch)
+        self.queue.ack(batch)
+        self.assertEqual(self.queue.depth(), 0)
+
+
+@override_settings(MAIL_MAX_RETRIES=3)
+class SendBatchTests(TestCase):
+    def send_three(self, *outcomes):
+        queue = InMemoryMailQueue()
+        for n in range(3):
+            queue.push({'subject': f'm{n}', 'body': '', 'from_email': 'a@b.c', 'to': [f'user{n}@narayanagroup.com'], 'enqueued_at': 0, 'attempts': 0})
+        connection = mock.Mock()
+        connection.send_messages.side_effect = outcomes
+        with mock.patch('users.mail.get_mail_queue', return_value=queue):
+            failed = send_batch(connection, queue.pop_batch(10))
+        return connection.send_messages.call_count, [(item['subject'], item['attempts']) for item in failed]
+
+    def test_lost_connection_leaves_the_rest_untried(self):
+        calls, failed = self.send_three(1, smtplib.SMTPServerDisconnected('gone'))
+        self.assertEqual(calls, 2)
+        self.assertEqual(failed, [('m1', 1), ('m2', 0)])
+
+    def test_refused_recipient_does_not_end_the_batch(self):
+        calls, failed = self.send_three(smtplib.SMTPRecipientsRefused({'user0@narayanagroup.com': (550, b'no')}), 1, 1)
+        self.assertEqual(calls, 3)
+        self.assertEqual(failed, [('m0', 1)])
+
+
+def read_otp(email):
+    # The newest code mailed to this address
+    for message in reversed(mail.outbox):
+        if email in message.to:
+            return re.search(r'\b(\d{6})\b', message.body).group(1)
+    return None
+
+
+# Issued inside the request's transaction: on_commit never fires in a TestCase
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, OTP_STORE_BACKEND='users.otp_store.DatabaseOTPStore')
+class AsyncViewTests(CacheResetMixin, TestCase):
+    email = 'ivy@narayanagroup.com'
+    password = 'Correct-Horse-1'
+
+    async def post(self, view, **data):
+        return await self.async_client.post(reverse(f'users:async-{view}'), data, content_type='application/json')
+
+    async def test_signup_to_login(self):
+        self.assertEqual((await self.post('signup', name='Ivy', email=self.email)).status_code, 200)
+        response = await self.post('otp-verify', email=self.email, otp=read_otp(self.email))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.post('set-password', email=self.email, password=self.password)).status_code, 201)
+
+        response = await self.post('login', email=self.email, password=self.password)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access_token', response.cookies)
+        self.assertEqual((await self.post('login', email=self.email, password='wrong-password')).status_code, 400)
+
+    @override_settings(RATE_LIMITS={'otp': {'ip': (1, 3600), 'email': (1, 600)}, 'login': {'ip': (1, 300), 'email': (1, 300)}})
+    async def test_login_attempts_are_throttled(self):
+        await sync_to_async(make_user)(self.email, self.password)
+        self.assertEqual((await self.post('login', email=self.email, password='wrong-password')).status_code, 400)
+        response = await self.post('login', email=self.email, password=self.password)
+        self.assertEqual(response.status_code, 429)
+
+    async def test_saturated_hashing_pool_returns_503(self):
+        await sync_to_async(make_user)(self.email)
+        with mock.patch('users.async_views.ahash_password', side_effect=HashingBusy):
+            response = await self.post('password-reset', email=self.email, otp='123456', password=self.password)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    async def test_reset_needs_the_mailed_code(self):
+        await sync_to_async(make_user)(self.email, 'OldPass123!')
+        await self.post('password-reset', email=self.email)
+        code = read_otp(self.email)
+        wrong = '000000' if code != '000000' else '111111'
+
+        self.assertEqual((await self.post('password-reset', email=self.email, otp=wrong, password=self.password)).status_code, 400)
+        self.assertEqual((await self.post('password-reset', email=self.email, otp=code)).status_code, 200)
+        self.assertEqual((await self.post('password-reset', email=self.email, otp=code, password=self.password)).status_code, 200)
+        # Used up by the reset
+        self.assertEqual((await self.post('password-reset', email=self.email, otp=code, password='Another-Pass-2')).status_code, 400)
+
+        user = await User.objects.aget(pk=self.email)
+        self.assertTrue(await sync_to_async(user.check_password)(self.password))
+
+
+class TokenRegistryContract:
+    # Behaviour every TOKEN_REGISTRY_BACKEND must share
+
+    def make_registry(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        self.registry = self.make_registry()
+        self.user = make_user('quinn@narayanagroup.com')
+        self.other = make_user('ruth@narayanagroup.com')
+        self.exp = time.time() + 3600
+
+    def jti(self):
+        return uuid.uuid4().hex
+
+    def test_blacklisted_jti_is_refused(self):
+        jti, other = self.jti(), self.jti()
+        self.registry.outstand(jti, self.user.pk, self.exp)
+        self.registry.outstand(other, self.user.pk, self.exp)
+        self.registry.blacklist(jti, self.user.pk, self.exp)
+        self.assertTrue(self.registry.is_blacklisted(jti))
+        self.assertFalse(self.registry.is_blacklisted(other))
+
+    def test_unknown_jti_is_not_blacklisted(self):
+        self.assertFalse(self.registry.is_blacklisted(self.jti()))
+
+    def test_revoke_user_blacklists_only_that_users_tokens(self):
+        mine = [self.jti(), self.jti()]
+        theirs = self.jti()
+        for jti in mine:
+            self.registry.outstand(jti, self.user.pk, self.exp)
+        self.registry.outstand(theirs, self.other.pk, self.exp)
+
+        self.registry.revoke_user(self.user.pk)
+        self.assertTrue(all(self.registry.is_blacklisted(jti) for jti in mine))
+        self.assertFalse(self.registry.is_blacklisted(theirs))
+
+
+class InMemoryTokenRegistryTests(TokenRegistryContract, TestCase):
+    def make_registry(self):
+        return InMemoryTokenRegistry()
+
+
+class DatabaseTokenRegistryTests(TokenRegistryContract, TestCase):
+    def make_registry(self):
+        return DatabaseTokenRegistry()
+
+
+@skipUnless(redis_available(), 'needs a Redis server at REDIS_URL')
+class RedisTokenRegistryTests(TokenRegistryContract, TestCase):
+    def make_registry(self):
+        return RedisTokenRegistry()
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, TOKEN_REGISTRY_BACKEND='users.token_registry.InMemoryTokenRegistry')
+class TokenRefreshTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('sam@narayanagroup.com', 'Correct-Horse-1')
+        response = self.client.post(reverse('users:login'), {'email': self.user.email, 'password': 'Correct-Horse-1'})
+        self.refresh = response.cookies['refresh_token'].value
+
+    def refresh_with(self, token):
+        return self.client.post(reverse('users:token_refresh'), {'refresh': token})
+
+    def test_rotated_refresh_token_cannot_be_reused(self):
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        rotated = response.json()['refresh']
+
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+        self.assertEqual(self.refresh_with(rotated).status_code, 200)
+
+    def test_logout_blacklists_the_refresh_token(self):
+        self.assertEqual(self.client.post(reverse('users:logout')).status_code, 200)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
+
+    def test_revoked_user_tokens_are_refused(self):
+        get_token_registry().revoke_user(self.user.pk)
+        self.assertEqual(self.refresh_with(self.refresh).status_code, 401)
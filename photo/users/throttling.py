@@ -0,0 +1,86 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.throttling import BaseThrottle
+
+from .signals import get_client_ip
+
+
+def take_token(buckets):
+    """
+    Take one token from every bucket in ``buckets`` ({cache key: (capacity,
+    seconds to refill an empty bucket)}) or, if any is empty, from none.
+    Returns None when the tokens were taken, else the seconds until they can
+    be. All buckets are read with one get_many and written with one set_many.
+    Updates are not atomic; like DRF's own throttles, a few extra tokens can
+    be taken under heavy contention.
+    """
+    now = time.time()
+    states = cache.get_many(list(buckets))
+    updated = {}
+    waits = []
+    for key, (capacity, period) in buckets.items():
+        rate = capacity / period  # tokens per second
+        tokens, last = states.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * rate)
+        if tokens < 1:
+            waits.append((1 - tokens) / rate)
+        updated[key] = (tokens - 1, now)
+
+    if waits:
+        return max(waits)
+
+    cache.set_many(updated, timeout=max(math.ceil(period) for _, period in buckets.values()))
+    return None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token buckets kept in the shared cache, one per client IP and one per
+    submitted email. ``settings.RATE_LIMITS[scope]`` maps 'ip' / 'email' to
+    (capacity, seconds to refill an empty bucket). A request costs two cache
+    round trips (see take_token).
+    """
+    scope = None
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_email(self, request):
+        try:
+            email = request.data.get('email')
+        except Exception:
+            return None
+        return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+    def get_buckets(self, request):
+        limits = settings.RATE_LIMITS.get(self.scope, {})
+        idents = {'ip': get_client_ip(request), 'email': self.get_email(request)}
+        return {
+            f"throttle:{self.scope}:{kind}:{idents[kind]}": limits[kind]
+            for kind in ('ip', 'email')
+            if kind in limits and idents[kind]
+        }
+
+    def allow_request(self, request, view):
+        buckets = self.get_buckets(request)
+        if not buckets:
+            return True
+        self.wait_seconds = take_token(buckets)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class OTPRequestThrottle(TokenBucketThrottle):
+    # Anything that generates an OTP and sends an email
+    scope = 'otp'
+
+
+class LoginThrottle(TokenBucketThrottle):
+    # Password / OTP / TOTP checks
+    scope = 'login'
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .utils import load_backend, get_redis
+
+
+class BaseTokenRegistry:
+    """
+    Tracks issued (outstanding) and revoked (blacklisted) refresh token JTIs.
+    Every entry can be forgotten once the token's exp has passed.
+    """
+
+    def outstand(self, jti, user_id, exp, token=None):
+        raise NotImplementedError
+
+    def blacklist(self, jti, user_id, exp, token=None):
+        raise NotImplementedError
+
+    def is_blacklisted(self, jti):
+        raise NotImplementedError
+
+    def revoke_user(self, user_id):
+        # Blacklist every outstanding token of this user
+        raise NotImplementedError
+
+
+class RedisTokenRegistry(BaseTokenRegistry):
+    # token:outstanding:<jti> and token:blacklisted:<jti> expire with the token itself;
+    # token:user:<id> holds the user's JTIs so they can all be revoked at once
+
+    def ttl(self, exp):
+        return int(exp - time.time()) + 1
+
+    def outstand(self, jti, user_id, exp, token=None):
+        ttl = self.ttl(exp)
+        if ttl <= 0:
+            return
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.set(f"token:outstanding:{jti}", exp, ex=ttl)
+        if user_id is not None:
+            pipe.sadd(f"token:user:{user_id}", jti)
+            # Tokens share one lifetime, so the newest token always outlives the set's other members
+            pipe.expire(f"token:user:{user_id}", ttl)
+        pipe.execute()
+
+    def blacklist(self, jti, user_id, exp, token=None):
+        ttl = self.ttl(exp)
+        if ttl > 0:
+            get_redis().set(f"token:blacklisted:{jti}", 1, ex=ttl)
+
+    def is_blacklisted(self, jti):
+        return bool(get_redis().exists(f"token:blacklisted:{jti}"))
+
+    def revoke_user(self, user_id):
+        redis = get_redis()
+        jtis = [jti.decode() for jti in redis.smembers(f"token:user:{user_id}")]
+        if not jtis:
+            return
+        expiries = redis.mget([f"token:outstanding:{jti}" for jti in jtis])
+        pipe = redis.pipeline(transaction=False)
+        for jti, exp in zip(jtis, expiries):
+            if exp is not None:
+                pipe.set(f"token:blacklisted:{jti}", 1, ex=self.ttl(float(exp)))
+        pipe.delete(f"token:user:{user_id}")
+        pipe.execute()
+
+
+class DatabaseTokenRegistry(BaseTokenRegistry):
+    # Previous behaviour: OutstandingToken/BlacklistedToken rows from the token_blacklist app
+
+    def get_user(self, user_id):
+        User = get_user_model()
+        return User.objects.filter(pk=user_id).first() if user_id is not None else None
+
+    def outstand(self, jti, user_id, exp, token=None):
+        return OutstandingToken.objects.get_or_create(
+            jti=jti,
+            defaults={
+                'user': self.get_user(user_id),
+                'created_at': timezone.now(),
+                'token': token or '',
+                'expires_at': datetime_from_epoch(exp),
+            },
+        )[0]
+
+    def blacklist(self, jti, user_id, exp, token=None):
+        outstanding = self.outstand(jti, user_id, exp, token)
+        BlacklistedToken.objects.get_or_create(token=outstanding)
+
+    def is_blacklisted(self, jti):
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def revoke_user(self, user_id):
+        for outstanding in OutstandingToken.objects.filter(user_id=user_id, blacklistedtoken__isnull=True):
+            BlacklistedToken.objects.get_or_create(token=outstanding)
+
+
+class InMemoryTokenRegistry(BaseTokenRegistry):
+    # Process-local registry for tests and benchmarks
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outstanding = {}
+        self._blacklisted = {}
+
+    def outstand(self, jti, user_id, exp, token=None):
+        with self._lock:
+            self._outstanding[jti] = (user_id, exp)
+
+    def blacklist(self, jti, user_id, exp, token=None):
+        with self._lock:
+            self._blacklisted[jti] = exp
+
+    def is_blacklisted(self, jti):
+        with self._lock:
+            exp = self._blacklisted.get(jti)
+        return exp is not None and exp > time.time()
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for jti, (owner, exp) in self._outstanding.items():
+                if owner == user_id:
+                    self._blacklisted[jti] = exp
+
+
+def get_token_registry():
+    return load_backend(settings.TOKEN_REGISTRY_BACKEND)
@@ -0,0 +1,45 @@
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, Token, RefreshToken as BaseRefreshToken
+
+from .token_registry import get_token_registry
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    Refresh token whose outstanding/blacklist bookkeeping goes through the
+    configured token registry instead of the token_blacklist tables.
+    """
+
+    def verify(self, *args, **kwargs):
+        self.check_blacklist()
+        Token.verify(self, *args, **kwargs)
+
+    def check_blacklist(self):
+        if get_token_registry().is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def outstand(self):
+        get_token_registry().outstand(
+            self.payload[api_settings.JTI_CLAIM],
+            self.payload.get(api_settings.USER_ID_CLAIM),
+            self.payload['exp'],
+            token=str(self),
+        )
+
+    def blacklist(self):
+        get_token_registry().blacklist(
+            self.payload[api_settings.JTI_CLAIM],
+            self.payload.get(api_settings.USER_ID_CLAIM),
+            self.payload['exp'],
+            token=str(self),
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, which inserts an OutstandingToken row
+        token = super(BlacklistMixin, cls).for_user(user)
+        token.outstand()
+        return token
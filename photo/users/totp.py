@@ -0,0 +1,85 @@
+import time
+
+import pyotp
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from photo.db.routers import PRIMARY
+
+from .user_cache import canonical_user_id, invalidate_user, totp_secret_key
+
+
+# Results of verify_totp()
+TOTP_VALID = 'valid'
+TOTP_INVALID = 'invalid'
+TOTP_REPLAYED = 'replayed'
+TOTP_NOT_REGISTERED = 'not_registered'
+
+ISSUER = "N_IIT_RAW"
+
+
+def provisioning_uri(email, secret):
+    # otpauth:// URI that authenticator apps scan
+    return pyotp.TOTP(secret).provisioning_uri(name=email, issuer_name=ISSUER)
+
+
+def get_secret(email):
+    """
+    The user's authenticator secret ('' when none is registered), from the
+    shared cache when possible. Deliberately not read through the per-process
+    user LRU: right after a rotation every worker must see the new secret.
+    Raises User.DoesNotExist for unknown emails.
+    """
+    email = canonical_user_id(email)
+    key = totp_secret_key(email)
+    secret = cache.get(key)
+    if secret is None:
+        User = get_user_model()
+        # From the primary, like get_cached_user: the result is shared by every worker
+        rows = list(User.objects.using(PRIMARY).filter(pk=email).values_list('google_authenticator_secret', flat=True)[:1])
+        if not rows:
+            raise User.DoesNotExist
+        secret = rows[0] or ''
+        cache.set(key, secret, settings.USER_CACHE_TTL)
+    return secret
+
+
+def rotate_secret(email):
+    # New secret in one UPDATE; invalidate_user drops every cached copy of the old one
+    secret = pyotp.random_base32()
+    User = get_user_model()
+    if not User.objects.filter(pk=email).update(google_authenticator_secret=secret):
+        raise User.DoesNotExist
+    invalidate_user(email)
+    return secret
+
+
+def used_key(email, timestep):
+    # Canonical, so a used code cannot be replayed by changing the email's case
+    return f"totp:used:{canonical_user_id(email)}:{timestep}"
+
+
+def verify_totp(email, code):
+    """
+    Check ``code`` against the user's secret. A code is accepted at most once:
+    the matching (user, timestep) pair is claimed with cache.add() and stays
+    claimed until the step can no longer verify.
+    """
+    secret = get_secret(email)
+    if not secret:
+        return TOTP_NOT_REGISTERED
+
+    totp = pyotp.TOTP(secret)
+    now = time.time()
+    window = settings.TOTP_VALID_WINDOW
+    for offset in range(-window, window + 1):
+        at = now + offset * totp.interval
+        if pyotp.utils.strings_equal(str(code), totp.at(at)):
+            timestep = int(at // totp.interval)
+            ttl = totp.interval * (2 * window + 2)
+            if not cache.add(used_key(email, timestep), 1, ttl):
+                return TOTP_REPLAYED
+            return TOTP_VALID
+    return TOTP_INVALID
+
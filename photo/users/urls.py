@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import SignupView, OTPVerifyView, SetPasswordView, LoginView, LoginOTPRequestView, PasswordResetView, GoogleAuthenticatorRegisterView, GoogleAuthenticatorVerifyView, LogoutView, ProtectedPageView
+from . import async_views
+from .views import SignupView, OTPVerifyView, SetPasswordView, LoginView, LoginOTPRequestView, PasswordResetView, GoogleAuthenticatorRegisterView, GoogleAuthenticatorVerifyView, GoogleAuthenticatorQRView, LogoutView, ProtectedPageView, MailQueueStatsView, LoginHistoryView, ProvisionUsersView
 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -19,8 +20,21 @@ urlpatterns = [
 
     path('google-auth/register/', GoogleAuthenticatorRegisterView.as_view(), name='google_auth_register'),
     path('google-auth/verify/', GoogleAuthenticatorVerifyView.as_view(), name='google_auth_verify'),
+    path('google-auth/qr/', GoogleAuthenticatorQRView.as_view(), name='google_auth_qr'),
 
     path('protected/', ProtectedPageView.as_view(), name='protected'),
+
+    path('mail-queue/stats/', MailQueueStatsView.as_view(), name='mail_queue_stats'),
+    path('login-history/', LoginHistoryView.as_view(), name='login_history'),
+    path('admin/provision/', ProvisionUsersView.as_view(), name='provision_users'),
+
+    # Async versions of the account flow for ASGI deployments (users.async_views)
+    path('async/signup/', async_views.signup, name='async-signup'),
+    path('async/otp-verify/', async_views.otp_verify, name='async-otp-verify'),
+    path('async/set-password/', async_views.set_password, name='async-set-password'),
+    path('async/login/', async_views.login, name='async-login'),
+    path('async/login-otp-request/', async_views.login_otp_request, name='async-login-otp-request'),
+    path('async/password-reset/', async_views.password_reset, name='async-password-reset'),
 ]
 
     
\ No newline at end of file
@@ -0,0 +1,95 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from photo.db.routers import PRIMARY
+
+from .utils import LRUCache
+
+
+# Tier 1: per-process LRU, short TTL so other processes pick up changes quickly
+_local_users = LRUCache(maxsize=settings.USER_CACHE_LOCAL_SIZE, ttl=settings.USER_CACHE_LOCAL_TTL)
+
+# Validated access tokens, each kept until its own exp claim
+_validated_tokens = LRUCache(maxsize=settings.TOKEN_CACHE_SIZE)
+
+
+def canonical_user_id(user_id):
+    # MySQL compares emails case-insensitively, so 'Alice@…' and 'alice@…' are
+    # the same user; cache keys are built from one form so they are shared too
+    return str(user_id).strip().lower()
+
+
+def user_cache_key(user_id):
+    return f"user:fields:{canonical_user_id(user_id)}"
+
+
+# Never cached: on the users get_cached_user returns these are deferred, and
+# read from the primary only if something asks for them
+UNCACHED_FIELDS = ('password', 'google_authenticator_secret')
+
+
+def cached_field_names(User):
+    return [f.attname for f in User._meta.concrete_fields if f.attname not in UNCACHED_FIELDS]
+
+
+def get_cached_user(user_id):
+    """
+    Return the user with this primary key from the in-process LRU, then the
+    shared cache, then the database. Raises User.DoesNotExist like objects.get().
+    Both tiers hold a dict of field values without the password hash or the
+    authenticator secret, and every call builds a fresh instance from it.
+    Misses are read from the primary: a lagging replica would refill the shared
+    cache with the row as it was before the write that just invalidated it.
+    """
+    user_id = canonical_user_id(user_id)
+    User = get_user_model()
+    values = _local_users.get(user_id)
+    if values is None:
+        values = cache.get(user_cache_key(user_id))
+        if values is None:
+            values = User.objects.using(PRIMARY).values(*cached_field_names(User)).get(pk=user_id)
+            cache.set(user_cache_key(user_id), values, settings.USER_CACHE_TTL)
+        _local_users.set(user_id, values)
+    # Entries written before a field was added or removed still load; the rest is deferred
+    names = [name for name in cached_field_names(User) if name in values]
+    return User.from_db(PRIMARY, names, [values[name] for name in names])
+
+
+def missing_user_key(user_id):
+    # Negative lookups cached by users.auth_state
+    return f"user:missing:{canonical_user_id(user_id)}"
+
+
+def totp_secret_key(user_id):
+    # Authenticator secrets cached by users.totp
+    return f"user:totp_secret:{canonical_user_id(user_id)}"
+
+
+def invalidate_user(user_id):
+    _local_users.pop(canonical_user_id(user_id))
+    cache.delete_many([user_cache_key(user_id), missing_user_key(user_id), totp_secret_key(user_id)])
+
+
+def invalidate_users(user_ids):
+    # Bulk invalidate_user() with one cache round trip
+    keys = []
+    for user_id in user_ids:
+        _local_users.pop(canonical_user_id(user_id))
+        keys += [user_cache_key(user_id), missing_user_key(user_id), totp_secret_key(user_id)]
+    if keys:
+        cache.delete_many(keys)
+
+
+def get_cached_token(raw_token):
+    # Keyed by the full encoded token (which carries the jti), never by jti alone,
+    # so a forged token reusing a jti can never match
+    return _validated_tokens.get(raw_token)
+
+
+def remember_token(raw_token, validated_token):
+    ttl = validated_token['exp'] - time.time()
+    if ttl > 0:
+        _validated_tokens.set(raw_token, validated_token, ttl=ttl)
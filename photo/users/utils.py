@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import redis
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+@lru_cache(maxsize=None)
+def load_backend(path):
+    # One instance per backend class path and process
+    return import_string(path)()
+
+
+@lru_cache(maxsize=None)
+def _redis_client(url):
+    return redis.Redis.from_url(url)
+
+
+def get_redis():
+    # Shared client; redis-py pools connections and is safe across threads
+    return _redis_client(settings.REDIS_URL)
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU with per-entry expiry.
+    Used in front of the shared Django cache for very hot keys.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
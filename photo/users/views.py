@@ -1,34 +1,49 @@
 import io
-import qrcode
-import pyotp
-import base64
-import random
 import logging
+from itertools import islice
 
 
+from django.conf import settings
 from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import render
-from django.utils import timezone
-from django.utils.timezone import now
-from django.core.mail import send_mail
+from django.urls import reverse
 from django.contrib.auth import authenticate, logout
 
 
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
-
-from .models import User, OTP, PendingUser
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+
+from .auth_state import resolve_auth_state, forget_auth_state
+from .hashing import HashingBusy
+from .login_audit import record_login
+from .login_history import recent_logins
+from .mail import mail_queue_stats, send_otp_mail
+from .models import User, PendingUser
+from .otp_store import get_otp_store, OTP_VALID, OTP_EXPIRED
+from .provisioning import detect_format, provision_users, read_rows
+from .qr import QR_FORMATS, QRBusy, get_qr, qr_digest
+from .throttling import OTPRequestThrottle, LoginThrottle
+from .tokens import RefreshToken
+from .totp import get_secret, verify_totp, rotate_secret, provisioning_uri, TOTP_VALID, TOTP_REPLAYED, TOTP_NOT_REGISTERED
+from .user_cache import get_cached_user
 from .serializers import SignupSerializer, OTPVerifySerializer, SetPasswordSerializer, LoginSerializer, LoginOTPRequestSerializer, PasswordResetSerializer, GoogleAuthenticatorRegisterSerializer
 
 
 logger = logging.getLogger('users')
 
 
+def hashing_busy_response():
+    # The password hashing pool is saturated (users.hashing)
+    response = Response({"error": "Server busy, please retry."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = '1'
+    return response
+
 class SignupView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [OTPRequestThrottle]
 
     def post(self, request):
         serializer = SignupSerializer(data=request.data)
@@ -41,20 +56,14 @@ class SignupView(APIView):
                 email=email,
                 defaults={'name': name, 'otp_verified': False}
             )
+            forget_auth_state(email)
 
-            # Delete old OTPs for this email (invalidate previous OTPs)
-            OTP.objects.filter(email=email).delete()
-
-            # Generate new OTP
-            otp_code = f"{random.randint(100000, 999999)}"
-            OTP.objects.create(email=email, code=otp_code, created_at=timezone.now())
-
-            # Send OTP email (prints to console or real email)
-            send_mail(
+            # Generate new OTP (replaces any previous signup OTP for this email) and
+            # queue its email in the same transaction (sent by the mail dispatcher)
+            otp_code = send_otp_mail(
+                email, 'signup',
                 subject="Your OTP Code",
-                message=f"Your OTP code is {otp_code}. It will expire in 5 minutes.",
-                from_email='no-reply@narayanagroup.com',
-                recipient_list=[email],
+                message="Your OTP code is {code}. It will expire in 5 minutes.",
             )
 
             # Log OTP sent event (optional, see next steps)
@@ -68,6 +77,7 @@ class SignupView(APIView):
 
 class OTPVerifyView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginThrottle]  # guesses at a 6-digit code
 
     def post(self, request):
         serializer = OTPVerifySerializer(data=request.data)
@@ -83,25 +93,20 @@ class OTPVerifyView(APIView):
                 logger.warning(f"OTP verification failed: email {email} is not registered")
                 return Response({"error": "Email is not registered or invalid email"}, status=status.HTTP_400_BAD_REQUEST)
 
-            try:
-                otp_obj = OTP.objects.filter(email=email, code=otp_code, is_used=False).latest('created_at')
-            except OTP.DoesNotExist:
-                logger.warning(f"Invalid OTP attempt for {email}")
-                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
+            result = get_otp_store().verify(email, otp_code, 'signup')
 
-            if otp_obj.is_expired():
-                # OTP expired: cleanup OTP and PendingUser atomically
-                with transaction.atomic():
-                    otp_obj.delete()
-                    PendingUser.objects.filter(email=email).delete()
+            if result == OTP_EXPIRED:
+                # OTP expired (the store already dropped it): cleanup PendingUser
+                PendingUser.objects.filter(email=email).delete()
                 logger.error(f"OTP expired for {email}, pending user deleted")
                 return Response({"error": "OTP expired. Please click Resend OTP."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # OTP valid: mark used and mark PendingUser verified atomically
-            with transaction.atomic():
-                otp_obj.is_used = True
-                otp_obj.save()
+            if result != OTP_VALID:
+                logger.warning(f"Invalid OTP attempt for {email}")
+                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
 
+            # OTP valid (consumed by the store): mark PendingUser verified
+            with transaction.atomic():
                 try:
                     pending_user = PendingUser.objects.get(email=email)
                 except PendingUser.DoesNotExist:
@@ -146,12 +151,15 @@ class SetPasswordView(APIView):
 
             with transaction.atomic():
                 # Create the user
-                user = User.objects.create_user(email=email, name=pending_user.name, password=password)
+                try:
+                    user = User.objects.create_user(email=email, name=pending_user.name, password=password)
+                except HashingBusy:
+                    return hashing_busy_response()
                 logger.info(f"User created: {email}")
 
                 # Cleanup: delete pending user and all OTPs for this email
                 pending_user.delete()
-                OTP.objects.filter(email=email).delete()
+                get_otp_store().discard(email)
 
                 # Generate tokens
                 refresh = RefreshToken.for_user(user)
@@ -181,6 +189,7 @@ class SetPasswordView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -192,8 +201,11 @@ class LoginView(APIView):
         otp = serializer.validated_data.get('otp')
         totp = serializer.validated_data.get('totp')
 
-        user_exists = User.objects.filter(email=email).exists()
-        pending_user = PendingUser.objects.filter(email=email).first()
+        # One lookup (usually cached) shared by every branch below
+        state = resolve_auth_state(email)
+        user = state.user
+        user_exists = state.user_exists
+        pending_user = state.pending_user
 
         # Restrict login if user is not verified
         if not user_exists:
@@ -215,13 +227,18 @@ class LoginView(APIView):
         if password:
             if not user_exists:
                 return Response({"error": "User not found. Please sign up."}, status=status.HTTP_404_NOT_FOUND)
-            user = authenticate(request, email=email, password=password)
+            # Checked against a fresh row, never the cached user: a cached copy can
+            # still hold the hash from before a password reset. authenticate() also
+            # sends user_login_failed.
+            try:
+                user = authenticate(request, email=email, password=password)
+            except HashingBusy:
+                return hashing_busy_response()
             if user is None:
                 return Response({"error": "Incorrect password."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Update last_login here
-            user.last_login = now()
-            user.save(update_fields=['last_login'])
+            # Buffered; flushed to the User row by flush_login_audit
+            record_login(request, user, method='password')
 
             # Generate tokens
             refresh = RefreshToken.for_user(user)
@@ -249,26 +266,19 @@ class LoginView(APIView):
         if otp:
             if not user_exists:
                 return Response({"error": "User not found. Please sign up."}, status=status.HTTP_404_NOT_FOUND)
-            try:
-                otp_obj = OTP.objects.filter(email=email, code=otp, is_used=False, otp_type='login').latest('created_at')
-            except OTP.DoesNotExist:
-                logger.warning(f"Invalid login OTP attempt for {email}")
-                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
+            result = get_otp_store().verify(email, otp, 'login')
 
-            if otp_obj.is_expired():
-                with transaction.atomic():
-                    otp_obj.delete()
+            if result == OTP_EXPIRED:
                 logger.error(f"Login OTP expired for {email}")
                 return Response({"error": "OTP expired. Please request a new OTP."}, status=status.HTTP_400_BAD_REQUEST)
 
-            with transaction.atomic():
-                otp_obj.is_used = True
-                otp_obj.save()
-                user = User.objects.get(email=email)
+            if result != OTP_VALID:
+                logger.warning(f"Invalid login OTP attempt for {email}")
+                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
 
-                # Update last_login here
-                user.last_login = now()
-                user.save(update_fields=['last_login'])
+            with transaction.atomic():
+                # Buffered; flushed to the User row by flush_login_audit
+                record_login(request, user, method='otp')
 
                 # Generate tokens
                 refresh = RefreshToken.for_user(user)
@@ -296,14 +306,16 @@ class LoginView(APIView):
         if totp:
             if not user_exists:
                 return Response({"error": "User not found. Please sign up."}, status=status.HTTP_404_NOT_FOUND)
-            try:
-                user = User.objects.get(email=email)
-            except User.DoesNotExist:
-                return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
-            if not user.google_authenticator_secret:
+            result = verify_totp(email, totp)
+            if result == TOTP_NOT_REGISTERED:
                 return Response({"error": "Google Authenticator is not registered for this user"}, status=status.HTTP_400_BAD_REQUEST)
-            totp_obj = pyotp.TOTP(user.google_authenticator_secret)
-            if totp_obj.verify(totp):
+            if result == TOTP_REPLAYED:
+                logger.warning(f"Replayed Google Authenticator code for {email}")
+                return Response({"error": "This Google Authenticator code has already been used"}, status=status.HTTP_400_BAD_REQUEST)
+            if result == TOTP_VALID:
+                # Buffered; flushed to the User row by flush_login_audit
+                record_login(request, user, method='totp')
+
                 # Generate tokens
                 refresh = RefreshToken.for_user(user)
                 access_token = str(refresh.access_token)
@@ -332,6 +344,7 @@ class LoginView(APIView):
 
 class LoginOTPRequestView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [OTPRequestThrottle]
 
     def post(self, request):
         serializer = LoginOTPRequestSerializer(data=request.data)
@@ -342,19 +355,11 @@ class LoginOTPRequestView(APIView):
             if not User.objects.filter(email=email).exists():
                 return Response({"error": "User not found. Please sign up."}, status=status.HTTP_404_NOT_FOUND)
 
-            # Delete old login OTPs for this email
-            OTP.objects.filter(email=email, otp_type='login').delete()
-
-            # Generate new login OTP
-            otp_code = f"{random.randint(100000, 999999)}"
-            OTP.objects.create(email=email, code=otp_code, otp_type='login', created_at=timezone.now())
-
-            # Send OTP email
-            send_mail(
+            # Generate new login OTP (replaces old login OTPs for this email) and queue its email
+            otp_code = send_otp_mail(
+                email, 'login',
                 subject="Your Login OTP Code",
-                message=f"Your login OTP code is {otp_code}. It will expire in 5 minutes.",
-                from_email='no-reply@narayanagroup.com',
-                recipient_list=[email],
+                message="Your login OTP code is {code}. It will expire in 5 minutes.",
             )
 
             logger.info(f"Login OTP sent to {email}: {otp_code}")
@@ -367,6 +372,13 @@ class LoginOTPRequestView(APIView):
 class PasswordResetView(APIView):
     permission_classes = [AllowAny]
 
+    def get_throttles(self):
+        # Step 1 sends an OTP; steps 2 and 3 are guesses at one
+        data = self.request.data
+        if not data.get('otp') and not data.get('password'):
+            return [OTPRequestThrottle()]
+        return [LoginThrottle()]
+
     def post(self, request):
         serializer = PasswordResetSerializer(data=request.data)
         if not serializer.is_valid():
@@ -378,30 +390,23 @@ class PasswordResetView(APIView):
 
         if not otp and not password:
             # Step 1: Send OTP
-            OTP.objects.filter(email=email, otp_type='reset_password').delete()
-            otp_code = f"{random.randint(100000, 999999)}"
-            OTP.objects.create(email=email, code=otp_code, otp_type='reset_password', created_at=timezone.now())
-            send_mail(
+            send_otp_mail(
+                email, 'reset_password',
                 subject="Your Password Reset OTP",
-                message=f"Your password reset OTP is {otp_code}. It expires in 5 minutes.",
-                from_email='no-reply@narayanagroup.com',
-                recipient_list=[email],
+                message="Your password reset OTP is {code}. It expires in 5 minutes.",
             )
             return Response({"message": "Password reset OTP sent to your email"}, status=status.HTTP_200_OK)
 
         elif otp and not password:
-            # Step 2: Verify OTP
-            try:
-                otp_obj = OTP.objects.filter(email=email, code=otp, is_used=False, otp_type='reset_password').latest('created_at')
-            except OTP.DoesNotExist:
-                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
+            # Step 2: Verify OTP; left usable, since step 3 sends it again
+            result = get_otp_store().verify(email, otp, 'reset_password', consume=False)
 
-            if otp_obj.is_expired():
-                otp_obj.delete()
+            if result == OTP_EXPIRED:
                 return Response({"error": "OTP expired. Please request a new OTP."}, status=status.HTTP_400_BAD_REQUEST)
 
-            otp_obj.is_used = True
-            otp_obj.save()
+            if result != OTP_VALID:
+                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
+
             return Response({"message": "OTP verified. You can now reset your password."}, status=status.HTTP_200_OK)
 
         elif otp and password:
@@ -411,9 +416,20 @@ class PasswordResetView(APIView):
             except User.DoesNotExist:
                 return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
-            # Optional: Verify OTP again here or require fresh OTP verification before password reset
+            # Hash before using up the code, so a 503 from the hashing pool leaves it valid
+            try:
+                user.set_password(password)
+            except HashingBusy:
+                return hashing_busy_response()
+
+            # Provisioned accounts get their first password here: the code is all that
+            # proves the caller owns the mailbox
+            result = get_otp_store().verify(email, otp, 'reset_password')
+            if result == OTP_EXPIRED:
+                return Response({"error": "OTP expired. Please request a new OTP."}, status=status.HTTP_400_BAD_REQUEST)
+            if result != OTP_VALID:
+                return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
 
-            user.set_password(password)
             user.save()
             return Response({"message": "Password reset successful."}, status=status.HTTP_200_OK)
 
@@ -428,39 +444,61 @@ class GoogleAuthenticatorRegisterView(APIView):
     def post(self, request):
         email = request.user.email  # Use the authenticated user's email
 
-        # Fetch the user
+        # Generate and save a new secret key for Google Authenticator
         try:
-            user = User.objects.get(email=email)
+            secret = rotate_secret(email)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Generate a secret key for Google Authenticator
-        secret = pyotp.random_base32()
+        # The QR image itself is served (and cached) by GoogleAuthenticatorQRView;
+        # the digest in the query string changes with the secret so browsers refetch
+        otp_auth_url = provisioning_uri(email, secret)
+        qr_code_url = request.build_absolute_uri(reverse('users:google_auth_qr')) + f"?v={qr_digest(otp_auth_url)[:16]}"
 
-        # Save the secret key to the user's model
-        user.google_authenticator_secret = secret
-        user.save()
+        return Response({
+            "message": "Google Authenticator registration initiated",
+            "qr_code_url": qr_code_url  # Send only the QR code
+        }, status=status.HTTP_200_OK)
 
-        # Generate a QR code URL for Google Authenticator
-        totp = pyotp.TOTP(secret)
-        otp_auth_url = totp.provisioning_uri(name=email, issuer_name="N_IIT_RAW")
 
-        # Generate the QR code as an image
-        qr = qrcode.make(otp_auth_url)
-        buffer = io.BytesIO()
-        qr.save(buffer, format="PNG")
-        buffer.seek(0)
+class GoogleAuthenticatorQRView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        # Convert the QR code image to a base64-encoded data URL
-        qr_code_data_url = f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+    def get(self, request):
+        user = request.user
+        # Not user.google_authenticator_secret: request.user may predate a rotation
+        secret = get_secret(user.email)
+        if not secret:
+            return Response({"error": "Google Authenticator is not registered for this user"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Not ?format=, which DRF reserves for renderer selection
+        fmt = request.query_params.get('type', 'svg')
+        if fmt not in QR_FORMATS:
+            return Response({"error": f"type must be one of {', '.join(QR_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        otp_auth_url = provisioning_uri(user.email, secret)
+        etag = f'"{qr_digest(otp_auth_url)[:32]}-{fmt}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            try:
+                image = get_qr(otp_auth_url, fmt)
+            except QRBusy:
+                logger.warning(f"QR render pool saturated, rejecting request for {user.email}")
+                response = Response({"error": "Server busy, please retry."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+                response['Retry-After'] = '1'
+                return response
+            response = HttpResponse(image, content_type=QR_FORMATS[fmt])
+        # The image carries the TOTP secret: only the user's own browser may keep it
+        response['Cache-Control'] = f"private, max-age={settings.QR_CACHE_TTL}"
+        response['ETag'] = etag
+        response['Vary'] = 'Cookie'
+        return response
 
-        return Response({
-            "message": "Google Authenticator registration initiated",
-            "qr_code_url": qr_code_data_url  # Send only the QR code
-        }, status=status.HTTP_200_OK)
 
 class GoogleAuthenticatorVerifyView(APIView):
     permission_classes = [AllowAny]  # Allow access to everyone (no authentication required)
+    throttle_classes = [LoginThrottle]  # issues tokens for a valid code, so guesses are rate limited
 
     def post(self, request):
         # Get the email and OTP from the request
@@ -470,21 +508,22 @@ class GoogleAuthenticatorVerifyView(APIView):
         if not email or not otp:
             return Response({"error": "Email and OTP are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Fetch the user by email
+        # Fetch the user by email (cached; see users.user_cache)
         try:
-            user = User.objects.get(email=email)
+            user = get_cached_user(email)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if the user has Google Authenticator enabled
-        if not user.google_authenticator_secret:
-            return Response({"error": "Google Authenticator is not registered for this user"}, status=status.HTTP_400_BAD_REQUEST)
-
         # Verify the OTP
-        totp = pyotp.TOTP(user.google_authenticator_secret)
-        if totp.verify(otp):
+        result = verify_totp(email, otp)
+        if result == TOTP_NOT_REGISTERED:
+            return Response({"error": "Google Authenticator is not registered for this user"}, status=status.HTTP_400_BAD_REQUEST)
+        if result == TOTP_REPLAYED:
+            logger.warning(f"Replayed Google Authenticator code for {email}")
+            return Response({"error": "This Google Authenticator code has already been used"}, status=status.HTTP_400_BAD_REQUEST)
+        if result == TOTP_VALID:
+            record_login(request, user, method='totp')
             # OTP is valid, issue tokens or mark the user as logged in
-            from rest_framework_simplejwt.tokens import RefreshToken
             refresh = RefreshToken.for_user(user)
             return Response({
                 "message": "Google Authenticator verified",
@@ -522,4 +561,60 @@ class ProtectedPageView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        return render(request, 'login.html')
\ No newline at end of file
+        return render(request, 'login.html')
+
+
+class MailQueueStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(mail_queue_stats(), status=status.HTTP_200_OK)
+
+
+class LoginHistoryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"logins": recent_logins(request.user.email, limit=limit)}, status=status.HTTP_200_OK)
+
+
+class ProvisionUsersView(APIView):
+    """
+    Bulk account creation for admins: upload a CSV/JSONL ``file`` or post
+    ``{"users": [{"email": ..., "name": ...}, ...]}``; ``invite`` emails each
+    new account a code to set its password. Initial passwords are refused
+    here because hashing thousands of them would tie up a web worker.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        limit = settings.PROVISIONING_API_MAX_ROWS
+        upload = request.FILES.get('file')
+        if upload is not None:
+            lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            rows = read_rows(lines, request.data.get('format') or detect_format(upload.name))
+        elif isinstance(request.data.get('users'), list):
+            rows = enumerate(request.data['users'], 1)
+        else:
+            return Response({"error": "Upload a CSV/JSONL file or send a users list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            rows = list(islice(rows, limit + 1))
+        except (UnicodeDecodeError, ValueError) as e:
+            return Response({"error": f"Could not read file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > limit:
+            return Response({"error": f"At most {limit} rows per request; use manage.py provision_users"}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = provision_users(
+            rows,
+            invite=str(request.data.get('invite', '')).lower() in ('1', 'true', 'yes'),
+            dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes'),
+            allow_passwords=False,
+            hash_workers=1,
+        )
+        logger.info(f"{request.user.email} provisioned {report['created']} users via the API")
+        return Response(report, status=status.HTTP_200_OK)